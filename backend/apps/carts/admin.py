@@ -3,7 +3,7 @@ Admin interface cho Giỏ hàng
 """
 
 from django.contrib import admin
-from .models import Cart, CartItem
+from .models import Cart, CartItem, StockReservation
 
 
 class CartItemInline(admin.TabularInline):
@@ -98,3 +98,11 @@ class CartItemAdmin(admin.ModelAdmin):
     def total_price_display(self, obj):
         return f"{obj.get_total_price():,.0f} ₫"
     total_price_display.short_description = "Tổng tiền"
+
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ('holder', 'variant', 'quantity', 'expires_at')
+    list_filter = ('expires_at',)
+    search_fields = ('holder', 'variant__sku')
+    raw_id_fields = ('variant',)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class CartsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.carts'
+    
+    def ready(self):
+        """Initialize app: import signals"""
+        import apps.carts.signals  # noqa
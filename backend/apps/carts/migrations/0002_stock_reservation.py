@@ -0,0 +1,32 @@
+# Generated by Django 5.2.9 on 2026-10-17 03:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carts', '0001_initial'),
+        ('products', '0013_media_placeholders'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('holder', models.CharField(max_length=64, verbose_name='Giỏ hàng giữ hàng')),
+                ('quantity', models.PositiveIntegerField(verbose_name='Số lượng')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='Hết hạn lúc')),
+                ('variant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='products.productvariant', verbose_name='Biến thể sản phẩm')),
+            ],
+            options={
+                'verbose_name': 'Giữ hàng',
+                'verbose_name_plural': 'Giữ hàng',
+                'db_table': 'stock_reservations',
+                'indexes': [models.Index(fields=['variant', 'expires_at'], name='stock_reser_variant_67a11a_idx')],
+                'unique_together': {('holder', 'variant')},
+            },
+        ),
+    ]
@@ -111,3 +111,31 @@ class CartItem(models.Model):
         if not self.pk:  # New item
             self.price_at_addition = self.variant.get_display_price()
         super().save(*args, **kwargs)
+
+
+class StockReservation(models.Model):
+    """
+    Soft hold on stock for one cart line until expires_at (see reservations.py)
+    holder: "cart:<cart id>" for Cart rows, "guest:<session key>" for Redis carts
+    """
+    holder = models.CharField(max_length=64, verbose_name='Giỏ hàng giữ hàng')
+    variant = models.ForeignKey(
+        'products.ProductVariant',
+        on_delete=models.CASCADE,
+        related_name='reservations',
+        verbose_name='Biến thể sản phẩm'
+    )
+    quantity = models.PositiveIntegerField(verbose_name='Số lượng')
+    expires_at = models.DateTimeField(db_index=True, verbose_name='Hết hạn lúc')
+
+    class Meta:
+        db_table = 'stock_reservations'
+        verbose_name = 'Giữ hàng'
+        verbose_name_plural = 'Giữ hàng'
+        unique_together = [['holder', 'variant']]
+        indexes = [
+            models.Index(fields=['variant', 'expires_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.holder}: {self.variant_id} x{self.quantity}"
@@ -0,0 +1,120 @@
+"""
+Soft stock reservations - giữ hàng tạm thời cho giỏ hàng
+
+With CART_STOCK_RESERVATIONS on, every cart change reserves the line's
+quantity for CART_RESERVATION_TTL seconds (one StockReservation row per
+cart and variant; each change extends the whole cart). What other shoppers
+can add is the available-to-promise quantity:
+
+    available = variant.stock - active reservations of other carts
+
+Checkout converts the cart's reservations into the stock decrement (see
+OrderService.create_order) instead of re-validating every line under a
+row lock. Expired rows are ignored by every read and deleted in bulk by
+the reap_stock_reservations task.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from apps.products.models import ProductVariant
+from apps.products.signals import schedule_collection_invalidation, schedule_listing_refresh
+from .models import StockReservation
+
+
+def is_enabled():
+    return getattr(settings, 'CART_STOCK_RESERVATIONS', False)
+
+
+def get_ttl():
+    return getattr(settings, 'CART_RESERVATION_TTL', 15 * 60)
+
+
+def cart_holder(cart_id):
+    return f'cart:{cart_id}'
+
+
+def guest_holder(session_key):
+    return f'guest:{session_key}'
+
+
+def available_to_promise(variants, holder):
+    """{variant_id: stock minus other carts' active reservations} in one query"""
+    reserved = dict(
+        StockReservation.objects.filter(variant__in=variants, expires_at__gt=timezone.now())
+        .exclude(holder=holder)
+        .values('variant_id')
+        .annotate(total=Sum('quantity'))
+        .values_list('variant_id', 'total')
+    )
+    return {variant.pk: max(0, variant.stock - reserved.get(variant.pk, 0)) for variant in variants}
+
+
+def reserve(holder, quantities):
+    """
+    Hold {variant_id: cart quantity} (0 releases the line) and extend the
+    holder's other reservations to the same expiry
+    """
+    expires_at = timezone.now() + timedelta(seconds=get_ttl())
+    held = [
+        StockReservation(holder=holder, variant_id=variant_id, quantity=quantity, expires_at=expires_at)
+        for variant_id, quantity in quantities.items() if quantity
+    ]
+    released = [variant_id for variant_id, quantity in quantities.items() if not quantity]
+    if released:
+        StockReservation.objects.filter(holder=holder, variant_id__in=released).delete()
+    if held:
+        StockReservation.objects.bulk_create(
+            held, update_conflicts=True, unique_fields=['holder', 'variant'], update_fields=['quantity', 'expires_at'],
+        )
+    StockReservation.objects.filter(holder=holder).exclude(variant_id__in=quantities).update(expires_at=expires_at)
+
+
+def release(holders):
+    """Drop every reservation of these holders (cart cleared, cart merged at login)"""
+    StockReservation.objects.filter(holder__in=holders).delete()
+
+
+def convert(holder, quantities):
+    """
+    Turn the holder's active reservations into the stock decrement at
+    checkout (call inside the order transaction). Lines whose reservation
+    covers {variant_id: quantity} are decremented with one guarded UPDATE
+    each, no row lock or re-validation; returns their variant ids, the rest
+    go through the locked path. All of the holder's reservations are
+    dropped (rolled back with the order if checkout fails).
+
+    The UPDATE skips post_save, so the listing summaries and collection
+    caches of the touched products are refreshed on commit, as the variant
+    signals would.
+    """
+    now = timezone.now()
+    active = dict(
+        StockReservation.objects.filter(holder=holder, expires_at__gt=now).values_list('variant_id', 'quantity')
+    )
+    converted = set()
+    for variant_id, quantity in quantities.items():
+        if active.get(variant_id, 0) < quantity:
+            continue
+        # The guard only fails if stock was edited below the reservation
+        if ProductVariant.objects.filter(pk=variant_id, stock__gte=quantity).update(
+            stock=F('stock') - quantity, updated_at=now
+        ):
+            converted.add(variant_id)
+    StockReservation.objects.filter(holder=holder).delete()
+
+    if converted:
+        product_ids = ProductVariant.objects.filter(pk__in=converted).values_list('product_id', flat=True).distinct()
+        for product_id in product_ids:
+            schedule_listing_refresh(product_id)
+            schedule_collection_invalidation(product_id)
+    return converted
+
+
+def reap_expired():
+    """Delete expired reservations in one statement; returns how many"""
+    count, _ = StockReservation.objects.filter(expires_at__lte=timezone.now()).delete()
+    return count
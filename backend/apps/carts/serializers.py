@@ -3,14 +3,40 @@ Serializers cho Giỏ hàng - Cart Serializers
 """
 
 from rest_framework import serializers
-from .models import Cart, CartItem
+from .models import CartItem
 from apps.products.serializers import ProductVariantSerializer
 
 
+class CartVariantSerializer(ProductVariantSerializer):
+    """
+    Biến thể rút gọn cho dòng giỏ hàng: chỉ những gì trang giỏ hàng và
+    thanh toán hiển thị, cùng ảnh thumbnail (variant.cart_images đã được
+    prefetch, xem storage.variant_images)
+    """
+    
+    media = None
+    product_name = None
+    product_brand = None
+    thumbnail = serializers.SerializerMethodField()
+    
+    class Meta(ProductVariantSerializer.Meta):
+        fields = [
+            'id', 'sku', 'color', 'color_hex', 'material', 'lens_type', 'size',
+            'price', 'sale_price', 'display_price', 'is_on_sale', 'discount_percentage',
+            'stock', 'stock_status', 'is_active', 'thumbnail'
+        ]
+    
+    def get_thumbnail(self, obj):
+        for media in obj.cart_images:
+            if media.processed_images and media.processed_images.get('thumbnail'):
+                return media.processed_images['thumbnail']
+        return None
+
+
 class CartItemSerializer(serializers.ModelSerializer):
     """Serializer cho sản phẩm trong giỏ hàng"""
     
-    variant = ProductVariantSerializer(read_only=True)
+    variant = CartVariantSerializer(read_only=True)
     variant_id = serializers.IntegerField(write_only=True)
     total_price = serializers.DecimalField(
         source='get_total_price',
@@ -66,19 +92,40 @@ class CartItemSerializer(serializers.ModelSerializer):
         return data
 
 
-class CartSerializer(serializers.ModelSerializer):
-    """Serializer cho giỏ hàng"""
+class CartSerializer(serializers.Serializer):
+    """Serializer cho giỏ hàng (đọc từ CartSnapshot, xem storage.py)"""
     
+    id = serializers.UUIDField(read_only=True)
+    user = serializers.IntegerField(source='user_id', read_only=True)
+    session_key = serializers.CharField(read_only=True)
     items = CartItemSerializer(many=True, read_only=True)
-    total_items = serializers.IntegerField(source='get_total_items', read_only=True)
-    subtotal = serializers.DecimalField(
-        source='get_subtotal',
-        max_digits=10,
-        decimal_places=2,
-        read_only=True
-    )
+    total_items = serializers.IntegerField(read_only=True)
+    subtotal = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    created_at = serializers.DateTimeField(read_only=True)
+    updated_at = serializers.DateTimeField(read_only=True)
+
+
+class CartBatchOperationSerializer(serializers.Serializer):
+    """Một thao tác trong POST /cart/batch/ (giống add_item / update_item / remove_item)"""
     
-    class Meta:
-        model = Cart
-        fields = ['id', 'user', 'session_key', 'items', 'total_items', 'subtotal', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'user', 'session_key', 'created_at', 'updated_at']
+    op = serializers.ChoiceField(choices=['add', 'update', 'remove'])
+    variant_id = serializers.IntegerField(required=False)
+    item_id = serializers.IntegerField(required=False)
+    quantity = serializers.IntegerField(required=False, min_value=1)
+    
+    def validate(self, data):
+        if data['op'] == 'add':
+            if 'variant_id' not in data:
+                raise serializers.ValidationError({'variant_id': 'Vui lòng cung cấp variant_id.'})
+            data.setdefault('quantity', 1)
+        elif 'item_id' not in data:
+            raise serializers.ValidationError({'item_id': 'Vui lòng cung cấp item_id.'})
+        elif data['op'] == 'update' and 'quantity' not in data:
+            raise serializers.ValidationError({'quantity': 'Vui lòng cung cấp quantity.'})
+        return data
+
+
+class CartBatchSerializer(serializers.Serializer):
+    """Danh sách thao tác, áp dụng theo thứ tự"""
+    
+    operations = CartBatchOperationSerializer(many=True, allow_empty=False, max_length=50)
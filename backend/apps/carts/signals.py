@@ -0,0 +1,22 @@
+"""
+Cart signals - gộp giỏ hàng khách vào giỏ hàng người dùng khi đăng nhập
+"""
+
+from django.contrib.auth.signals import user_logged_in
+from django.dispatch import receiver
+
+from .storage import GUEST_SESSION_FIELD, guest_cart_key, promote_guest_cart
+
+
+@receiver(user_logged_in)
+def merge_guest_cart(sender, request, user, **kwargs):
+    """
+    Merge the session's guest cart once, at login (session login, and the
+    token LoginView which sends user_logged_in itself). Conflicts are left
+    on the request for the login response.
+    """
+    if request is None or not hasattr(request, 'session'):
+        return
+    # login() has already cycled the session key; the cart is under the old one
+    request.cart_merge_conflicts = promote_guest_cart(guest_cart_key(request.session), user)
+    request.session.pop(GUEST_SESSION_FIELD, None)
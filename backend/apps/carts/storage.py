@@ -0,0 +1,475 @@
+"""
+Cart storage - giỏ hàng khách trong Redis, giỏ hàng người dùng trong DB
+
+Guest carts live in a Redis hash per session (TTL-bound, refreshed on
+every write), so anonymous visitors, bots included, never create Cart or
+CartItem rows. Per variant the hash holds three fields, all updated
+atomically:
+
+    q:<variant_id>   quantity (HINCRBY)
+    p:<variant_id>   display price when first added
+    t:<variant_id>   time first added
+
+A guest cart is promoted to DB rows once, at login (user_logged_in, see
+signals.py; checkout requires login). Logged-in users keep using
+Cart/CartItem. While Redis is unreachable guests fall back to the old
+session-keyed Cart row; the first Redis-backed request afterwards folds it
+back into the hash, and promotion merges both in case it never came.
+"""
+
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+import time
+import uuid
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch, Q
+from django.utils import timezone
+from redis.exceptions import RedisError
+
+from config.redis_client import get_redis
+from apps.products.models import ProductMedia, ProductVariant
+from . import reservations
+from .models import Cart, CartItem
+
+logger = logging.getLogger(__name__)
+
+
+GUEST_KEY = 'carts:guest:{session_key}'
+
+# Session field remembering the key the guest cart was stored under:
+# django.contrib.auth.login() cycles the session key before user_logged_in
+GUEST_SESSION_FIELD = '_guest_cart_key'
+
+# Session flag: lines were written to a session-keyed Cart row while Redis was down
+GUEST_FALLBACK_FIELD = '_guest_cart_in_db'
+
+# Skip Redis for this long after a failure so every cart request does not wait on a timeout
+REDIS_RETRY_AFTER = 5.0
+
+_redis_down_until = 0.0
+
+
+def get_guest_ttl():
+    """Guest carts expire with the session by default"""
+    return getattr(settings, 'CART_GUEST_TTL', settings.SESSION_COOKIE_AGE)
+
+
+def redis_available():
+    return time.monotonic() >= _redis_down_until
+
+
+def mark_redis_down(error):
+    global _redis_down_until
+    _redis_down_until = time.monotonic() + REDIS_RETRY_AFTER
+    logger.warning(f"Redis unavailable for guest carts, using the database: {error}")
+
+
+class GuestCartItem:
+    """Redis cart line, shaped like CartItem for CartItemSerializer (id is the variant id)"""
+
+    def __init__(self, variant, quantity, price_at_addition, created_at):
+        self.id = variant.pk
+        self.variant = variant
+        self.quantity = quantity
+        self.price_at_addition = price_at_addition
+        self.created_at = created_at
+        self.updated_at = created_at
+
+    def get_total_price(self):
+        return self.variant.get_display_price() * self.quantity
+
+
+class CartSnapshot:
+    """
+    Read model for CartSerializer, the same for Cart rows and Redis carts:
+    lines come from one prefetch plan (see cart_lines / variant_images) and
+    the totals are summed in a single pass, so a read costs a fixed number
+    of queries however many lines the cart has
+    """
+
+    def __init__(self, cart_id, user_id, session_key, items, created_at, updated_at):
+        self.id = cart_id
+        self.user_id = user_id
+        self.session_key = session_key
+        self.items = items
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.total_items = 0
+        self.subtotal = Decimal('0')
+        for item in items:
+            self.total_items += item.quantity
+            self.subtotal += item.get_total_price()
+
+
+def variant_images(lookup='media'):
+    """Each variant's processed images in display order, as variant.cart_images"""
+    return Prefetch(
+        lookup,
+        queryset=ProductMedia.objects.filter(media_type='image', is_processed=True),
+        to_attr='cart_images',
+    )
+
+
+def cart_lines(cart):
+    """A Cart's items with variant and product joined and variant images prefetched (two queries)"""
+    return list(cart.items.select_related('variant__product').prefetch_related(variant_images('variant__media')))
+
+
+def _from_timestamp(value):
+    return datetime.fromtimestamp(float(value), tz=dt_timezone.utc)
+
+
+class DatabaseCartStore:
+    """Cart/CartItem rows (logged-in users, and guests while Redis is down)"""
+
+    def __init__(self, cart):
+        self.cart = cart
+        self.holder = reservations.cart_holder(cart.pk)
+
+    def get_cart(self):
+        cart = self.cart
+        return CartSnapshot(cart.pk, cart.user_id, cart.session_key, cart_lines(cart), cart.created_at, cart.updated_at)
+
+    def get_item(self, item_id):
+        return self.cart.items.select_related('variant__product').filter(pk=item_id).first()
+
+    def get_quantity(self, variant_id):
+        return self.cart.items.filter(variant_id=variant_id).values_list('quantity', flat=True).first() or 0
+
+    def add(self, variant, quantity):
+        cart_item = self.cart.items.filter(variant=variant).first()
+        if cart_item:
+            cart_item.quantity += quantity
+            cart_item.save()
+        else:
+            CartItem.objects.create(
+                cart=self.cart,
+                variant=variant,
+                quantity=quantity,
+                price_at_addition=variant.get_display_price()
+            )
+
+    def set_quantity(self, item, quantity):
+        item.quantity = quantity
+        item.save()
+
+    def remove(self, item):
+        item.delete()
+
+    def clear(self):
+        self.cart.clear()
+
+    def get_lines(self):
+        """{variant_id: (item id, quantity)}"""
+        return {
+            variant_id: (item_id, quantity)
+            for item_id, variant_id, quantity in self.cart.items.values_list('id', 'variant_id', 'quantity')
+        }
+
+    def apply(self, lines, quantities, variants):
+        """
+        Write {variant_id: new quantity} (0 removes the line) with one
+        bulk_update, one bulk_create and one delete; lines from get_lines()
+        """
+        now = timezone.now()
+        updated, created, removed = [], [], []
+        for variant_id, quantity in quantities.items():
+            item_id = lines[variant_id][0] if variant_id in lines else None
+            if not quantity:
+                removed.append(item_id)
+            elif item_id:
+                updated.append(CartItem(pk=item_id, quantity=quantity, updated_at=now))
+            else:
+                variant = variants[variant_id]
+                created.append(CartItem(
+                    cart=self.cart, variant=variant, quantity=quantity,
+                    price_at_addition=variant.get_display_price(),
+                ))
+
+        with transaction.atomic():
+            if updated:
+                CartItem.objects.bulk_update(updated, ['quantity', 'updated_at'])
+            if created:
+                CartItem.objects.bulk_create(created)
+            if removed:
+                CartItem.objects.filter(cart=self.cart, pk__in=removed).delete()
+
+
+class RedisGuestCartStore:
+    """Guest cart in one Redis hash (see module docstring)"""
+
+    def __init__(self, session_key):
+        self.session_key = session_key
+        self.key = GUEST_KEY.format(session_key=session_key) if session_key else None
+        self.holder = reservations.guest_holder(session_key)
+
+    def lines(self):
+        """{variant_id: (quantity, price, added timestamp)} and the last write time"""
+        if not self.key:
+            return {}, None
+        raw = {field.decode(): value.decode() for field, value in get_redis().hgetall(self.key).items()}
+        lines = {}
+        for field, value in raw.items():
+            if field.startswith('q:') and int(value) > 0:
+                variant_id = int(field[2:])
+                lines[variant_id] = (
+                    int(value),
+                    Decimal(raw.get(f'p:{variant_id}', '0')),
+                    float(raw.get(f't:{variant_id}', 0)),
+                )
+        return lines, raw.get('updated')
+
+    def get_cart(self):
+        lines, updated = self.lines()
+        variants = ProductVariant.objects.select_related('product').prefetch_related(variant_images()).in_bulk(lines)
+        items = [
+            GuestCartItem(variants[variant_id], quantity, price, _from_timestamp(added))
+            for variant_id, (quantity, price, added) in lines.items()
+            if variant_id in variants
+        ]
+        items.sort(key=lambda item: item.created_at, reverse=True)
+        updated_at = _from_timestamp(updated) if updated else None
+        return CartSnapshot(
+            uuid.uuid5(uuid.NAMESPACE_URL, f'guest-cart:{self.session_key}') if self.session_key else None,
+            None,
+            self.session_key,
+            items,
+            min((item.created_at for item in items), default=updated_at),
+            updated_at,
+        )
+
+    def get_item(self, item_id):
+        try:
+            variant_id = int(item_id)
+        except (TypeError, ValueError):
+            return None
+        lines, _ = self.lines()
+        if variant_id not in lines:
+            return None
+        variant = ProductVariant.objects.select_related('product').filter(pk=variant_id).first()
+        if variant is None:
+            return None
+        quantity, price, added = lines[variant_id]
+        return GuestCartItem(variant, quantity, price, _from_timestamp(added))
+
+    def get_quantity(self, variant_id):
+        if not self.key:
+            return 0
+        return int(get_redis().hget(self.key, f'q:{variant_id}') or 0)
+
+    def _write(self, pipe):
+        pipe.hset(self.key, 'updated', time.time())
+        pipe.expire(self.key, get_guest_ttl())
+        pipe.execute()
+
+    def add(self, variant, quantity):
+        pipe = get_redis().pipeline()
+        pipe.hincrby(self.key, f'q:{variant.pk}', quantity)
+        pipe.hsetnx(self.key, f'p:{variant.pk}', str(variant.get_display_price()))
+        pipe.hsetnx(self.key, f't:{variant.pk}', time.time())
+        self._write(pipe)
+
+    def set_quantity(self, item, quantity):
+        pipe = get_redis().pipeline()
+        pipe.hset(self.key, f'q:{item.variant.pk}', quantity)
+        self._write(pipe)
+
+    def remove(self, item):
+        pipe = get_redis().pipeline()
+        pipe.hdel(self.key, f'q:{item.variant.pk}', f'p:{item.variant.pk}', f't:{item.variant.pk}')
+        self._write(pipe)
+
+    def clear(self):
+        if self.key:
+            get_redis().delete(self.key)
+
+    def get_lines(self):
+        """{variant_id: (item id, quantity)}; the item id is the variant id"""
+        return {variant_id: (variant_id, quantity) for variant_id, (quantity, _, _) in self.lines()[0].items()}
+
+    def apply(self, lines, quantities, variants):
+        """Write {variant_id: new quantity} (0 removes the line) in one pipeline"""
+        pipe = get_redis().pipeline()
+        now = time.time()
+        for variant_id, quantity in quantities.items():
+            if not quantity:
+                pipe.hdel(self.key, f'q:{variant_id}', f'p:{variant_id}', f't:{variant_id}')
+                continue
+            pipe.hset(self.key, f'q:{variant_id}', quantity)
+            if variant_id not in lines:
+                pipe.hsetnx(self.key, f'p:{variant_id}', str(variants[variant_id].get_display_price()))
+                pipe.hsetnx(self.key, f't:{variant_id}', now)
+        self._write(pipe)
+
+
+def get_cart_store(request, create=True):
+    """
+    Store for the current visitor: the user's Cart rows, or the guest's
+    Redis cart. A guest session is only started when something is written
+    (create=True); reading an empty cart costs nothing.
+    """
+    if request.user.is_authenticated:
+        cart, _ = Cart.objects.get_or_create(user=request.user)
+        return DatabaseCartStore(cart)
+
+    session_key = request.session.session_key
+    if not session_key and create:
+        request.session.create()
+        session_key = request.session.session_key
+    if session_key and create:
+        request.session.setdefault(GUEST_SESSION_FIELD, session_key)
+
+    if redis_available():
+        store = RedisGuestCartStore(session_key)
+        if session_key and request.session.get(GUEST_FALLBACK_FIELD):
+            fold_fallback_cart(store)
+            del request.session[GUEST_FALLBACK_FIELD]
+        return store
+    if not session_key:
+        return RedisGuestCartStore(None)
+    cart, _ = Cart.objects.get_or_create(session_key=session_key)
+    request.session[GUEST_FALLBACK_FIELD] = True
+    return DatabaseCartStore(cart)
+
+
+def fold_fallback_cart(store):
+    """
+    Move the session-keyed Cart row written while Redis was down into the
+    guest's Redis hash (quantities added, capped at stock) and delete it,
+    so those lines do not vanish from the cart once Redis is back
+    """
+    cart = Cart.objects.filter(session_key=store.session_key, user__isnull=True).first()
+    if cart is None:
+        return
+
+    items = list(cart.items.select_related('variant'))
+    if items:
+        lines = store.get_lines()
+        quantities = {
+            item.variant_id: min(lines.get(item.variant_id, (None, 0))[1] + item.quantity, item.variant.stock)
+            for item in items
+        }
+        store.apply(lines, quantities, {item.variant_id: item.variant for item in items})
+        if reservations.is_enabled():
+            reservations.release([reservations.cart_holder(cart.pk)])
+            reservations.reserve(store.holder, quantities)
+    cart.delete()
+
+
+def guest_cart_key(session):
+    """Key of the session's guest cart, also after login() has cycled the session key"""
+    return session.get(GUEST_SESSION_FIELD) or session.session_key
+
+
+def promote_guest_cart(session_key, user):
+    """
+    Merge the session's guest cart (Redis, plus any session-keyed Cart row
+    from before or while Redis was down) into the user's cart at login;
+    returns the merge conflicts
+    """
+    if not session_key:
+        return []
+
+    lines = {}
+    guest = None
+    if redis_available():
+        try:
+            guest = RedisGuestCartStore(session_key)
+            for variant_id, (quantity, _, _) in guest.lines()[0].items():
+                lines[variant_id] = quantity
+        except RedisError as e:
+            mark_redis_down(e)
+            guest = None
+
+    user_cart, _ = Cart.objects.get_or_create(user=user)
+    # Both carts in one query: the user's items and the legacy guest row's
+    items = list(
+        CartItem.objects.filter(
+            Q(cart=user_cart) | Q(cart__session_key=session_key, cart__user__isnull=True)
+        ).select_related('variant')
+    )
+    existing, legacy_carts = {}, set()
+    for item in items:
+        if item.cart_id == user_cart.pk:
+            existing[item.variant_id] = item
+        else:
+            lines[item.variant_id] = lines.get(item.variant_id, 0) + item.quantity
+            legacy_carts.add(item.cart_id)
+    if not lines:
+        return []
+
+    conflicts = merge_into_cart(user_cart, lines, existing, {item.variant_id: item.variant for item in items})
+
+    if reservations.is_enabled():
+        # The guest's holds move to the merged lines of the user's cart
+        reservations.release(
+            [reservations.guest_holder(session_key)] + [reservations.cart_holder(pk) for pk in legacy_carts]
+        )
+        reservations.reserve(
+            reservations.cart_holder(user_cart.pk), dict(user_cart.items.values_list('variant_id', 'quantity'))
+        )
+
+    if legacy_carts:
+        Cart.objects.filter(pk__in=legacy_carts).delete()
+    if guest is not None:
+        try:
+            guest.clear()
+        except RedisError as e:
+            mark_redis_down(e)
+    return conflicts
+
+
+def merge_into_cart(user_cart, lines, existing, variants):
+    """
+    Add {variant_id: quantity} to the user's cart in memory, capped at stock,
+    then write it with one bulk_update and one bulk_create
+
+    existing: the user's CartItems by variant id; variants: ProductVariants
+    already loaded (the rest are fetched in one query). Returns the lines
+    that could not be added in full.
+    """
+    missing = [variant_id for variant_id in lines if variant_id not in variants]
+    if missing:
+        variants = {**variants, **ProductVariant.objects.in_bulk(missing)}
+
+    now = timezone.now()
+    conflicts, updated, created = [], [], []
+    for variant_id, requested in lines.items():
+        variant = variants.get(variant_id)
+        if variant is None or not variant.is_active:
+            conflicts.append({'variant_id': variant_id, 'requested': requested, 'added': 0, 'reason': 'unavailable'})
+            continue
+        item = existing.get(variant_id)
+        current = item.quantity if item else 0
+        added = max(0, min(requested, variant.stock - current))
+        if added < requested:
+            conflicts.append({
+                'variant_id': variant_id,
+                'requested': requested,
+                'added': added,
+                'reason': 'insufficient_stock' if added else 'cart_already_at_max_stock',
+            })
+        if not added:
+            continue
+        if item:
+            item.quantity = current + added
+            item.updated_at = now
+            updated.append(item)
+        else:
+            created.append(CartItem(
+                cart=user_cart, variant=variant, quantity=added,
+                price_at_addition=variant.get_display_price(),
+            ))
+
+    with transaction.atomic():
+        if updated:
+            CartItem.objects.bulk_update(updated, ['quantity', 'updated_at'])
+        if created:
+            CartItem.objects.bulk_create(created)
+
+    if conflicts:
+        logger.warning(f"Cart merge conflicts for user {user_cart.user_id}: {conflicts}")
+    return conflicts
@@ -0,0 +1,22 @@
+"""
+Celery tasks for carts
+"""
+
+from celery import shared_task
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(ignore_result=True)
+def reap_stock_reservations():
+    """
+    Periodic task: delete expired stock reservations in bulk
+    Scheduled via CELERY_BEAT_SCHEDULE every minute (reads already ignore them)
+    """
+    from apps.carts.reservations import reap_expired
+    
+    reaped = reap_expired()
+    if reaped:
+        logger.info(f"Reaped {reaped} expired stock reservations")
+    return reaped
@@ -1,3 +1,467 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from unittest.mock import patch
+from redis.exceptions import RedisError
+from apps.products.models import Category, Product, ProductListingSummary, ProductMedia, ProductVariant
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from datetime import timedelta
+from apps.orders.services import OrderService
+from . import reservations, storage
+from .models import Cart, CartItem, StockReservation
 
-# Create your tests here.
+User = get_user_model()
+
+
+class FakeRedis:
+    """Just the hash commands the guest cart store uses"""
+
+    def __init__(self):
+        self.data = {}
+        self.ttl = {}
+
+    def _hash(self, key):
+        return self.data.setdefault(key, {})
+
+    def hgetall(self, key):
+        return {f.encode(): str(v).encode() for f, v in self.data.get(key, {}).items()}
+
+    def hget(self, key, field):
+        value = self.data.get(key, {}).get(field)
+        return None if value is None else str(value).encode()
+
+    def hincrby(self, key, field, amount):
+        hash_ = self._hash(key)
+        hash_[field] = int(hash_.get(field, 0)) + amount
+        return hash_[field]
+
+    def hsetnx(self, key, field, value):
+        self._hash(key).setdefault(field, value)
+
+    def hset(self, key, field, value):
+        self._hash(key)[field] = value
+
+    def hdel(self, key, *fields):
+        for field in fields:
+            self.data.get(key, {}).pop(field, None)
+
+    def expire(self, key, seconds):
+        self.ttl[key] = seconds
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        return lambda *args: self.commands.append((name, args))
+
+    def execute(self):
+        return [getattr(self.client, name)(*args) for name, args in self.commands]
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class GuestCartStorageTest(TestCase):
+    """Guest carts in Redis, promoted to Cart rows at login (apps.carts.storage)"""
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = patch('apps.carts.storage.get_redis', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        storage._redis_down_until = 0.0
+
+        self.client = APIClient()
+        category = Category.objects.create(name='Sunglasses')
+        product = Product.objects.create(
+            name='Aviator', brand='Ray-Ban', category=category, base_price='100.00',
+            short_description='Short', description='Desc',
+        )
+        self.black = ProductVariant.objects.create(
+            product=product, sku='AV-BLK', color='Black', size='M', price='700000.00', stock=5,
+        )
+        self.gold = ProductVariant.objects.create(
+            product=product, sku='AV-GLD', color='Gold', size='L', price='900000.00', stock=2,
+        )
+
+    def _add(self, variant, quantity):
+        return self.client.post(
+            reverse('cart-add-item'), {'variant_id': variant.pk, 'quantity': quantity}, format='json'
+        )
+
+    def test_anonymous_read_creates_nothing(self):
+        response = self.client.get(reverse('cart-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['items'], [])
+        self.assertEqual(Cart.objects.count(), 0)
+        self.assertEqual(self.redis.data, {})
+
+    def test_guest_cart_lives_in_redis(self):
+        self.assertEqual(self._add(self.black, 2).status_code, status.HTTP_201_CREATED)
+        response = self._add(self.black, 1)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['total_items'], 3)
+        self.assertEqual(response.data['items'][0]['product_name'], 'Aviator')
+        self.assertEqual(response.data['items'][0]['variant']['sku'], 'AV-BLK')
+        self.assertEqual(Cart.objects.count(), 0)
+        self.assertEqual(CartItem.objects.count(), 0)
+        self.assertEqual(list(self.redis.ttl.values()), [storage.get_guest_ttl()])
+
+        # Stock counts what is already in the cart
+        self.assertEqual(self._add(self.black, 3).status_code, status.HTTP_400_BAD_REQUEST)
+
+        item_id = response.data['items'][0]['id']
+        response = self.client.patch(
+            reverse('cart-update-item'), {'item_id': item_id, 'quantity': 4}, format='json'
+        )
+        self.assertEqual(response.data['total_items'], 4)
+        response = self.client.delete(reverse('cart-remove-item'), {'item_id': item_id}, format='json')
+        self.assertEqual(response.data['items'], [])
+
+    def test_guest_cart_merged_at_login_with_conflicts(self):
+        self._add(self.black, 2)
+        self._add(self.gold, 2)
+        user = User.objects.create_user(username='buyer', email='buyer@example.com', password='password')
+        CartItem.objects.create(cart=user.carts.get(), variant=self.gold, quantity=1, price_at_addition='900000.00')
+
+        response = self.client.post(
+            reverse('users:login'), {'username': 'buyer', 'password': 'password'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Gold is capped at its stock of 2
+        self.assertEqual(response.data['cart_merge_conflicts'], [{
+            'variant_id': self.gold.pk, 'requested': 2, 'added': 1, 'reason': 'insufficient_stock',
+        }])
+        self.assertEqual([h for h in self.redis.data.values() if h], [])
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {response.data['token']}")
+        response = self.client.get(reverse('cart-list'))
+        quantities = {item['variant']['sku']: item['quantity'] for item in response.data['items']}
+        self.assertEqual(quantities, {'AV-BLK': 2, 'AV-GLD': 2})
+        self.assertEqual(Cart.objects.filter(user__isnull=True).count(), 0)
+
+    def test_guest_cart_merged_on_session_login(self):
+        self._add(self.black, 2)
+        guest_key = self.client.session.session_key
+        user = User.objects.create_user(username='buyer', email='buyer@example.com', password='password')
+
+        # auth.login() cycles the session key before user_logged_in is sent
+        self.assertTrue(self.client.login(username='buyer', password='password'))
+        self.assertNotEqual(self.client.session.session_key, guest_key)
+        self.assertEqual(dict(user.carts.get().items.values_list('variant__sku', 'quantity')), {'AV-BLK': 2})
+        self.assertEqual([h for h in self.redis.data.values() if h], [])
+
+    def test_guest_cart_merged_at_signup(self):
+        self._add(self.black, 1)
+        response = self.client.post(reverse('users:register'), {
+            'username': 'newbie', 'email': 'newbie@example.com',
+            'password': 'S3cure-pass!', 'password_confirm': 'S3cure-pass!',
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        self.assertEqual(response.data['cart_merge_conflicts'], [])
+        cart = Cart.objects.get(user__username='newbie')
+        self.assertEqual(dict(cart.items.values_list('variant__sku', 'quantity')), {'AV-BLK': 1})
+
+    def test_merge_is_set_based(self):
+        for variant in (self.black, self.gold):
+            self._add(variant, 1)
+        session_key = self.client.session.session_key
+        user = User.objects.create_user(username='buyer', email='buyer@example.com', password='password')
+        CartItem.objects.create(cart=user.carts.get(), variant=self.gold, quantity=1, price_at_addition='900000.00')
+
+        # User cart, both carts' items, the guest-only variants, then one
+        # bulk_update and one bulk_create inside a savepoint
+        with self.assertNumQueries(7):
+            conflicts = storage.promote_guest_cart(session_key, user)
+        self.assertEqual(conflicts, [])
+        self.assertEqual(
+            dict(user.carts.get().items.values_list('variant__sku', 'quantity')), {'AV-BLK': 1, 'AV-GLD': 2}
+        )
+
+    def test_authenticated_cart_requests_do_not_look_for_guest_carts(self):
+        user = User.objects.create_user(username='buyer', email='buyer@example.com', password='password')
+        self.client.force_authenticate(user=user)
+        with patch('apps.carts.storage.promote_guest_cart') as promote:
+            self.client.get(reverse('cart-list'))
+            self._add(self.black, 1)
+        promote.assert_not_called()
+
+    def test_falls_back_to_session_cart_when_redis_is_down(self):
+        with patch('apps.carts.storage.get_redis', side_effect=RedisError('down')):
+            response = self._add(self.black, 1)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['total_items'], 1)
+        self.assertEqual(Cart.objects.filter(session_key__isnull=False).count(), 1)
+
+    def test_fallback_cart_folded_into_redis_when_it_is_back(self):
+        self._add(self.black, 1)
+        with patch('apps.carts.storage.get_redis', side_effect=RedisError('down')):
+            self._add(self.black, 2)
+            self._add(self.gold, 1)
+
+        # Redis back: the session cart's lines move into the Redis hash
+        storage._redis_down_until = 0.0
+        response = self.client.get(reverse('cart-list'))
+        quantities = {item['variant']['sku']: item['quantity'] for item in response.data['items']}
+        self.assertEqual(quantities, {'AV-BLK': 3, 'AV-GLD': 1})
+        self.assertEqual(Cart.objects.count(), 0)
+
+        # Folded once: later requests read Redis only
+        response = self._add(self.gold, 1)
+        self.assertEqual(response.data['total_items'], 5)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CartReadQueryTest(TestCase):
+    """Cart reads cost a fixed number of queries however many lines the cart has (storage.CartSnapshot)"""
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = patch('apps.carts.storage.get_redis', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        storage._redis_down_until = 0.0
+
+        self.client = APIClient()
+        category = Category.objects.create(name='Sunglasses')
+        self.variants = []
+        for index in range(6):
+            product = Product.objects.create(
+                name=f'Frame {index}', brand='Gentle Monster', category=category, base_price='100.00',
+                short_description='Short', description='Desc',
+            )
+            variant = ProductVariant.objects.create(
+                product=product, sku=f'FR-{index}', color='Black', size='M', price='500000.00', stock=10,
+            )
+            ProductMedia.objects.create(
+                product=product, variant=variant, media_type='image', original_file=f'products/{index}.jpg',
+                is_processed=True, processed_images={'thumbnail': f'/media/products/{index}-thumb.webp'},
+            )
+            self.variants.append(variant)
+
+    def _add(self, variants):
+        for variant in variants:
+            self.client.post(reverse('cart-add-item'), {'variant_id': variant.pk, 'quantity': 2}, format='json')
+
+    def test_user_cart_read_is_query_bounded(self):
+        user = User.objects.create_user(username='buyer', email='buyer@example.com', password='password')
+        self.client.force_authenticate(user=user)
+        self._add(self.variants[:1])
+        # Cart row, lines (variant + product joined), variant images, inside
+        # the request's savepoint
+        with self.assertNumQueries(5):
+            self.client.get(reverse('cart-list'))
+
+        self._add(self.variants[1:])
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('cart-list'))
+        self.assertEqual(response.data['total_items'], 12)
+        self.assertEqual(response.data['subtotal'], '6000000.00')
+        line = response.data['items'][0]
+        self.assertEqual(line['product_name'], 'Frame 5')
+        self.assertEqual(line['variant']['thumbnail'], '/media/products/5-thumb.webp')
+        self.assertNotIn('media', line['variant'])
+
+    def test_guest_cart_read_is_query_bounded(self):
+        self._add(self.variants[:1])
+        # Variants (product joined), variant images, inside the request's savepoint
+        with self.assertNumQueries(4):
+            self.client.get(reverse('cart-list'))
+
+        self._add(self.variants[1:])
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('cart-list'))
+        self.assertEqual(response.data['total_items'], 12)
+        self.assertEqual(response.data['items'][0]['variant']['stock_status'], 'in_stock')
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CartBatchTest(TestCase):
+    """POST /cart/batch/: many operations, one stock query, one write, one cart in the response"""
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = patch('apps.carts.storage.get_redis', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        storage._redis_down_until = 0.0
+
+        self.client = APIClient()
+        category = Category.objects.create(name='Sunglasses')
+        product = Product.objects.create(
+            name='Aviator', brand='Ray-Ban', category=category, base_price='100.00',
+            short_description='Short', description='Desc',
+        )
+        self.black = ProductVariant.objects.create(
+            product=product, sku='AV-BLK', color='Black', size='M', price='700000.00', stock=5,
+        )
+        self.gold = ProductVariant.objects.create(
+            product=product, sku='AV-GLD', color='Gold', size='L', price='900000.00', stock=2,
+        )
+
+    def _batch(self, operations):
+        return self.client.post(reverse('cart-batch'), {'operations': operations}, format='json')
+
+    def _statuses(self, response):
+        return [result['status'] for result in response.data['results']]
+
+    def _run_batches(self):
+        response = self._batch([
+            {'op': 'add', 'variant_id': self.black.pk, 'quantity': 2},
+            {'op': 'add', 'variant_id': self.gold.pk, 'quantity': 3},
+            {'op': 'add', 'variant_id': 999999},
+        ])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self._statuses(response), ['ok', 'error', 'error'])
+        self.assertEqual(response.data['results'][1]['error'], 'Chỉ còn 2 sản phẩm trong kho.')
+        self.assertEqual(response.data['cart']['total_items'], 2)
+
+        item_id = response.data['cart']['items'][0]['id']
+        response = self._batch([
+            {'op': 'update', 'item_id': item_id, 'quantity': 4},
+            {'op': 'add', 'variant_id': self.gold.pk},
+            {'op': 'remove', 'item_id': item_id},
+            {'op': 'remove', 'item_id': item_id},
+        ])
+        self.assertEqual(self._statuses(response), ['ok', 'ok', 'ok', 'error'])
+        lines = {item['variant']['sku']: item['quantity'] for item in response.data['cart']['items']}
+        self.assertEqual(lines, {'AV-GLD': 1})
+        return response
+
+    def test_user_cart_batch(self):
+        user = User.objects.create_user(username='buyer', email='buyer@example.com', password='password')
+        self.client.force_authenticate(user=user)
+        self._run_batches()
+        self.assertEqual(dict(user.carts.get().items.values_list('variant__sku', 'quantity')), {'AV-GLD': 1})
+
+        # Cart, lines, all variants at once, bulk_create + delete in a
+        # savepoint, then the cart read (lines, images); inside the request's savepoint
+        gold_item = user.carts.get().items.get()
+        with self.assertNumQueries(11):
+            response = self._batch([
+                {'op': 'add', 'variant_id': self.black.pk, 'quantity': 3},
+                {'op': 'update', 'item_id': gold_item.pk, 'quantity': 2},
+                {'op': 'remove', 'item_id': gold_item.pk},
+            ])
+        self.assertEqual(self._statuses(response), ['ok', 'ok', 'ok'])
+        self.assertEqual(response.data['cart']['total_items'], 3)
+
+    def test_guest_cart_batch(self):
+        self._run_batches()
+        self.assertEqual(Cart.objects.count(), 0)
+        self.assertEqual(len(self.redis.data), 1)
+
+    def test_invalid_operations_rejected(self):
+        response = self._batch([{'op': 'update', 'item_id': 1}])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self._batch([]).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    CART_STOCK_RESERVATIONS=True,
+)
+class StockReservationTest(TestCase):
+    """Cart lines hold stock for a while; checkout converts the holds (apps.carts.reservations)"""
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = patch('apps.carts.storage.get_redis', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        storage._redis_down_until = 0.0
+
+        category = Category.objects.create(name='Sunglasses')
+        product = Product.objects.create(
+            name='Aviator', brand='Ray-Ban', category=category, base_price='100.00',
+            short_description='Short', description='Desc',
+        )
+        self.gold = ProductVariant.objects.create(
+            product=product, sku='AV-GLD', color='Gold', size='L', price='900000.00', stock=3,
+        )
+
+    def _add(self, client, quantity):
+        return client.post(reverse('cart-add-item'), {'variant_id': self.gold.pk, 'quantity': quantity}, format='json')
+
+    def test_other_carts_only_get_what_is_not_reserved(self):
+        guest, other = APIClient(), APIClient()
+        self.assertEqual(self._add(guest, 2).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(StockReservation.objects.get().quantity, 2)
+
+        response = self._add(other, 2)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['error'], 'Chỉ còn 1 sản phẩm trong kho.')
+        # The holder itself can still use its own reservation
+        self.assertEqual(self._add(guest, 1).status_code, status.HTTP_201_CREATED)
+
+        # Expired holds no longer count, and are reaped in bulk
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self._add(other, 2).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(reservations.reap_expired(), 1)
+        self.assertEqual(StockReservation.objects.get().quantity, 2)
+
+    def test_holds_follow_the_guest_to_the_user_cart(self):
+        self._add(self.client, 2)
+        User.objects.create_user(username='buyer', email='buyer@example.com', password='password')
+        self.client.post(reverse('users:login'), {'username': 'buyer', 'password': 'password'}, format='json')
+        cart = Cart.objects.get(user__username='buyer')
+        self.assertEqual(
+            list(StockReservation.objects.values_list('holder', 'quantity')),
+            [(reservations.cart_holder(cart.pk), 2)],
+        )
+
+    def test_checkout_converts_reservations(self):
+        user = User.objects.create_user(username='buyer', email='buyer@example.com', password='password')
+        client = APIClient()
+        client.force_authenticate(user=user)
+        self._add(client, 2)
+        cart = user.carts.get()
+
+        with patch('apps.orders.tasks.process_order_async.delay'), self.captureOnCommitCallbacks(execute=True):
+            order = OrderService.create_order(
+                user=user,
+                cart_items=cart.items.all(),
+                shipping_address_data={
+                    'full_name': 'Buyer', 'phone': '0900000000', 'address_line1': '1 Street', 'city': 'Hanoi',
+                },
+                payment_method='cod',
+                reservation_holder=reservations.cart_holder(cart.pk),
+            )
+        self.assertEqual(order.items.get().quantity, 2)
+        self.gold.refresh_from_db()
+        self.assertEqual(self.gold.stock, 1)
+        self.assertFalse(StockReservation.objects.exists())
+        # The guarded UPDATE skips post_save; the listing summary is refreshed on commit anyway
+        self.assertEqual(ProductListingSummary.objects.get(product=self.gold.product).total_stock, 1)
+
+    def test_unreserved_checkout_cannot_take_stock_held_by_another_cart(self):
+        user = User.objects.create_user(username='buyer', email='buyer@example.com', password='password')
+        client = APIClient()
+        client.force_authenticate(user=user)
+        self._add(client, 2)
+        cart = user.carts.get()
+        # The buyer's hold lapsed, then a guest reserved 2 of the 3 in stock
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self._add(APIClient(), 2).status_code, status.HTTP_201_CREATED)
+
+        with patch('apps.orders.tasks.process_order_async.delay'), self.assertRaisesMessage(ValueError, 'còn 1'):
+            OrderService.create_order(
+                user=user,
+                cart_items=cart.items.all(),
+                shipping_address_data={
+                    'full_name': 'Buyer', 'phone': '0900000000', 'address_line1': '1 Street', 'city': 'Hanoi',
+                },
+                payment_method='cod',
+                reservation_holder=reservations.cart_holder(cart.pk),
+            )
+        self.gold.refresh_from_db()
+        self.assertEqual(self.gold.stock, 3)
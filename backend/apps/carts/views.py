@@ -1,15 +1,17 @@
 """
 Cart ViewSet với tính năng Auto-Merge im lặng (Silent Auto-Merge)
-Tự động gộp giỏ hàng khách → giỏ hàng người dùng khi đăng nhập
+Giỏ hàng khách lưu trong Redis, giỏ hàng người dùng trong DB (xem storage.py);
+giỏ khách được gộp vào giỏ người dùng khi đăng nhập
 """
 
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
-from django.db import transaction
-from .models import Cart, CartItem
-from .serializers import CartSerializer, CartItemSerializer
+from redis.exceptions import RedisError
+from .serializers import CartSerializer, CartItemSerializer, CartBatchSerializer
+from . import reservations
+from .storage import get_cart_store, mark_redis_down
 from apps.products.models import ProductVariant
 
 
@@ -20,159 +22,68 @@ class CartViewSet(viewsets.ViewSet):
     """
     permission_classes = [AllowAny]
     
-    def _get_or_create_cart(self, request):
+    def _with_store(self, request, operation, create=True):
         """
-        Lấy hoặc tạo giỏ hàng
-        Tự động gộp giỏ khách → giỏ user nếu đăng nhập
+        Chạy operation(store) trên giỏ hàng hiện tại
+        Redis lỗi giữa chừng: chạy lại trên giỏ DB của session
         """
-        if request.user.is_authenticated:
-            # User đã đăng nhập
-            user_cart, created = Cart.objects.get_or_create(user=request.user)
-            
-            # SILENT AUTO-MERGE: Kiểm tra guest cart trong session
-            session_key = request.session.session_key
-            if session_key:
-                guest_cart = Cart.objects.filter(session_key=session_key).first()
-                
-                if guest_cart and guest_cart.get_total_items() > 0:
-                    # Tự động gộp giỏ khách vào giỏ user
-                    self._silent_merge_carts(guest_cart, user_cart)
-                    guest_cart.delete()  # Xóa giỏ khách sau khi gộp
-            
-            return user_cart
-        else:
-            # Khách (Guest user)
-            session_key = request.session.session_key
-            if not session_key:
-                request.session.create()
-                session_key = request.session.session_key
-            
-            cart, created = Cart.objects.get_or_create(session_key=session_key)
-            return cart
+        try:
+            return operation(get_cart_store(request, create=create))
+        except RedisError as e:
+            mark_redis_down(e)
+            return operation(get_cart_store(request, create=create))
+    
+    def _cart_response(self, store, status_code=status.HTTP_200_OK):
+        return Response(CartSerializer(store.get_cart()).data, status=status_code)
     
-    def _silent_merge_carts(self, guest_cart, user_cart):
+    def _available(self, store, variants):
         """
-        Gộp giỏ khách vào giỏ user im lặng (không cần xác nhận)
-        Handles conflicts: stock limits, duplicate items
+        Số lượng tối đa giỏ này được giữ cho mỗi biến thể: tồn kho, hoặc khi
+        bật giữ hàng (CART_STOCK_RESERVATIONS) tồn kho trừ phần giỏ khác đang giữ
         """
-        import logging
-        logger = logging.getLogger(__name__)
-        
-        with transaction.atomic():
-            merge_conflicts = []
-            
-            for guest_item in guest_cart.items.all():
-                try:
-                    # Kiểm tra xem sản phẩm đã có trong giỏ user chưa
-                    existing_item = user_cart.items.filter(variant=guest_item.variant).first()
-                    
-                    if existing_item:
-                        # Tính tổng số lượng sau khi gộp
-                        new_quantity = existing_item.quantity + guest_item.quantity
-                        
-                        # Kiểm tra stock availability
-                        if guest_item.variant.stock < new_quantity:
-                            # Nếu vượt quá stock, chỉ thêm số lượng tối đa có thể
-                            available = guest_item.variant.stock - existing_item.quantity
-                            if available > 0:
-                                existing_item.quantity += available
-                                existing_item.save()
-                                merge_conflicts.append({
-                                    'variant_id': guest_item.variant.id,
-                                    'requested': guest_item.quantity,
-                                    'added': available,
-                                    'reason': 'insufficient_stock'
-                                })
-                            else:
-                                merge_conflicts.append({
-                                    'variant_id': guest_item.variant.id,
-                                    'requested': guest_item.quantity,
-                                    'added': 0,
-                                    'reason': 'cart_already_at_max_stock'
-                                })
-                        else:
-                            # Stock đủ, cộng dồn số lượng
-                            existing_item.quantity = new_quantity
-                            existing_item.save()
-                    else:
-                        # Sản phẩm chưa có trong giỏ user
-                        # Kiểm tra stock trước khi thêm
-                        if guest_item.variant.stock < guest_item.quantity:
-                            # Chỉ thêm số lượng có sẵn
-                            guest_item.quantity = guest_item.variant.stock
-                            merge_conflicts.append({
-                                'variant_id': guest_item.variant.id,
-                                'requested': guest_item.quantity,
-                                'added': guest_item.variant.stock,
-                                'reason': 'insufficient_stock'
-                            })
-                        
-                        # Chuyển item sang user cart
-                        guest_item.cart = user_cart
-                        guest_item.save()
-                        
-                except Exception as e:
-                    logger.error(f"Error merging cart item {guest_item.id}: {str(e)}")
-                    merge_conflicts.append({
-                        'variant_id': guest_item.variant.id,
-                        'error': str(e)
-                    })
-            
-            # Log conflicts if any
-            if merge_conflicts:
-                logger.warning(f"Cart merge conflicts for user {user_cart.user.id}: {merge_conflicts}")
+        if reservations.is_enabled():
+            return reservations.available_to_promise(variants, store.holder)
+        return {variant.pk: variant.stock for variant in variants}
+    
+    def _reserve(self, store, quantities):
+        """Giữ hàng cho {variant_id: số lượng trong giỏ} (0: bỏ giữ)"""
+        if reservations.is_enabled():
+            reservations.reserve(store.holder, quantities)
     
     def list(self, request):
-        """Xem giỏ hàng hiện tại"""
-        cart = self._get_or_create_cart(request)
-        serializer = CartSerializer(cart)
-        return Response(serializer.data)
+        """Xem giỏ hàng hiện tại (khách chưa có session: giỏ rỗng, không tạo gì)"""
+        return self._with_store(request, self._cart_response, create=False)
     
     @action(detail=False, methods=['post'])
     def add_item(self, request):
         """Thêm sản phẩm vào giỏ hàng"""
-        cart = self._get_or_create_cart(request)
-        
         serializer = CartItemSerializer(data=request.data)
         if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         
         variant_id = serializer.validated_data['variant_id']
         quantity = serializer.validated_data.get('quantity', 1)
+        variant = ProductVariant.objects.get(pk=variant_id)
         
-        # Kiểm tra sản phẩm đã có trong giỏ chưa
-        cart_item = cart.items.filter(variant_id=variant_id).first()
-        
-        if cart_item:
-            # Cập nhật số lượng
-            new_quantity = cart_item.quantity + quantity
-            variant = cart_item.variant
-            
-            if variant.stock < new_quantity:
+        def add(store):
+            # Kiểm tra tồn kho với số lượng đã có trong giỏ
+            new_quantity = store.get_quantity(variant_id) + quantity
+            available = self._available(store, [variant])[variant.pk]
+            if available < new_quantity:
                 return Response({
-                    'error': f'Chỉ còn {variant.stock} sản phẩm trong kho.'
+                    'error': f'Chỉ còn {available} sản phẩm trong kho.'
                 }, status=status.HTTP_400_BAD_REQUEST)
             
-            cart_item.quantity = new_quantity
-            cart_item.save()
-        else:
-            # Thêm sản phẩm mới
-            variant = ProductVariant.objects.get(pk=variant_id)
-            cart_item = CartItem.objects.create(
-                cart=cart,
-                variant=variant,
-                quantity=quantity,
-                price_at_addition=variant.get_display_price()
-            )
+            store.add(variant, quantity)
+            self._reserve(store, {variant.pk: new_quantity})
+            # Trả về giỏ hàng đã cập nhật
+            return self._cart_response(store, status.HTTP_201_CREATED)
         
-        # Trả về giỏ hàng đã cập nhật
-        cart_serializer = CartSerializer(cart)
-        return Response(cart_serializer.data, status=status.HTTP_201_CREATED)
+        return self._with_store(request, add)
     
     @action(detail=False, methods=['patch'])
     def update_item(self, request):
         """Cập nhật số lượng sản phẩm"""
-        cart = self._get_or_create_cart(request)
         item_id = request.data.get('item_id')
         quantity = request.data.get('quantity')
         
@@ -181,34 +92,34 @@ class CartViewSet(viewsets.ViewSet):
                 'error': 'Vui lòng cung cấp item_id và quantity.'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        try:
-            cart_item = cart.items.get(pk=item_id)
-        except CartItem.DoesNotExist:
-            return Response({
-                'error': 'Không tìm thấy sản phẩm trong giỏ hàng.'
-            }, status=status.HTTP_404_NOT_FOUND)
-        
-        # Kiểm tra số lượng
-        if quantity < 1:
-            return Response({
-                'error': 'Số lượng phải lớn hơn 0.'
-            }, status=status.HTTP_400_BAD_REQUEST)
-        
-        if cart_item.variant.stock < quantity:
-            return Response({
-                'error': f'Chỉ còn {cart_item.variant.stock} sản phẩm trong kho.'
-            }, status=status.HTTP_400_BAD_REQUEST)
-        
-        cart_item.quantity = quantity
-        cart_item.save()
+        def update(store):
+            cart_item = store.get_item(item_id)
+            if cart_item is None:
+                return Response({
+                    'error': 'Không tìm thấy sản phẩm trong giỏ hàng.'
+                }, status=status.HTTP_404_NOT_FOUND)
+            
+            # Kiểm tra số lượng
+            if quantity < 1:
+                return Response({
+                    'error': 'Số lượng phải lớn hơn 0.'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            available = self._available(store, [cart_item.variant])[cart_item.variant.pk]
+            if available < quantity:
+                return Response({
+                    'error': f'Chỉ còn {available} sản phẩm trong kho.'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            store.set_quantity(cart_item, quantity)
+            self._reserve(store, {cart_item.variant.pk: quantity})
+            return self._cart_response(store)
         
-        cart_serializer = CartSerializer(cart)
-        return Response(cart_serializer.data)
+        return self._with_store(request, update, create=False)
     
     @action(detail=False, methods=['delete'])
     def remove_item(self, request):
         """Xóa sản phẩm khỏi giỏ hàng"""
-        cart = self._get_or_create_cart(request)
         item_id = request.data.get('item_id')
         
         if not item_id:
@@ -216,22 +127,89 @@ class CartViewSet(viewsets.ViewSet):
                 'error': 'Vui lòng cung cấp item_id.'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        try:
-            cart_item = cart.items.get(pk=item_id)
-            cart_item.delete()
-        except CartItem.DoesNotExist:
-            return Response({
-                'error': 'Không tìm thấy sản phẩm trong giỏ hàng.'
-            }, status=status.HTTP_404_NOT_FOUND)
+        def remove(store):
+            cart_item = store.get_item(item_id)
+            if cart_item is None:
+                return Response({
+                    'error': 'Không tìm thấy sản phẩm trong giỏ hàng.'
+                }, status=status.HTTP_404_NOT_FOUND)
+            
+            store.remove(cart_item)
+            self._reserve(store, {cart_item.variant.pk: 0})
+            return self._cart_response(store)
         
-        cart_serializer = CartSerializer(cart)
-        return Response(cart_serializer.data)
+        return self._with_store(request, remove, create=False)
     
     @action(detail=False, methods=['post'])
     def clear(self, request):
         """Xóa tất cả sản phẩm trong giỏ hàng"""
-        cart = self._get_or_create_cart(request)
-        cart.clear()
+        def clear(store):
+            store.clear()
+            if reservations.is_enabled():
+                reservations.release([store.holder])
+            return self._cart_response(store)
+        
+        return self._with_store(request, clear, create=False)
+    
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """
+        Nhiều thao tác add/update/remove trong một request: kiểm tra tồn kho
+        của mọi biến thể bằng một truy vấn, ghi một lần (bulk) và trả về giỏ
+        hàng một lần kèm kết quả từng thao tác. Thao tác lỗi được bỏ qua,
+        các thao tác còn lại vẫn được áp dụng.
+        """
+        serializer = CartBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         
-        cart_serializer = CartSerializer(cart)
-        return Response(cart_serializer.data)
+        operations = serializer.validated_data['operations']
+        create = any(operation['op'] == 'add' for operation in operations)
+        
+        def apply(store):
+            lines = store.get_lines()
+            current = {variant_id: quantity for variant_id, (_, quantity) in lines.items()}
+            item_variants = {item_id: variant_id for variant_id, (item_id, _) in lines.items()}
+            
+            targets = [
+                operation['variant_id'] if operation['op'] == 'add' else item_variants.get(operation['item_id'])
+                for operation in operations
+            ]
+            variants = ProductVariant.objects.in_bulk({variant_id for variant_id in targets if variant_id})
+            available = self._available(store, list(variants.values()))
+            
+            quantities = dict(current)
+            results = []
+            for operation, variant_id in zip(operations, targets):
+                error = self._apply_operation(operation, variants.get(variant_id), quantities, available)
+                result = {'op': operation['op'], 'status': 'error' if error else 'ok'}
+                if error:
+                    result['error'] = error
+                results.append(result)
+            
+            changes = {
+                variant_id: quantity for variant_id, quantity in quantities.items()
+                if quantity != current.get(variant_id, 0)
+            }
+            if changes:
+                store.apply(lines, changes, variants)
+                self._reserve(store, changes)
+            return Response({'cart': CartSerializer(store.get_cart()).data, 'results': results})
+        
+        return self._with_store(request, apply, create=create)
+    
+    def _apply_operation(self, operation, variant, quantities, available):
+        """Áp dụng một thao tác lên {variant_id: số lượng}; trả về thông báo lỗi hoặc None"""
+        if operation['op'] == 'add':
+            if variant is None or not variant.is_active:
+                return 'Sản phẩm không tồn tại hoặc đã ngừng kinh doanh.'
+            new_quantity = quantities.get(variant.pk, 0) + operation['quantity']
+        else:
+            if variant is None or not quantities.get(variant.pk):
+                return 'Không tìm thấy sản phẩm trong giỏ hàng.'
+            new_quantity = operation['quantity'] if operation['op'] == 'update' else 0
+        
+        if available[variant.pk] < new_quantity:
+            return f'Chỉ còn {available[variant.pk]} sản phẩm trong kho.'
+        quantities[variant.pk] = new_quantity
+        return None
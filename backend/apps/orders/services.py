@@ -18,7 +18,8 @@ class OrderService:
     """
     
     @staticmethod
-    def create_order(user, cart_items, shipping_address_data, payment_method, voucher_codes=None):
+    def create_order(user, cart_items, shipping_address_data, payment_method, voucher_codes=None,
+                     reservation_holder=None):
         """
         Create a new order from cart items
         
@@ -28,6 +29,8 @@ class OrderService:
             shipping_address_data: Dict with shipping address fields
             payment_method: Payment method code
             voucher_codes: Optional list of voucher codes to apply
+            reservation_holder: Cart whose stock reservations are converted
+                (apps.carts.reservations); lines they cover skip the locked re-check
         
         Returns:
             Order instance
@@ -47,21 +50,38 @@ class OrderService:
             subtotal = Decimal('0.00')
             items_data = []
             
+            # Reserved lines: stock already promised to this cart, decremented in one guarded UPDATE each
+            converted = {}
+            if reservation_holder:
+                from apps.carts.reservations import available_to_promise, convert
+                converted = convert(
+                    reservation_holder, {cart_item.variant_id: cart_item.quantity for cart_item in cart_items}
+                )
+                # Re-read after the UPDATE so the in-memory stock is current
+                converted = ProductVariant.objects.select_related('product').in_bulk(converted)
+            
             for cart_item in cart_items:
-                # CRITICAL FIX: Lock the variant row to prevent race conditions
-                # This ensures no other transaction can modify this variant until we are done
-                try:
-                    variant = ProductVariant.objects.select_for_update().get(id=cart_item.variant.id)
-                except ProductVariant.DoesNotExist:
-                    raise ValueError(f"Sản phẩm {cart_item.variant.sku} không tồn tại")
-                
-                # Check stock synchronously inside the lock
-                if variant.stock < cart_item.quantity:
-                    raise ValueError(f"Sản phẩm {variant.name} không đủ hàng (còn {variant.stock})")
-                
-                # Decrement stock immediately
-                variant.stock -= cart_item.quantity
-                variant.save(update_fields=['stock'])
+                if cart_item.variant_id in converted:
+                    variant = converted[cart_item.variant_id]
+                else:
+                    # CRITICAL FIX: Lock the variant row to prevent race conditions
+                    # This ensures no other transaction can modify this variant until we are done
+                    try:
+                        variant = ProductVariant.objects.select_for_update().get(id=cart_item.variant.id)
+                    except ProductVariant.DoesNotExist:
+                        raise ValueError(f"Sản phẩm {cart_item.variant.sku} không tồn tại")
+                    
+                    # Check stock synchronously inside the lock; with reservations on,
+                    # stock held by other carts' active reservations is not available
+                    available = variant.stock
+                    if reservation_holder:
+                        available = available_to_promise([variant], reservation_holder)[variant.pk]
+                    if available < cart_item.quantity:
+                        raise ValueError(f"Sản phẩm {variant.sku} không đủ hàng (còn {available})")
+                    
+                    # Decrement stock immediately
+                    variant.stock -= cart_item.quantity
+                    variant.save(update_fields=['stock', 'updated_at'])
                 
                 unit_price = variant.get_display_price()
                 quantity = cart_item.quantity
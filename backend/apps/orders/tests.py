@@ -1,3 +1,42 @@
 from django.test import TestCase
+from config.celery import QUEUE_NAMES, WORKER_PROFILES, app
+from config.worker import build_argv
 
-# Create your tests here.
+
+class TaskRoutingTest(TestCase):
+    """Order pipeline tasks never share a queue with media work (config/celery.py)"""
+
+    def route(self, task_name):
+        return app.amqp.router.route({}, task_name, (), {})
+
+    def test_order_tasks_have_their_own_queues(self):
+        self.assertEqual(self.route('apps.orders.tasks.process_order_async')['queue'].name, 'orders')
+        self.assertEqual(self.route('apps.orders.tasks.process_order_async')['priority'], 0)
+        self.assertEqual(self.route('apps.orders.tasks.send_order_notification')['queue'].name, 'notifications')
+        self.assertEqual(self.route('apps.products.tasks.process_product_media')['queue'].name, 'media')
+        self.assertEqual(self.route('apps.products.tasks.reprocess_media_batch')['queue'].name, 'media_bulk')
+
+        # Queues are bound to their own routing keys (no fan-out between them)
+        orders = self.route('apps.orders.tasks.process_order_async')['queue']
+        self.assertEqual((orders.exchange.name, orders.routing_key), ('orders', 'orders'))
+
+    def test_every_queue_has_a_worker_profile(self):
+        app.loader.import_default_modules()
+        routed = {self.route(name)['queue'].name for name in app.tasks if name.startswith('apps.')}
+        self.assertTrue(routed <= set(QUEUE_NAMES))
+
+        consumed = {queue for profile in WORKER_PROFILES.values() for queue in profile['queues']}
+        self.assertEqual(consumed, set(QUEUE_NAMES))
+        for profile in WORKER_PROFILES.values():
+            if 'orders' in profile['queues']:
+                self.assertFalse([q for q in profile['queues'] if q.startswith('media')])
+
+    def test_worker_argv_from_profile(self):
+        argv = build_argv('media', ['--concurrency', '3'])
+        self.assertEqual(argv[argv.index('--queues') + 1], 'media')
+        self.assertEqual(argv[argv.index('--prefetch-multiplier') + 1], '1')
+        # Image work runs in the main process so encoding can use a process pool
+        self.assertEqual(argv[argv.index('--pool') + 1], 'threads')
+        self.assertNotIn('--pool', build_argv('orders'))
+        # Passed-through options come last and win
+        self.assertEqual(argv[-2:], ['--concurrency', '3'])
@@ -102,6 +102,7 @@ class OrderViewSet(viewsets.ReadOnlyModelViewSet):
         POST /api/orders/create_order/
         """
         from apps.carts.models import Cart
+        from apps.carts import reservations
         
         # Get user's cart
         try:
@@ -139,7 +140,8 @@ class OrderViewSet(viewsets.ReadOnlyModelViewSet):
                 cart_items=cart.items.all(),
                 shipping_address_data=shipping_data,
                 payment_method=payment_method,
-                voucher_codes=voucher_codes
+                voucher_codes=voucher_codes,
+                reservation_holder=reservations.cart_holder(cart.pk) if reservations.is_enabled() else None
             )
             
             # Add customer note if provided
@@ -115,21 +115,27 @@ class ProductMediaAdmin(admin.ModelAdmin):
     list_display = ('id', 'product', 'variant', 'media_type', 'display_order', 'is_processed', 'processing_status', 'created_at')
     list_filter = ('media_type', 'is_processed', 'processing_status', 'product')
     search_fields = ('product__name', 'alt_text', 'title')
-    readonly_fields = ('is_processed', 'processing_status', 'processing_error', 'created_at', 'updated_at')
+    readonly_fields = (
+        'is_processed', 'processing_status', 'processing_progress', 'processing_error',
+        'content_hash', 'processing_profile', 'created_at', 'updated_at'
+    )
     
     fieldsets = (
         ('Media', {
             'fields': ('product', 'variant', 'media_type', 'original_file')
         }),
         ('Processed Files', {
-            'fields': ('processed_images', 'processed_video', 'video_thumbnail'),
+            'fields': ('processed_images', 'processed_video', 'video_thumbnail', 'hls_playlist'),
             'classes': ('collapse',)
         }),
         ('Metadata', {
             'fields': ('alt_text', 'title', 'display_order')
         }),
         ('Processing Status', {
-            'fields': ('is_processed', 'processing_status', 'processing_error')
+            'fields': (
+                'is_processed', 'processing_status', 'processing_progress', 'processing_error',
+                'content_hash', 'processing_profile'
+            )
         }),
         ('Timestamps', {
             'fields': ('created_at', 'updated_at'),
@@ -0,0 +1,172 @@
+"""
+Cache layer for curated product collections (featured, new arrivals,
+best sellers) and the category tree
+
+Serialized payloads are stored in the default cache under a per-scope
+version. Signals bump only the versions a changed product can affect,
+and each entry carries a soft expiry: once it passes, one request
+rebuilds under a lock while the others keep serving the stale copy.
+"""
+
+import time
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+# Collection name -> Product flag that puts a product in it
+COLLECTION_FLAGS = {
+    'featured': 'is_featured',
+    'new_arrivals': 'is_new_arrival',
+    'best_sellers': 'is_best_seller',
+}
+
+KEY_PREFIX = 'products:collections'
+
+# Scope of the cached /categories/tree/ payload
+CATEGORY_TREE_SCOPE = 'category_tree'
+
+# Waiting for another worker's rebuild on a cold key
+LOCK_WAIT = 2.0
+LOCK_POLL = 0.05
+
+
+def get_collection_ttl():
+    """Soft TTL in seconds; entries are kept for twice as long to serve stale"""
+    return getattr(settings, 'PRODUCT_COLLECTION_CACHE_TTL', 600)
+
+
+def version_key(scope):
+    return f'{KEY_PREFIX}:version:{scope}'
+
+
+def get_version(scope):
+    """
+    Current version token for a scope
+    Initialised from the clock so an evicted version never matches old entries
+    """
+    key = version_key(scope)
+    version = cache.get(key)
+    if version is None:
+        version = time.time_ns()
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def bump_versions(scopes):
+    """Invalidate every entry under the given scopes"""
+    if not scopes:
+        return
+    version = time.time_ns()
+    try:
+        cache.set_many({version_key(scope): version for scope in scopes}, None)
+    except Exception as e:
+        logger.warning(f"Could not invalidate product collections {sorted(scopes)}: {e}")
+
+
+def get_or_build(scope, name, build):
+    """
+    Cached payload for `name` under `scope`, built with build() -> (payload, member_ids)
+
+    Fresh entry: returned as is. Stale entry: one caller rebuilds (cache.add
+    lock), everyone else gets the stale payload. Missing entry: one caller
+    builds, the others wait briefly for it instead of hitting the database.
+    Any cache failure degrades to building directly.
+    """
+    try:
+        key = f'{KEY_PREFIX}:{scope}:{get_version(scope)}:{name}'
+        entry = cache.get(key)
+    except Exception as e:
+        logger.warning(f"Product collection cache unavailable: {e}")
+        return build()[0]
+
+    now = time.time()
+    if entry is not None and entry['fresh_until'] > now:
+        return entry['payload']
+
+    lock_key = f'{key}:lock'
+    if _acquire(lock_key):
+        try:
+            return _store(key, build)
+        finally:
+            _release(lock_key)
+
+    if entry is not None:
+        return entry['payload']
+
+    deadline = now + LOCK_WAIT
+    while time.time() < deadline:
+        time.sleep(LOCK_POLL)
+        try:
+            entry = cache.get(key)
+        except Exception as e:
+            logger.warning(f"Product collection cache unavailable: {e}")
+            break
+        if entry is not None:
+            return entry['payload']
+
+    return _store(key, build)
+
+
+def _acquire(lock_key):
+    try:
+        return cache.add(lock_key, 1, 30)
+    except Exception:
+        return True
+
+
+def _release(lock_key):
+    try:
+        cache.delete(lock_key)
+    except Exception as e:
+        logger.warning(f"Could not release product collection lock {lock_key}: {e}")
+
+
+def _store(key, build):
+    payload, members = build()
+    ttl = get_collection_ttl()
+    try:
+        cache.set(key, {
+            'payload': payload,
+            'members': list(members),
+            'fresh_until': time.time() + ttl,
+        }, ttl * 2)
+    except Exception as e:
+        logger.warning(f"Could not store product collection {key}: {e}")
+    return payload
+
+
+def cached_members(scope, name):
+    """Product ids in the current entry (empty if not cached)"""
+    entry = cache.get(f'{KEY_PREFIX}:{scope}:{get_version(scope)}:{name}')
+    return set(entry['members']) if entry else set()
+
+
+def invalidate_for_product(product_id, flags=None):
+    """
+    Bump the collections a change to `product_id` can affect: those whose
+    cached list contains the product or whose flag the product now carries
+    """
+    scopes = set()
+    try:
+        for name, flag in COLLECTION_FLAGS.items():
+            if (flags or {}).get(flag) or product_id in cached_members(name, name):
+                scopes.add(name)
+    except Exception as e:
+        logger.warning(f"Could not read product collection cache: {e}")
+        scopes.update(COLLECTION_FLAGS)
+    bump_versions(scopes)
+
+
+def invalidate_all():
+    """Category changes show up in every payload (category_name)"""
+    bump_versions(list(COLLECTION_FLAGS))
+
+
+def invalidate_category_tree():
+    """Category edits and product create/delete/moves change the tree or its counts"""
+    bump_versions([CATEGORY_TREE_SCOPE])
@@ -0,0 +1,48 @@
+"""
+Conditional GET support (ETag / Last-Modified) for catalog read endpoints
+
+Validators are computed from updated_at maxima and row counts (counts catch
+deletions, which do not move any timestamp) with a single aggregate query,
+so an unchanged resource is answered with 304 before any serializer runs.
+"""
+
+from calendar import timegm
+from hashlib import md5
+
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+
+def make_etag(*parts):
+    """
+    Weak ETag over the validator parts
+    Weak because nginx gzip rewrites strong ETags on compressed responses
+    """
+    digest = md5(':'.join(str(part) for part in parts).encode('utf-8'), usedforsecurity=False).hexdigest()
+    return f'W/"{digest}"'
+
+
+def latest(*timestamps):
+    """Most recent of the given datetimes (None values ignored)"""
+    values = [ts for ts in timestamps if ts is not None]
+    return max(values) if values else None
+
+
+def conditional_response(request, etag, last_modified, render):
+    """
+    304 if the client's If-None-Match / If-Modified-Since still match,
+    otherwise render() the full response; validators are attached to both
+    """
+    timestamp = timegm(last_modified.utctimetuple()) if last_modified else None
+
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = render()
+
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+        # Cacheable, but always revalidated (cheap thanks to the validators)
+        patch_cache_control(response, no_cache=True)
+    return response
@@ -0,0 +1,159 @@
+"""
+Write-behind product view counter
+
+Views are counted with HINCRBY in a Redis hash and written to
+Product.view_count in batches by the flush_product_view_counts task.
+While Redis is unreachable, hits go to an in-process buffer that is
+handed back to Redis (or written straight to the DB) once due.
+"""
+
+from collections import Counter
+import threading
+import time
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, When, Value, F, IntegerField
+from redis.exceptions import LockError, RedisError
+
+from config.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+PENDING_KEY = 'products:views:pending'
+FLUSH_LOCK_KEY = 'products:views:flush-lock'
+
+# Skip Redis for this long after a failure so every page view does not wait on a timeout
+REDIS_RETRY_AFTER = 5.0
+
+FLUSH_BATCH_SIZE = 500
+
+
+class LocalViewBuffer:
+    """Thread-safe in-process fallback buffer"""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.lock = threading.Lock()
+        self.last_flush = time.monotonic()
+        self.redis_down_until = 0.0
+
+    def add(self, product_id, amount=1):
+        with self.lock:
+            self.counts[product_id] += amount
+
+    def drain(self):
+        with self.lock:
+            counts, self.counts = self.counts, Counter()
+            self.last_flush = time.monotonic()
+            return counts
+
+    def is_due(self):
+        interval = getattr(settings, 'PRODUCT_VIEW_FLUSH_INTERVAL', 30)
+        return bool(self.counts) and time.monotonic() - self.last_flush >= interval
+
+
+_buffer = LocalViewBuffer()
+
+
+def record_view(product_id):
+    """Count one product page view without touching the database"""
+    if time.monotonic() >= _buffer.redis_down_until:
+        try:
+            get_redis().hincrby(PENDING_KEY, product_id, 1)
+            if _buffer.counts:
+                flush_local_buffer()
+            return
+        except RedisError as e:
+            _buffer.redis_down_until = time.monotonic() + REDIS_RETRY_AFTER
+            logger.warning(f"Redis unavailable for view counting, buffering in process: {e}")
+
+    _buffer.add(product_id)
+    if _buffer.is_due():
+        flush_local_buffer()
+
+
+def flush_local_buffer():
+    """Hand buffered hits to Redis, or write them directly if Redis is still down"""
+    counts = _buffer.drain()
+    if not counts:
+        return
+
+    try:
+        pipe = get_redis().pipeline()
+        for product_id, amount in counts.items():
+            pipe.hincrby(PENDING_KEY, product_id, amount)
+        pipe.execute()
+    except RedisError:
+        apply_view_counts(counts)
+
+
+def apply_view_counts(counts):
+    """
+    Add {product_id: hits} to Product.view_count
+    One UPDATE ... CASE per batch; queryset.update() skips signals, so
+    the listing summary and search index are not rebuilt for a view hit
+    """
+    from .models import Product
+
+    items = [(int(product_id), int(amount)) for product_id, amount in counts.items() if int(amount)]
+    for start in range(0, len(items), FLUSH_BATCH_SIZE):
+        batch = items[start:start + FLUSH_BATCH_SIZE]
+        Product.objects.filter(pk__in=[product_id for product_id, _ in batch]).update(
+            view_count=F('view_count') + Case(
+                *[When(pk=product_id, then=Value(amount)) for product_id, amount in batch],
+                default=Value(0),
+                output_field=IntegerField(),
+            )
+        )
+    return len(items)
+
+
+def flush_view_counts():
+    """
+    Move pending hits from Redis into the database
+
+    The pending hash is read and deleted in one MULTI/EXEC, so new hits
+    start a fresh hash and no later flush can see (and apply) the same hits
+    again, whatever happens to this one. If the database write fails the
+    claimed hits are handed back to Redis, or to the in-process buffer.
+    """
+    client = get_redis()
+    lock = client.lock(FLUSH_LOCK_KEY, timeout=300, blocking=False)
+    if not lock.acquire():
+        return 0
+
+    try:
+        pipe = client.pipeline(transaction=True)
+        pipe.hgetall(PENDING_KEY)
+        pipe.delete(PENDING_KEY)
+        counts, _ = pipe.execute()
+        if not counts:
+            return 0
+
+        try:
+            with transaction.atomic():
+                return apply_view_counts(counts)
+        except Exception:
+            restore_view_counts(counts)
+            raise
+    finally:
+        try:
+            lock.release()
+        except LockError as e:
+            # Expired during a slow flush; harmless now that the claim is atomic
+            logger.warning(f"View count flush lock already released: {e}")
+
+
+def restore_view_counts(counts):
+    """Give claimed hits back after a failed database write"""
+    try:
+        pipe = get_redis().pipeline()
+        for product_id, amount in counts.items():
+            pipe.hincrby(PENDING_KEY, product_id, int(amount))
+        pipe.execute()
+    except RedisError:
+        for product_id, amount in counts.items():
+            _buffer.add(int(product_id), int(amount))
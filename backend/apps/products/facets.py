@@ -0,0 +1,528 @@
+"""
+Facet engine for the product catalog
+In-process inverted index: one bitset (Python int, bit N = product id N)
+per attribute value, kept in sync incrementally from ProductListingSummary.
+Variant attributes are also indexed per variant (bit N = variant id N) so
+selections on them hold on the same variant, like compile_variant_filter.
+"""
+
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+import threading
+import time
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+
+logger = logging.getLogger(__name__)
+
+
+# Facets returned with counts
+FACETS = ['brand', 'color', 'material', 'lens_type', 'size', 'price']
+
+# Dimensions that only narrow the result set (no counts returned)
+FILTER_DIMENSIONS = ['category', 'target_gender', 'in_stock', 'is_featured', 'is_new_arrival', 'is_best_seller']
+
+# Dimensions that belong to a variant: every selection on them must hold on
+# the *same* active variant (see filters.compile_variant_filter)
+VARIANT_DIMENSIONS = ['color', 'material', 'lens_type', 'size', 'in_stock']
+
+# Price bucket boundaries in VND (bucketed on the product's lowest display price)
+DEFAULT_PRICE_BUCKETS = [0, 500000, 1000000, 2000000, 5000000, 10000000]
+
+EPOCH_CACHE_KEY = 'products:facets:epoch'
+
+# Re-scan window behind the watermark on incremental syncs
+SYNC_OVERLAP = timedelta(seconds=5)
+
+
+def get_price_buckets():
+    return getattr(settings, 'PRODUCT_FACET_PRICE_BUCKETS', DEFAULT_PRICE_BUCKETS)
+
+
+def price_bucket_key(price, buckets=None):
+    """Map a price to its bucket label, e.g. '500000-1000000' or '10000000+'"""
+    if price is None:
+        return None
+
+    buckets = buckets or get_price_buckets()
+    for lower, upper in zip(buckets, buckets[1:]):
+        if lower <= price < upper:
+            return f"{lower}-{upper}"
+    return f"{buckets[-1]}+"
+
+
+def price_bucket_bounds(key):
+    """Inverse of price_bucket_key: returns (lower, upper) with upper=None for the open bucket"""
+    if key.endswith('+'):
+        return Decimal(key[:-1]), None
+    lower, upper = key.split('-', 1)
+    return Decimal(lower), Decimal(upper)
+
+
+def bump_facet_epoch():
+    """
+    Force every process to rebuild its index from scratch on next use
+    Needed for deletions, which the incremental updated_at scan cannot see
+    """
+    try:
+        cache.set(EPOCH_CACHE_KEY, time.time(), None)
+    except Exception as e:
+        logger.warning(f"Could not bump facet index epoch: {e}")
+
+
+class FacetIndex:
+    """
+    Bitset inverted index over active products
+
+    bits[dimension][value] -> int bitset of product ids having that value
+    (for variant dimensions: on any active variant).
+    documents[product_id] keeps the values last indexed so an update can clear
+    the old bits before setting the new ones.
+
+    variant_bits[dimension][value] -> int bitset of active variant ids, with
+    variant_documents[variant_id] = (product_id, {dimension: value}); used
+    whenever a count depends on more than one variant-level condition.
+    """
+
+    def __init__(self, buckets=None):
+        self.buckets = buckets
+        self.bits = defaultdict(lambda: defaultdict(int))
+        self.documents = {}
+        self.all_bits = 0
+        self.variant_bits = defaultdict(lambda: defaultdict(int))
+        self.variant_documents = {}
+        self.product_variants = defaultdict(list)
+        self.all_variant_bits = 0
+        self.lock = threading.RLock()
+
+        # Sync bookkeeping
+        self.watermark = None
+        self.epoch = None
+        self.last_sync = 0.0
+        self.last_full_build = 0.0
+
+    # ------------------------------------------------------------------ build
+
+    def make_document(self, row):
+        """Turn a summary/product row into {dimension: [values]}"""
+        return {
+            'brand': [row['brand']] if row['brand'] else [],
+            'color': list(row['colors']),
+            'material': list(row['materials']),
+            'lens_type': list(row['lens_types']),
+            'size': list(row['sizes']),
+            'price': [price_bucket_key(row['min_price'], self.buckets)] if row['min_price'] is not None else [],
+            'category': [row['category_id']],
+            'target_gender': [row['target_gender']],
+            'in_stock': ['true' if row['in_stock'] else 'false'],
+            'is_featured': ['true' if row['is_featured'] else 'false'],
+            'is_new_arrival': ['true' if row['is_new_arrival'] else 'false'],
+            'is_best_seller': ['true' if row['is_best_seller'] else 'false'],
+        }
+
+    def make_variant_document(self, row):
+        """Turn a variant row into {dimension: value} (None for blank values)"""
+        return {
+            'color': row['color'] or None,
+            'material': row['material'] or None,
+            'lens_type': row['lens_type'] or None,
+            'size': row['size'] or None,
+            'in_stock': 'true' if row['stock'] > 0 else 'false',
+        }
+
+    def add(self, product_id, document):
+        """Index (or re-index) a single product"""
+        with self.lock:
+            self.remove(product_id)
+            bit = 1 << product_id
+            for dimension, values in document.items():
+                for value in values:
+                    self.bits[dimension][value] |= bit
+            self.documents[product_id] = document
+            self.all_bits |= bit
+
+    def remove(self, product_id):
+        """Drop a product from every bitset it belongs to"""
+        with self.lock:
+            document = self.documents.pop(product_id, None)
+            if document is None:
+                return
+            mask = ~(1 << product_id)
+            for dimension, values in document.items():
+                for value in values:
+                    remaining = self.bits[dimension][value] & mask
+                    if remaining:
+                        self.bits[dimension][value] = remaining
+                    else:
+                        del self.bits[dimension][value]
+            self.all_bits &= mask
+            self.remove_variants(product_id)
+
+    def add_variants(self, product_id, variants):
+        """Replace a product's variants with {variant_id: document}"""
+        with self.lock:
+            self.remove_variants(product_id)
+            for variant_id, document in variants.items():
+                bit = 1 << variant_id
+                for dimension, value in document.items():
+                    if value is not None:
+                        self.variant_bits[dimension][value] |= bit
+                self.variant_documents[variant_id] = (product_id, document)
+                self.all_variant_bits |= bit
+            if variants:
+                self.product_variants[product_id] = list(variants)
+
+    def remove_variants(self, product_id):
+        """Drop every variant of a product from the variant bitsets"""
+        with self.lock:
+            for variant_id in self.product_variants.pop(product_id, []):
+                _, document = self.variant_documents.pop(variant_id)
+                mask = ~(1 << variant_id)
+                for dimension, value in document.items():
+                    if value is None:
+                        continue
+                    remaining = self.variant_bits[dimension][value] & mask
+                    if remaining:
+                        self.variant_bits[dimension][value] = remaining
+                    else:
+                        del self.variant_bits[dimension][value]
+                self.all_variant_bits &= mask
+
+    def clear(self):
+        with self.lock:
+            self.bits = defaultdict(lambda: defaultdict(int))
+            self.documents = {}
+            self.all_bits = 0
+            self.variant_bits = defaultdict(lambda: defaultdict(int))
+            self.variant_documents = {}
+            self.product_variants = defaultdict(list)
+            self.all_variant_bits = 0
+
+    # ------------------------------------------------------------------ query
+
+    def bitset_for(self, dimension, values, bits=None):
+        """OR of the bitsets for the given values of one dimension"""
+        result = 0
+        dimension_bits = (self.bits if bits is None else bits).get(dimension, {})
+        for value in values:
+            result |= dimension_bits.get(value, 0)
+        return result
+
+    def resolve_selections(self, selections, bits=None):
+        """
+        Turn {dimension: [values]} into {dimension: bitset}
+        'color' is matched case-insensitively by substring, like the SQL filter
+        """
+        bits = self.bits if bits is None else bits
+        resolved = {}
+        for dimension, values in selections.items():
+            if not values:
+                continue
+            if dimension == 'color':
+                needles = [v.lower() for v in values]
+                values = [
+                    color for color in bits.get('color', {})
+                    if any(needle in color.lower() for needle in needles)
+                ]
+            resolved[dimension] = self.bitset_for(dimension, values, bits)
+        return resolved
+
+    def resolve(self, selections):
+        """Split selections into product-level and same-variant bitsets"""
+        product_selections = {d: v for d, v in selections.items() if d not in VARIANT_DIMENSIONS}
+        variant_selections = {d: v for d, v in selections.items() if d in VARIANT_DIMENSIONS}
+        return (
+            self.resolve_selections(product_selections),
+            self.resolve_selections(variant_selections, self.variant_bits),
+        )
+
+    def products_of(self, variant_bits):
+        """Bitset of the products owning the given variants"""
+        return bitset_from_ids(self.variant_documents[variant_id][0] for variant_id in ids_from_bitset(variant_bits))
+
+    def match(self, selections, base=None, variant_base=None):
+        """
+        Bitset of products matching every selection; variant-level selections
+        (and variant_base, a bitset of variant ids) must hold on one variant
+        """
+        with self.lock:
+            product_resolved, variant_resolved = self.resolve(selections)
+            result = self.all_bits if base is None else self.all_bits & base
+            for bits in product_resolved.values():
+                result &= bits
+
+            conditions = list(variant_resolved.values())
+            if variant_base is not None:
+                conditions.append(variant_base)
+            if conditions:
+                variant_mask = self.all_variant_bits
+                for bits in conditions:
+                    variant_mask &= bits
+                result &= self.products_of(variant_mask)
+            return result
+
+    def counts(self, selections, base=None, variant_base=None):
+        """
+        Disjunctive facet counts: for each facet, count every value under all
+        the *other* selections, so the UI can show what switching value yields
+
+        A product counts for a variant facet value only if one of its variants
+        has that value and meets every other variant-level condition, exactly
+        like the list filter. Without other variant conditions that is "any
+        variant", answered from the product bitsets.
+        """
+        with self.lock:
+            product_resolved, variant_resolved = self.resolve(selections)
+            base_bits = self.all_bits if base is None else self.all_bits & base
+
+            result = {}
+            for facet in FACETS:
+                mask = base_bits
+                for dimension, bits in product_resolved.items():
+                    if dimension != facet:
+                        mask &= bits
+
+                conditions = [bits for dimension, bits in variant_resolved.items() if dimension != facet]
+                if variant_base is not None:
+                    conditions.append(variant_base)
+
+                if not conditions:
+                    facet_counts = self.count_values(self.bits.get(facet, {}), mask)
+                else:
+                    variant_mask = self.all_variant_bits
+                    for bits in conditions:
+                        variant_mask &= bits
+                    if facet in VARIANT_DIMENSIONS:
+                        facet_counts = self.count_variant_values(facet, variant_mask, mask)
+                    else:
+                        facet_counts = self.count_values(self.bits.get(facet, {}), mask & self.products_of(variant_mask))
+                result[facet] = dict(sorted(facet_counts.items(), key=lambda item: (-item[1], str(item[0]))))
+            return result
+
+    def count_values(self, dimension_bits, mask):
+        """{value: products in mask} for product-level bitsets"""
+        facet_counts = {}
+        for value, bits in dimension_bits.items():
+            count = (bits & mask).bit_count()
+            if count:
+                facet_counts[value] = count
+        return facet_counts
+
+    def count_variant_values(self, facet, variant_mask, mask):
+        """{value: products in mask with a variant in variant_mask having that value}"""
+        products = defaultdict(list)
+        for variant_id in ids_from_bitset(variant_mask):
+            product_id, document = self.variant_documents[variant_id]
+            if document[facet] is not None:
+                products[document[facet]].append(product_id)
+
+        facet_counts = {}
+        for value, product_ids in products.items():
+            count = (bitset_from_ids(product_ids) & mask).bit_count()
+            if count:
+                facet_counts[value] = count
+        return facet_counts
+
+    # ------------------------------------------------------------------ sync
+
+    def _rows(self, queryset):
+        return queryset.values(
+            'product_id', 'colors', 'materials', 'lens_types', 'sizes', 'min_price', 'in_stock', 'updated_at',
+            is_active=F('product__is_active'),
+            brand=F('product__brand'),
+            category_id=F('product__category_id'),
+            target_gender=F('product__target_gender'),
+            is_featured=F('product__is_featured'),
+            is_new_arrival=F('product__is_new_arrival'),
+            is_best_seller=F('product__is_best_seller'),
+        ).iterator(chunk_size=2000)
+
+    def _variants(self, queryset):
+        """{product_id: {variant_id: document}} for the active variants in queryset"""
+        variants = defaultdict(dict)
+        for row in queryset.filter(is_active=True).values(
+            'id', 'product_id', 'color', 'material', 'lens_type', 'size', 'stock'
+        ).iterator(chunk_size=2000):
+            variants[row['product_id']][row['id']] = self.make_variant_document(row)
+        return variants
+
+    def _apply_rows(self, rows):
+        from .models import ProductVariant
+
+        active = []
+        for row in rows:
+            if row['is_active']:
+                self.add(row['product_id'], self.make_document(row))
+                active.append(row['product_id'])
+            else:
+                self.remove(row['product_id'])
+            if self.watermark is None or row['updated_at'] > self.watermark:
+                self.watermark = row['updated_at']
+
+        # Variant changes always refresh the summary, so re-read them with it
+        if active:
+            variants = self._variants(ProductVariant.objects.filter(product_id__in=active))
+            for product_id in active:
+                self.add_variants(product_id, variants.get(product_id, {}))
+
+    def load(self, documents, variants=None):
+        """
+        Replace the whole index in one bulk pass from {product_id: document}
+        and {product_id: {variant_id: variant document}}
+        """
+        ids = defaultdict(lambda: defaultdict(list))
+        for product_id, document in documents.items():
+            for dimension, values in document.items():
+                for value in values:
+                    ids[dimension][value].append(product_id)
+
+        bits = defaultdict(lambda: defaultdict(int))
+        for dimension, values in ids.items():
+            for value, product_ids in values.items():
+                bits[dimension][value] = bitset_from_ids(product_ids)
+
+        variant_ids = defaultdict(lambda: defaultdict(list))
+        variant_documents = {}
+        product_variants = defaultdict(list)
+        for product_id, product_variant_documents in (variants or {}).items():
+            if product_id not in documents:
+                continue
+            for variant_id, document in product_variant_documents.items():
+                for dimension, value in document.items():
+                    if value is not None:
+                        variant_ids[dimension][value].append(variant_id)
+                variant_documents[variant_id] = (product_id, document)
+                product_variants[product_id].append(variant_id)
+
+        variant_bits = defaultdict(lambda: defaultdict(int))
+        for dimension, values in variant_ids.items():
+            for value, ids in values.items():
+                variant_bits[dimension][value] = bitset_from_ids(ids)
+
+        with self.lock:
+            self.bits = bits
+            self.documents = documents
+            self.all_bits = bitset_from_ids(documents.keys())
+            self.variant_bits = variant_bits
+            self.variant_documents = variant_documents
+            self.product_variants = product_variants
+            self.all_variant_bits = bitset_from_ids(variant_documents.keys())
+
+    def build(self):
+        """Full rebuild from the listing summary table"""
+        from .models import ProductListingSummary, ProductVariant
+
+        documents = {}
+        watermark = None
+        for row in self._rows(ProductListingSummary.objects.filter(product__is_active=True)):
+            documents[row['product_id']] = self.make_document(row)
+            if watermark is None or row['updated_at'] > watermark:
+                watermark = row['updated_at']
+
+        variants = self._variants(ProductVariant.objects.filter(product__is_active=True))
+
+        with self.lock:
+            self.load(documents, variants)
+            self.watermark = watermark
+            self.last_full_build = time.monotonic()
+
+    def apply_changes(self):
+        """Incremental update: re-index summaries touched since the last sync"""
+        from .models import ProductListingSummary
+
+        if self.watermark is None:
+            return self.build()
+
+        # Small overlap guards against rows committed slightly out of order
+        since = self.watermark - SYNC_OVERLAP
+        with self.lock:
+            self._apply_rows(self._rows(ProductListingSummary.objects.filter(updated_at__gte=since)))
+
+    def sync(self, force=False):
+        """
+        Bring the index up to date, at most once per sync interval
+        A changed epoch (deletions) or an old full build triggers a rebuild
+        """
+        now = time.monotonic()
+        interval = getattr(settings, 'PRODUCT_FACET_SYNC_INTERVAL', 2)
+        full_interval = getattr(settings, 'PRODUCT_FACET_FULL_REBUILD_INTERVAL', 300)
+
+        if not force and self.last_sync and now - self.last_sync < interval:
+            return self
+
+        with self.lock:
+            try:
+                epoch = cache.get(EPOCH_CACHE_KEY)
+            except Exception:
+                epoch = self.epoch
+
+            if force or self.watermark is None or epoch != self.epoch or now - self.last_full_build > full_interval:
+                self.build()
+                self.epoch = epoch
+            else:
+                self.apply_changes()
+
+            self.last_sync = now
+        return self
+
+
+_index = FacetIndex()
+
+
+def get_facet_index():
+    """Process-wide facet index, synced with the database"""
+    return _index.sync()
+
+
+def bitset_from_ids(ids):
+    """Build a bitset from product ids in one pass (much faster than OR-ing bit by bit)"""
+    ids = list(ids)
+    if not ids:
+        return 0
+    buffer = bytearray(max(ids) // 8 + 1)
+    for product_id in ids:
+        buffer[product_id >> 3] |= 1 << (product_id & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def ids_from_bitset(bits):
+    """Inverse of bitset_from_ids: the set positions in ascending order"""
+    ids = []
+    for offset, byte in enumerate(bits.to_bytes((bits.bit_length() + 7) // 8, 'little')):
+        while byte:
+            low = byte & -byte
+            ids.append(offset * 8 + low.bit_length() - 1)
+            byte ^= low
+    return ids
+
+
+def selections_from_params(params):
+    """
+    Read facet/filter selections from request query params
+    Uses the same parameter names as ProductViewSet ('price_bucket' for the price facet)
+    """
+    selections = {}
+    for dimension in FACETS + FILTER_DIMENSIONS:
+        value = params.get('price_bucket' if dimension == 'price' else dimension)
+        if not value:
+            continue
+
+        if dimension == 'category':
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                continue
+        elif dimension == 'in_stock':
+            # Mirrors the SQL filter, which only understands in_stock=true
+            if value != 'true':
+                continue
+        elif dimension.startswith('is_'):
+            value = {'1': 'true', '0': 'false'}.get(value, value.lower())
+
+        selections[dimension] = [value]
+
+    return selections
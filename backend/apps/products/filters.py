@@ -0,0 +1,66 @@
+"""
+Filter backends for Products API
+"""
+
+from django.db.models import Exists, OuterRef
+from rest_framework import filters
+from .models import ProductVariant
+from .search import get_search_backend
+
+
+class ProductSearchFilter(filters.SearchFilter):
+    """
+    ?search= backed by the product full-text index
+    Diacritic-insensitive and annotates matches with `search_rank`
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query:
+            return queryset
+        return get_search_backend().search(queryset, query)
+
+
+class ProductOrderingFilter(filters.OrderingFilter):
+    """Search results default to relevance order unless ?ordering= is given"""
+
+    def get_ordering(self, request, queryset, view):
+        if not request.query_params.get(self.ordering_param) and 'search_rank' in queryset.query.annotations:
+            return ['-search_rank', '-created_at']
+        return super().get_ordering(request, queryset, view)
+
+
+# Query param -> ProductVariant lookup for variant-level predicates
+VARIANT_FILTER_LOOKUPS = {
+    'min_price': 'price__gte',
+    'max_price': 'price__lte',
+    'color': 'color__icontains',
+    'lens_type': 'lens_type',
+    'material': 'material',
+    'size': 'size',
+}
+
+
+def compile_variant_filter(params):
+    """
+    Compile every variant-level query param into one correlated EXISTS
+
+    All conditions must hold on the *same* active variant ("black AND size M"),
+    and since EXISTS never multiplies product rows no DISTINCT is needed.
+    Returns None when no variant-level param is present.
+    """
+    conditions = {}
+    for param, lookup in VARIANT_FILTER_LOOKUPS.items():
+        value = params.get(param)
+        if value:
+            conditions[lookup] = value
+
+    if params.get('in_stock') == 'true':
+        conditions['stock__gt'] = 0
+
+    if not conditions:
+        return None
+
+    return Exists(
+        ProductVariant.objects.filter(product=OuterRef('pk'), is_active=True, **conditions)
+    )
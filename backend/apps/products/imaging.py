@@ -0,0 +1,381 @@
+"""
+Image derivative pipeline for product media
+
+- Decode once, in draft mode: JPEG sources are DCT-scaled (1/2, 1/4, 1/8)
+  straight to the smallest resolution still covering the largest target
+- Resolution pyramid: sizes are produced largest first and each one is
+  resampled from the nearest larger level instead of the full original
+- Encoding (the expensive part) runs in parallel: a process pool when the
+  current process may fork children (the media worker profiles run the
+  threads pool for this), a thread pool inside daemonic Celery prefork
+  workers (Pillow releases the GIL while encoding)
+- Every size is encoded to each configured format (AVIF, WebP, JPEG);
+  encoder settings are tunable per format and size
+- A tiny inline placeholder (LQIP), the dominant colour and the intrinsic
+  size are taken from the same decode
+"""
+
+from base64 import b64encode
+from collections import namedtuple
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import cache
+from hashlib import sha1
+from io import BytesIO
+import json
+import multiprocessing
+import os
+import threading
+import logging
+
+from django.conf import settings
+from PIL import Image, ImageEnhance, features
+
+logger = logging.getLogger(__name__)
+
+
+# One encoded output: a size in a format
+Rendition = namedtuple('Rendition', ['size_name', 'image_format', 'width', 'height', 'data'])
+
+# Intrinsic size of the original plus what a page needs before any rendition loads
+ImageInfo = namedtuple('ImageInfo', ['width', 'height', 'dominant_color', 'placeholder'])
+
+
+# Target sizes (width, height); images are center-cropped to fill them
+DEFAULT_SIZES = {
+    'thumbnail': (300, 300),
+    'medium': (800, 800),
+    'large': (1500, 1500),
+}
+
+# Output formats, best compression first. AVIF is skipped when Pillow is
+# built without it; JPEG is the universal fallback.
+DEFAULT_FORMATS = ['AVIF', 'WEBP', 'JPEG']
+
+FORMAT_EXTENSIONS = {'AVIF': 'avif', 'WEBP': 'webp', 'JPEG': 'jpg'}
+FORMAT_MIME_TYPES = {'AVIF': 'image/avif', 'WEBP': 'image/webp', 'JPEG': 'image/jpeg'}
+
+# Formats whose URL fills the legacy {size_name: url} keys, in preference order
+LEGACY_FORMATS = ['WEBP', 'JPEG']
+
+# Per-format, per-size encoder settings (see benchmark_image_formats).
+# Small sizes are served most often but gain little from slow settings;
+# only the large rendition gets the full effort.
+DEFAULT_ENCODER = {
+    'AVIF': {
+        'thumbnail': {'quality': 55, 'speed': 8},
+        'medium': {'quality': 60, 'speed': 7},
+        'large': {'quality': 62, 'speed': 6},
+    },
+    'WEBP': {
+        'thumbnail': {'quality': 80, 'method': 4},
+        'medium': {'quality': 82, 'method': 4},
+        'large': {'quality': 85, 'method': 6},
+    },
+    'JPEG': {
+        'thumbnail': {'quality': 80},
+        'medium': {'quality': 82},
+        'large': {'quality': 85},
+    },
+}
+
+# Applied to sizes without an entry above
+FORMAT_ENCODER_DEFAULTS = {
+    'AVIF': {'quality': 60, 'speed': 7},
+    'WEBP': {'quality': 85, 'method': 4},
+    'JPEG': {'quality': 85, 'optimize': True, 'progressive': True},
+}
+
+# Bump when the pipeline changes output in a way settings do not capture
+PROFILE_VERSION = 2
+
+# Sources smaller than this (either side) are upscaled 2x before resizing
+UPSCALE_BELOW = 800
+
+# LQIP: longest side in pixels and WebP quality of the inline preview
+# (~150-300 bytes as a data URI, meant to be shown blurred)
+PLACEHOLDER_SIZE = 16
+PLACEHOLDER_QUALITY = 40
+
+# Lanczos with reducing_gap: a cheap box reduction first, then the precise
+# filter on the last <= 3x step (visually indistinguishable, much faster)
+REDUCING_GAP = 3.0
+
+
+def get_sizes():
+    return getattr(settings, 'PRODUCT_IMAGE_SIZES', DEFAULT_SIZES)
+
+
+@cache
+def can_encode(image_format):
+    """Whether this Pillow build can encode the format (checked, and warned about, once per process)"""
+    if image_format == 'JPEG' or features.check(image_format.lower()):
+        return True
+    logger.warning(f"Pillow cannot encode {image_format}, skipping it")
+    return False
+
+
+def get_formats():
+    """Configured output formats this Pillow build can encode"""
+    return [f for f in getattr(settings, 'PRODUCT_IMAGE_FORMATS', DEFAULT_FORMATS) if can_encode(f)]
+
+
+def get_encoder_options(size_name, image_format='WEBP'):
+    """Encoder options for one size in one format; PRODUCT_IMAGE_ENCODER overrides per format/size"""
+    configured = getattr(settings, 'PRODUCT_IMAGE_ENCODER', {}).get(image_format, {})
+    return {
+        **FORMAT_ENCODER_DEFAULTS.get(image_format, {}),
+        **DEFAULT_ENCODER.get(image_format, {}).get(size_name, {}),
+        **configured.get(size_name, {}),
+    }
+
+
+def get_worker_count():
+    return getattr(settings, 'PRODUCT_IMAGE_WORKERS', None) or min(3, os.cpu_count() or 1)
+
+
+def get_profile():
+    """
+    Short fingerprint of everything that shapes the derivatives (sizes,
+    formats, encoder options, pipeline version); derivatives are stored per profile
+    """
+    sizes = get_sizes()
+    formats = get_formats()
+    spec = {
+        'version': PROFILE_VERSION,
+        'sizes': {name: list(size) for name, size in sizes.items()},
+        'encoder': {
+            image_format: {name: get_encoder_options(name, image_format) for name in sizes}
+            for image_format in formats
+        },
+    }
+    digest = sha1(json.dumps(spec, sort_keys=True).encode('utf-8'), usedforsecurity=False).hexdigest()
+    return f'img-{digest[:10]}'
+
+
+# ---------------------------------------------------------------------- decode
+
+def cover_size(source_size, target_size):
+    """Smallest size with the source aspect ratio that covers target_size"""
+    scale = max(target_size[0] / source_size[0], target_size[1] / source_size[1])
+    return (max(1, round(source_size[0] * scale)), max(1, round(source_size[1] * scale)))
+
+
+def to_rgb(img):
+    """Flatten transparency onto white and convert to RGB (WebP/JPEG safe)"""
+    if img.mode in ('RGBA', 'LA', 'P'):
+        if img.mode != 'RGBA':
+            img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        return background
+    if img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
+
+
+def decode(source, sizes):
+    """
+    Open `source` (path or file object) and decode it at the lowest
+    resolution that still covers every target size, upscaling small
+    sources; returns (image, original size)
+    """
+    img, original_size = load(source, sizes)
+    if needs_upscale(original_size):
+        img = upscale(img)
+    return img, original_size
+
+
+def load(source, sizes):
+    """decode() without the upscale step: (RGB image, original size)"""
+    img = Image.open(source)
+    original_size = img.size
+    needed = max((cover_size(img.size, size) for size in sizes.values()), key=lambda size: size[0])
+
+    # JPEG only: decode with DCT scaling, result is >= the requested size
+    if img.format == 'JPEG' and needed[0] < img.size[0]:
+        img.draft('RGB', needed)
+
+    img = to_rgb(img)
+    img.load()
+    logger.debug(f"Decoded {original_size} source at {img.size} (needed {needed})")
+    return img, original_size
+
+
+def needs_upscale(original_size):
+    return original_size[0] < UPSCALE_BELOW or original_size[1] < UPSCALE_BELOW
+
+
+def upscale(img, scale_factor=2):
+    """2x Lanczos upscale with slight sharpening for small sources"""
+    new_size = (img.width * scale_factor, img.height * scale_factor)
+    upscaled = img.resize(new_size, Image.Resampling.LANCZOS)
+    logger.info(f"Upscaled image from {img.size} to {new_size}")
+    return ImageEnhance.Sharpness(upscaled).enhance(1.2)
+
+
+# ---------------------------------------------------------------------- resize
+
+def fit(img, target_size):
+    """
+    Center-crop to the target aspect ratio and resize in one resample
+    (same geometry as ImageOps.fit, without the intermediate crop copy)
+    """
+    target_ratio = target_size[0] / target_size[1]
+    width, height = img.size
+    if width / height > target_ratio:
+        crop_width = height * target_ratio
+        box = ((width - crop_width) / 2, 0, (width + crop_width) / 2, height)
+    else:
+        crop_height = width / target_ratio
+        box = (0, (height - crop_height) / 2, width, (height + crop_height) / 2)
+    return img.resize(target_size, Image.Resampling.LANCZOS, box=box, reducing_gap=REDUCING_GAP)
+
+
+def build_pyramid(img, sizes):
+    """
+    {size_name: Image}, largest first; each level is resampled from the
+    nearest larger level with the same aspect ratio (else from the source)
+    """
+    levels = {}
+    ordered = sorted(sizes.items(), key=lambda item: -(item[1][0] * item[1][1]))
+    for size_name, size in ordered:
+        parent = img
+        for level in reversed(list(levels.values())):
+            same_ratio = abs(level.width * size[1] - level.height * size[0]) <= max(level.width, level.height) // 100
+            if same_ratio and level.width >= size[0] and level.height >= size[1]:
+                parent = level
+                break
+        levels[size_name] = fit(parent, size)
+    return levels
+
+
+# ---------------------------------------------------------------------- describe
+
+def dominant_color(img):
+    """Most common colour after quantizing a small copy to 5 colours, as #rrggbb"""
+    small = img.copy()
+    small.thumbnail((64, 64))
+    quantized = small.quantize(colors=5, method=Image.Quantize.MEDIANCUT)
+    _, index = max(quantized.getcolors())
+    red, green, blue = quantized.getpalette()[index * 3:index * 3 + 3]
+    return f'#{red:02x}{green:02x}{blue:02x}'
+
+
+def placeholder(img):
+    """Tiny WebP preview as a data URI (low-quality image placeholder)"""
+    small = img.copy()
+    small.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+    data = encode(small, 'WEBP', quality=PLACEHOLDER_QUALITY, method=6)
+    return 'data:image/webp;base64,' + b64encode(data).decode('ascii')
+
+
+def describe(original_size, level):
+    """ImageInfo from the original size and a (small) rendition-shaped level"""
+    return ImageInfo(original_size[0], original_size[1], dominant_color(level), placeholder(level))
+
+
+def inspect(source, sizes=None):
+    """ImageInfo without rendering anything (for media whose renditions are reused)"""
+    sizes = sizes or get_sizes()
+    smallest = min(sizes.values(), key=lambda size: size[0] * size[1])
+    img = Image.open(source)
+    original_size = img.size
+    if img.format == 'JPEG':
+        img.draft('RGB', cover_size(img.size, smallest))
+    return describe(original_size, fit(to_rgb(img), smallest))
+
+
+# ---------------------------------------------------------------------- encode
+
+def encode(img, image_format='WEBP', **options):
+    """Encode one image to bytes (runs inside the pool)"""
+    output = BytesIO()
+    img.save(output, format=image_format, **options)
+    return output.getvalue()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Shared pool for encoding, safe to use from several task threads.
+    Celery prefork children are daemonic and may not start child processes,
+    so they get a thread pool instead (see WORKER_PROFILES in config/celery.py).
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = get_worker_count()
+            if multiprocessing.current_process().daemon:
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-encode')
+            else:
+                _executor = ProcessPoolExecutor(max_workers=workers)
+        return _executor
+
+
+def render_derivatives(source, sizes=None, formats=None):
+    """
+    Decode `source` once and return ([Rendition for every size in every
+    format], ImageInfo); the placeholder comes from the smallest level
+    """
+    sizes = sizes or get_sizes()
+    formats = formats or get_formats()
+    img, original_size = decode(source, sizes)
+    levels = build_pyramid(img, sizes)
+    info = describe(original_size, list(levels.values())[-1])
+    jobs = [
+        (size_name, image_format, level)
+        for size_name, level in levels.items()
+        for image_format in formats
+    ]
+
+    try:
+        executor = get_executor()
+        futures = [
+            executor.submit(encode, level, image_format, **get_encoder_options(size_name, image_format))
+            for size_name, image_format, level in jobs
+        ]
+        results = [future.result() for future in futures]
+    except BrokenExecutor:
+        # A pool process died (e.g. OOM-killed): drop the pool, encode inline this time
+        logger.warning("Image encoding pool is broken, recreating it")
+        shutdown_executor()
+        results = [
+            encode(level, image_format, **get_encoder_options(size_name, image_format))
+            for size_name, image_format, level in jobs
+        ]
+
+    renditions = [
+        Rendition(size_name, image_format, level.width, level.height, data)
+        for (size_name, image_format, level), data in zip(jobs, results)
+    ]
+    return renditions, info
+
+
+def nearest_size_name(size, sizes=None):
+    """Configured size closest in area to `size`; ad hoc sizes borrow its encoder settings"""
+    sizes = sizes or get_sizes()
+    area = size[0] * size[1]
+    return min(sizes, key=lambda name: abs(sizes[name][0] * sizes[name][1] - area))
+
+
+def render_one(source, size, image_format):
+    """
+    Decode `source` and encode a single ad hoc size inline (on-demand
+    renditions, see apps.products.renditions); returns a Rendition
+    """
+    img, _ = decode(source, {'requested': size})
+    level = fit(img, size)
+    size_name = nearest_size_name(size)
+    data = encode(level, image_format, **get_encoder_options(size_name, image_format))
+    return Rendition(size_name, image_format, level.width, level.height, data)
+
+
+def shutdown_executor(wait=False):
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait, cancel_futures=True)
+            _executor = None
@@ -0,0 +1,118 @@
+"""
+Django management command to benchmark the facet index
+Usage: python manage.py benchmark_facets --products 50000
+"""
+
+from django.core.management.base import BaseCommand
+from apps.products.facets import FacetIndex, FACETS
+from decimal import Decimal
+import random
+import statistics
+import time
+
+
+class Command(BaseCommand):
+    help = 'Benchmark facet index build, incremental updates and count queries on a synthetic catalog'
+
+    BRANDS = ['Ray-Ban', 'Oakley', 'Gucci', 'Prada', 'Versace', 'Gentle Monster', 'Tom Ford', 'Dior', 'Celine', 'Lindberg']
+    COLORS = ['Black', 'Gold', 'Silver', 'Tortoise', 'Blue', 'Red', 'Clear', 'Brown', 'Pink', 'Green']
+    MATERIALS = ['acetate', 'metal', 'titanium', 'plastic', 'wood', 'mixed']
+    LENS_TYPES = ['clear', 'prescription', 'polarized', 'photochromic', 'blue_light', 'sunglasses']
+    SIZES = ['XS', 'S', 'M', 'L', 'XL']
+    GENDERS = ['unisex', 'male', 'female', 'kids']
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=50000, help='Number of synthetic products')
+        parser.add_argument('--queries', type=int, default=200, help='Number of count queries to time')
+        parser.add_argument('--updates', type=int, default=1000, help='Number of incremental re-index operations')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        index = FacetIndex()
+        self.next_variant_id = 1
+
+        documents, variants = {}, {}
+        for product_id in range(1, options['products'] + 1):
+            documents[product_id], variants[product_id] = self.random_product(index, rng)
+
+        started = time.perf_counter()
+        index.load(documents, variants)
+        build_ms = (time.perf_counter() - started) * 1000
+        self.stdout.write(
+            f"Build: {len(documents)} products, {len(index.variant_documents)} variants in {build_ms:.1f} ms"
+        )
+
+        product_ids = list(documents)
+        started = time.perf_counter()
+        for _ in range(options['updates']):
+            product_id = rng.choice(product_ids)
+            document, product_variants = self.random_product(index, rng)
+            index.add(product_id, document)
+            index.add_variants(product_id, product_variants)
+        update_us = (time.perf_counter() - started) * 1e6 / max(options['updates'], 1)
+        self.stdout.write(f"Incremental update: {update_us:.1f} us per product")
+
+        scenarios = {
+            'no filters': lambda: {},
+            'one facet': lambda: {'brand': [rng.choice(self.BRANDS)]},
+            'three facets + stock': lambda: {
+                'color': [rng.choice(self.COLORS)],
+                'material': [rng.choice(self.MATERIALS)],
+                'size': [rng.choice(self.SIZES)],
+                'in_stock': ['true'],
+            },
+        }
+
+        for name, make_selection in scenarios.items():
+            timings = []
+            for _ in range(options['queries']):
+                selection = make_selection()
+                started = time.perf_counter()
+                counts = index.counts(selection)
+                timings.append((time.perf_counter() - started) * 1000)
+
+            timings.sort()
+            p95 = timings[int(len(timings) * 0.95) - 1] if len(timings) > 1 else timings[0]
+            values = sum(len(counts[facet]) for facet in FACETS)
+            self.stdout.write(
+                f"Counts [{name}]: median {statistics.median(timings):.2f} ms, "
+                f"p95 {p95:.2f} ms ({values} facet values)"
+            )
+
+        self.stdout.write(self.style.SUCCESS('Facet benchmark complete'))
+
+    def random_product(self, index, rng):
+        """Synthetic product document and {variant_id: document}, built like FacetIndex.build"""
+        variant_rows = [
+            {
+                'color': rng.choice(self.COLORS),
+                'material': rng.choice(self.MATERIALS),
+                'lens_type': rng.choice(self.LENS_TYPES),
+                'size': rng.choice(self.SIZES),
+                'stock': rng.choice([0, 0, 1, 5, 20]),
+            }
+            for _ in range(rng.randint(1, 4))
+        ]
+        variants = {}
+        for row in variant_rows:
+            variants[self.next_variant_id] = index.make_variant_document(row)
+            self.next_variant_id += 1
+        return index.make_document(self.random_row(rng, variant_rows)), variants
+
+    def random_row(self, rng, variant_rows):
+        """Synthetic summary row shaped like FacetIndex._rows output"""
+        return {
+            'brand': rng.choice(self.BRANDS),
+            'colors': sorted({row['color'] for row in variant_rows}),
+            'materials': sorted({row['material'] for row in variant_rows}),
+            'lens_types': sorted({row['lens_type'] for row in variant_rows}),
+            'sizes': sorted({row['size'] for row in variant_rows}),
+            'min_price': Decimal(rng.randint(200, 15000) * 1000),
+            'in_stock': any(row['stock'] > 0 for row in variant_rows),
+            'category_id': rng.randint(1, 12),
+            'target_gender': rng.choice(self.GENDERS),
+            'is_featured': rng.random() < 0.05,
+            'is_new_arrival': rng.random() < 0.1,
+            'is_best_seller': rng.random() < 0.05,
+        }
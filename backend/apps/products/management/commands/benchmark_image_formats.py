@@ -0,0 +1,137 @@
+"""
+Django management command to compare output formats and qualities for
+product image renditions: file size, encode time and fidelity (PSNR)
+Usage: python manage.py benchmark_image_formats --corpus /path/to/photos --qualities 50 60 70 80 90
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from apps.products import imaging
+from io import BytesIO
+from PIL import Image, ImageChops, ImageDraw, ImageFilter, ImageStat
+import math
+import os
+import random
+import statistics
+import time
+
+
+def psnr(reference, encoded_bytes):
+    """Peak signal-to-noise ratio (dB) of the decoded rendition against its source level"""
+    with Image.open(BytesIO(encoded_bytes)) as decoded:
+        decoded = decoded.convert('RGB')
+        rms = ImageStat.Stat(ImageChops.difference(reference, decoded)).rms
+    mse = sum(value ** 2 for value in rms) / len(rms)
+    return 100.0 if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+
+def synthetic_corpus(count, seed=7):
+    """Product-shot-like images: soft background, blurred shapes, sharp lines, texture"""
+    rng = random.Random(seed)
+    images = []
+    for index in range(count):
+        width, height = rng.choice([(2400, 1800), (2000, 2000), (1800, 2400)])
+        background = tuple(rng.randint(200, 250) for _ in range(3))
+        img = Image.new('RGB', (width, height), background)
+        draw = ImageDraw.Draw(img)
+        for _ in range(rng.randint(4, 9)):
+            x, y = rng.randint(0, width), rng.randint(0, height)
+            radius = rng.randint(width // 12, width // 4)
+            color = tuple(rng.randint(0, 255) for _ in range(3))
+            draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=color)
+        img = img.filter(ImageFilter.GaussianBlur(6))
+        # Sharp edges (frames, logos, stitching) on top of the soft shapes
+        draw = ImageDraw.Draw(img)
+        for _ in range(rng.randint(20, 40)):
+            x, y = rng.randint(0, width), rng.randint(0, height)
+            color = tuple(rng.randint(0, 255) for _ in range(3))
+            draw.line((x, y, x + rng.randint(-400, 400), y + rng.randint(-400, 400)), fill=color, width=rng.randint(2, 12))
+        texture = Image.effect_noise((width, height), 64).convert('RGB')
+        images.append((f'synthetic-{index}', Image.blend(img, texture, 0.1)))
+    return images
+
+
+class Command(BaseCommand):
+    help = 'Benchmark AVIF/WebP/JPEG renditions at several qualities (size, encode time, PSNR)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corpus', help='Directory of sample images (default: synthetic corpus)')
+        parser.add_argument('--samples', type=int, default=4, help='Synthetic images when no corpus is given')
+        parser.add_argument('--formats', nargs='+', default=imaging.DEFAULT_FORMATS, help='Formats to compare')
+        parser.add_argument('--qualities', type=int, nargs='+', default=[50, 60, 70, 80, 90])
+        parser.add_argument('--target-psnr', type=float, default=40.0, help='Fidelity for the matched-quality summary')
+
+    def handle(self, *args, **options):
+        sizes = imaging.get_sizes()
+        formats = [f for f in options['formats'] if f in imaging.get_formats()]
+        if not formats:
+            raise CommandError('None of the requested formats can be encoded by this Pillow build')
+
+        corpus = self.load_corpus(options)
+        self.stdout.write(f"{len(corpus)} images, sizes: {', '.join(sizes)}, formats: {', '.join(formats)}")
+
+        # Pyramid once per image; only the encoding differs between runs
+        levels = [imaging.build_pyramid(imaging.to_rgb(img), sizes) for _, img in corpus]
+
+        results = {}
+        for image_format in formats:
+            for quality in options['qualities']:
+                for size_name in sizes:
+                    options_for_size = {**imaging.get_encoder_options(size_name, image_format), 'quality': quality}
+                    samples = []
+                    for image_levels in levels:
+                        level = image_levels[size_name]
+                        start = time.perf_counter()
+                        data = imaging.encode(level, image_format, **options_for_size)
+                        elapsed = time.perf_counter() - start
+                        samples.append((len(data), elapsed, psnr(level, data)))
+                    results[(image_format, quality, size_name)] = (
+                        statistics.mean(s[0] for s in samples),
+                        statistics.mean(s[1] for s in samples),
+                        statistics.mean(s[2] for s in samples),
+                    )
+
+        self.report(results, formats, options['qualities'], sizes, options['target_psnr'])
+        self.stdout.write(self.style.SUCCESS('\nBenchmark complete'))
+
+    def load_corpus(self, options):
+        if not options['corpus']:
+            return synthetic_corpus(options['samples'])
+        corpus = []
+        for name in sorted(os.listdir(options['corpus'])):
+            try:
+                with Image.open(os.path.join(options['corpus'], name)) as img:
+                    img.load()
+                    corpus.append((name, img.copy()))
+            except (OSError, Image.DecompressionBombError):
+                continue
+        if not corpus:
+            raise CommandError(f"No readable images in {options['corpus']}")
+        return corpus
+
+    def report(self, results, formats, qualities, sizes, target_psnr):
+        for size_name in sizes:
+            configured = {f: imaging.get_encoder_options(size_name, f).get('quality') for f in formats}
+            self.stdout.write(f"\n{size_name} {sizes[size_name][0]}x{sizes[size_name][1]}:")
+            self.stdout.write(f"  {'format':<6} {'q':>3} {'KB':>8} {'ms':>8} {'PSNR':>7}")
+            for image_format in formats:
+                for quality in qualities:
+                    size, seconds, fidelity = results[(image_format, quality, size_name)]
+                    marker = '  <- profile' if configured[image_format] == quality else ''
+                    self.stdout.write(
+                        f"  {image_format:<6} {quality:>3} {size / 1024:8.1f} {seconds * 1000:8.1f} {fidelity:7.2f}{marker}"
+                    )
+
+            # Smallest file per format that still reaches the target fidelity
+            matched = []
+            for image_format in formats:
+                passing = [
+                    (results[(image_format, q, size_name)][0], q)
+                    for q in qualities
+                    if results[(image_format, q, size_name)][2] >= target_psnr
+                ]
+                if passing:
+                    size, quality = min(passing)
+                    matched.append(f"{image_format} q{quality} {size / 1024:.1f} KB")
+                else:
+                    matched.append(f"{image_format} n/a")
+            self.stdout.write(f"  >= {target_psnr:g} dB: " + ', '.join(matched))
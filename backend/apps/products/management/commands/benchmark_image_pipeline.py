@@ -0,0 +1,255 @@
+"""
+Django management command to benchmark the image pipeline stage by stage
+(apps.products.imaging) on synthetic sources, and compare runs across commits
+Usage: python manage.py benchmark_image_pipeline --json results.json [--compare baseline.json]
+
+Sources cover the cases the pipeline branches on: several sizes (small ones
+take the upscale path), colour modes (RGB, RGBA, P, L, CMYK) and EXIF
+orientations. Every case runs in a forked child, as in benchmark_media, so
+its peak RSS is its own; the peak is sampled after each stage to show which
+stage raised it. Stages:
+
+    decode    open + draft/DCT scaling + mode conversion (imaging.load)
+    upscale   only for sources under UPSCALE_BELOW
+    fit       resolution pyramid for every size (imaging.build_pyramid)
+    encode    every size in every format, sequentially (bytes per format)
+    describe  dominant colour + placeholder
+    total     render_derivatives end to end (parallel encoding)
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from apps.products import imaging
+from datetime import datetime, timezone
+from PIL import Image, features
+from .benchmark_media import peak_rss_mb
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+
+
+STAGES = ['decode', 'upscale', 'fit', 'encode', 'describe', 'total']
+
+# Modes without alpha/palette are stored as JPEG (the usual camera output)
+JPEG_MODES = ('RGB', 'L', 'CMYK')
+
+EXIF_ORIENTATION = 0x0112
+
+
+def make_source(workdir, megapixels, mode, orientation):
+    """Synthetic 4:3 photo-like image (gradient + noise) in `mode` with an EXIF orientation tag"""
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    gradient = Image.linear_gradient('L').resize((width, height))
+    noise = Image.effect_noise((width, height), 48)
+    img = Image.merge('RGB', (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    if mode == 'RGBA':
+        img = img.convert('RGBA')
+        img.putalpha(gradient)
+    elif mode == 'P':
+        img = img.quantize(colors=256)
+    elif mode != 'RGB':
+        img = img.convert(mode)
+
+    image_format = 'JPEG' if mode in JPEG_MODES else 'PNG'
+    exif = Image.Exif()
+    exif[EXIF_ORIENTATION] = orientation
+    path = os.path.join(workdir, f'{megapixels:g}mp_{mode}_o{orientation}.{image_format.lower()}')
+    img.save(path, format=image_format, quality=90, exif=exif)
+    return path, image_format
+
+
+def run_stages(path, sizes, formats):
+    """One pass over every stage; {stage: seconds}, {stage: peak RSS so far}, {format: bytes}"""
+    seconds, rss, output_bytes = {}, {}, {}
+
+    start = time.perf_counter()
+    img, original_size = imaging.load(path, sizes)
+    seconds['decode'] = time.perf_counter() - start
+    rss['decode'] = peak_rss_mb()
+
+    start = time.perf_counter()
+    if imaging.needs_upscale(original_size):
+        img = imaging.upscale(img)
+    seconds['upscale'] = time.perf_counter() - start
+    rss['upscale'] = peak_rss_mb()
+
+    start = time.perf_counter()
+    levels = imaging.build_pyramid(img, sizes)
+    seconds['fit'] = time.perf_counter() - start
+    rss['fit'] = peak_rss_mb()
+
+    start = time.perf_counter()
+    for size_name, level in levels.items():
+        for image_format in formats:
+            data = imaging.encode(level, image_format, **imaging.get_encoder_options(size_name, image_format))
+            output_bytes[image_format] = output_bytes.get(image_format, 0) + len(data)
+    seconds['encode'] = time.perf_counter() - start
+    rss['encode'] = peak_rss_mb()
+
+    start = time.perf_counter()
+    imaging.describe(original_size, list(levels.values())[-1])
+    seconds['describe'] = time.perf_counter() - start
+    rss['describe'] = peak_rss_mb()
+
+    del img, levels
+    start = time.perf_counter()
+    imaging.render_derivatives(path, sizes, formats)
+    seconds['total'] = time.perf_counter() - start
+    # Pool workers are reaped first so their peak RSS is counted
+    imaging.shutdown_executor(wait=True)
+    rss['total'] = peak_rss_mb()
+    return seconds, rss, output_bytes
+
+
+def measure(path, sizes, formats):
+    """run_stages() in a forked child (clean peak RSS); result travels back as JSON"""
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        status = 0
+        try:
+            payload = dict(zip(('seconds', 'rss', 'bytes'), run_stages(path, sizes, formats)))
+        except Exception as e:
+            imaging.shutdown_executor(wait=True)
+            payload = {'error': str(e)}
+            status = 1
+        try:
+            os.write(write_fd, json.dumps(payload).encode())
+        finally:
+            os._exit(status)
+
+    os.close(write_fd)
+    with os.fdopen(read_fd) as reader:
+        output = json.loads(reader.read() or '{"error": "no output"}')
+    os.waitpid(pid, 0)
+    if 'error' in output:
+        raise RuntimeError(output['error'])
+    return output
+
+
+def git_revision():
+    try:
+        result = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True, timeout=5,
+        )
+        return result.stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the image pipeline per stage (latency, output bytes, peak RSS); JSON output for comparisons'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--megapixels', type=float, nargs='+', default=[0.5, 4, 12], help='Source sizes')
+        parser.add_argument('--modes', nargs='+', default=['RGB', 'RGBA', 'P', 'L', 'CMYK'], help='Source colour modes')
+        parser.add_argument('--orientations', type=int, nargs='+', default=[1, 6], help='EXIF orientation tags')
+        parser.add_argument('--formats', nargs='+', help='Output formats (default: configured)')
+        parser.add_argument('--runs', type=int, default=3, help='Runs per case (median latency, max RSS)')
+        parser.add_argument('--json', dest='json_path', help='Write results to this file')
+        parser.add_argument('--compare', help='Earlier --json results to compare against')
+        parser.add_argument('--threshold', type=float, default=10.0, help='Slowdown (%%) reported as a regression')
+        parser.add_argument('--fail-on-regression', action='store_true', help='Exit with an error on regressions')
+
+    def handle(self, *args, **options):
+        sizes = imaging.get_sizes()
+        formats = [f for f in (options['formats'] or imaging.get_formats()) if f in imaging.get_formats()]
+        if not formats:
+            raise CommandError('None of the requested formats can be encoded by this Pillow build')
+        baseline = self.load_baseline(options['compare'])
+
+        cases = []
+        with tempfile.TemporaryDirectory() as workdir:
+            for megapixels in options['megapixels']:
+                for mode in options['modes']:
+                    for orientation in options['orientations']:
+                        path, source_format = make_source(workdir, megapixels, mode, orientation)
+                        runs = [measure(path, sizes, formats) for _ in range(options['runs'])]
+                        case = {
+                            'name': f'{megapixels:g}mp-{mode}-o{orientation}',
+                            'megapixels': megapixels,
+                            'mode': mode,
+                            'orientation': orientation,
+                            'source_format': source_format,
+                            'source_bytes': os.path.getsize(path),
+                            'ms': {
+                                stage: round(statistics.median(run['seconds'][stage] for run in runs) * 1000, 2)
+                                for stage in STAGES
+                            },
+                            'peak_rss_mb': {
+                                stage: round(max(run['rss'][stage] for run in runs), 1) for stage in STAGES
+                            },
+                            'output_bytes': runs[0]['bytes'],
+                        }
+                        cases.append(case)
+                        self.print_case(case, formats)
+
+        results = {
+            'meta': {
+                'revision': git_revision(),
+                'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'pillow': Image.__version__,
+                'libjpeg_turbo': features.check_feature('libjpeg_turbo'),
+                'cpus': os.cpu_count(),
+                'profile': imaging.get_profile(),
+                'sizes': {name: list(size) for name, size in sizes.items()},
+                'formats': formats,
+                'runs': options['runs'],
+            },
+            'cases': cases,
+        }
+        if options['json_path']:
+            with open(options['json_path'], 'w') as handle:
+                json.dump(results, handle, indent=2)
+            self.stdout.write(f"\nResults written to {options['json_path']}")
+
+        regressions = self.compare(baseline, results, options['threshold']) if baseline else []
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f"{len(regressions)} stage(s) slower than {options['threshold']:g}% over the baseline")
+        self.stdout.write(self.style.SUCCESS('\nBenchmark complete'))
+
+    def load_baseline(self, path):
+        if not path:
+            return None
+        try:
+            with open(path) as handle:
+                return json.load(handle)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Cannot read baseline {path}: {e}")
+
+    def print_case(self, case, formats):
+        timings = '  '.join(f"{stage} {case['ms'][stage]:.0f}" for stage in STAGES)
+        output = ', '.join(f"{f} {case['output_bytes'].get(f, 0) / 1024:.0f} KB" for f in formats)
+        self.stdout.write(
+            f"{case['name']:<18} ms: {timings}  | peak RSS {case['peak_rss_mb']['total']:.0f} MB | {output}"
+        )
+
+    def compare(self, baseline, results, threshold):
+        """Print per-stage latency changes for cases present in both runs; returns the regressions"""
+        previous = {case['name']: case for case in baseline.get('cases', [])}
+        self.stdout.write(f"\nAgainst {baseline.get('meta', {}).get('revision') or 'baseline'}:")
+        regressions = []
+        for case in results['cases']:
+            before = previous.get(case['name'])
+            if before is None:
+                continue
+            changes = []
+            for stage in STAGES:
+                old, new = before['ms'].get(stage), case['ms'][stage]
+                if not old:
+                    continue
+                change = (new - old) * 100 / old
+                # Sub-millisecond stages are noise
+                if change > threshold and new - old >= 1:
+                    regressions.append((case['name'], stage, change))
+                    changes.append(self.style.ERROR(f"{stage} {change:+.0f}%"))
+                else:
+                    changes.append(f"{stage} {change:+.0f}%")
+            self.stdout.write(f"  {case['name']:<18} " + '  '.join(changes))
+        return regressions
@@ -0,0 +1,123 @@
+"""
+Django management command to compare the legacy sequential image pipeline
+with the single-decode pyramid pipeline (apps.products.imaging)
+Usage: python manage.py benchmark_media --megapixels 2 12 24 --runs 3
+"""
+
+from django.core.management.base import BaseCommand
+from apps.products import imaging
+from io import BytesIO
+from PIL import Image, ImageEnhance, ImageOps
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+
+def legacy_pipeline(path):
+    """The previous process_image: full decode, optional upscale, fit + WebP method=6 per size"""
+    results = {}
+    with Image.open(path) as img:
+        img = img.convert('RGB')
+        if img.width < 800 or img.height < 800:
+            upscaled = img.resize((img.width * 2, img.height * 2), Image.Resampling.LANCZOS)
+            img = ImageEnhance.Sharpness(upscaled).enhance(1.2)
+        for size_name, dimensions in imaging.DEFAULT_SIZES.items():
+            resized = ImageOps.fit(img, dimensions, method=Image.Resampling.LANCZOS, centering=(0.5, 0.5))
+            output = BytesIO()
+            resized.save(output, format='WEBP', quality=85, method=6)
+            results[size_name] = output.getvalue()
+    return results
+
+
+def pyramid_pipeline(path):
+    # WebP only, to compare like for like with the legacy pipeline
+    return imaging.render_derivatives(path, formats=['WEBP'])
+
+
+PIPELINES = {
+    'legacy': legacy_pipeline,
+    'pyramid': pyramid_pipeline,
+}
+
+
+def peak_rss_mb():
+    """Peak RSS of this process and its (reaped) children, in MB"""
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / scale
+
+
+def measure(pipeline, path):
+    """
+    Run the pipeline in a forked child so every measurement starts from a
+    clean peak RSS; returns (seconds, peak_rss_mb)
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        status = 0
+        try:
+            start = time.perf_counter()
+            PIPELINES[pipeline](path)
+            elapsed = time.perf_counter() - start
+            # Pool workers are reaped first so their peak RSS is counted
+            # (and so they do not outlive us holding the pipe open)
+            imaging.shutdown_executor(wait=True)
+            os.write(write_fd, f'{elapsed} {peak_rss_mb()}'.encode())
+        except Exception as e:
+            imaging.shutdown_executor(wait=True)
+            os.write(write_fd, f'error {e}'.encode())
+            status = 1
+        finally:
+            os._exit(status)
+
+    os.close(write_fd)
+    with os.fdopen(read_fd) as reader:
+        output = reader.read()
+    os.waitpid(pid, 0)
+    if output.startswith('error'):
+        raise RuntimeError(output)
+    elapsed, rss = output.split()
+    return float(elapsed), float(rss)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the legacy and pyramid image pipelines (wall time and peak RSS per megapixel)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--megapixels', type=float, nargs='+', default=[2, 12, 24], help='Source sizes to test')
+        parser.add_argument('--runs', type=int, default=3, help='Timed runs per pipeline and size')
+        parser.add_argument('--format', default='JPEG', choices=['JPEG', 'PNG'], help='Source file format')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as workdir:
+            for megapixels in options['megapixels']:
+                path = self.make_source(workdir, megapixels, options['format'])
+                self.stdout.write(f"\n{megapixels:g} MP {options['format']} source:")
+                for pipeline in PIPELINES:
+                    runs = [measure(pipeline, path) for _ in range(options['runs'])]
+                    seconds = statistics.median(run[0] for run in runs)
+                    rss = max(run[1] for run in runs)
+                    self.stdout.write(
+                        f"  {pipeline:<8} {seconds * 1000:8.0f} ms  {seconds * 1000 / megapixels:6.0f} ms/MP"
+                        f"  peak RSS {rss:7.1f} MB  {rss / megapixels:6.1f} MB/MP"
+                    )
+
+        self.stdout.write(self.style.SUCCESS('\nBenchmark complete'))
+
+    def make_source(self, workdir, megapixels, image_format):
+        """Synthetic 4:3 photo-like image (gradient + noise, so encoders have real work)"""
+        width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+        height = int(width * 3 / 4)
+        gradient = Image.linear_gradient('L').resize((width, height))
+        noise = Image.effect_noise((width, height), 48)
+        img = Image.merge('RGB', (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+
+        path = os.path.join(workdir, f'source_{megapixels:g}mp.{image_format.lower()}')
+        img.save(path, format=image_format, quality=90)
+        return path
@@ -0,0 +1,134 @@
+"""
+Django management command to compare the legacy per-filter variant joins
+with the compiled single EXISTS filter on a seeded catalog
+Usage: python manage.py benchmark_variant_filters --products 20000 --explain
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from apps.products.filters import compile_variant_filter
+from apps.products.models import Category, Product, ProductVariant
+from decimal import Decimal
+import random
+import statistics
+import time
+
+
+class Rollback(Exception):
+    """Raised to discard the seeded catalog"""
+
+
+def legacy_variant_filter(queryset, params):
+    """The previous ProductViewSet filters: one variants__ join + DISTINCT per param"""
+    if params.get('min_price'):
+        queryset = queryset.filter(variants__price__gte=params['min_price']).distinct()
+    if params.get('max_price'):
+        queryset = queryset.filter(variants__price__lte=params['max_price']).distinct()
+    if params.get('color'):
+        queryset = queryset.filter(variants__color__icontains=params['color']).distinct()
+    if params.get('lens_type'):
+        queryset = queryset.filter(variants__lens_type=params['lens_type']).distinct()
+    if params.get('material'):
+        queryset = queryset.filter(variants__material=params['material']).distinct()
+    if params.get('size'):
+        queryset = queryset.filter(variants__size=params['size']).distinct()
+    if params.get('in_stock') == 'true':
+        queryset = queryset.filter(variants__stock__gt=0, variants__is_active=True).distinct()
+    return queryset
+
+
+class Command(BaseCommand):
+    help = 'Benchmark legacy variant joins against the compiled EXISTS filter (seeded data is rolled back)'
+
+    COLORS = ['Black', 'Gold', 'Silver', 'Tortoise', 'Blue', 'Red', 'Clear', 'Brown']
+    MATERIALS = ['acetate', 'metal', 'titanium', 'plastic', 'wood', 'mixed']
+    LENS_TYPES = ['clear', 'prescription', 'polarized', 'photochromic', 'blue_light', 'sunglasses']
+    SIZES = ['XS', 'S', 'M', 'L', 'XL']
+
+    SCENARIOS = {
+        'price range': {'min_price': '500000', 'max_price': '2000000'},
+        'color + size': {'color': 'black', 'size': 'M'},
+        'all variant filters': {
+            'min_price': '300000', 'max_price': '5000000', 'color': 'black',
+            'material': 'acetate', 'size': 'M', 'in_stock': 'true',
+        },
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=20000, help='Number of seeded products')
+        parser.add_argument('--variants', type=int, default=4, help='Variants per product')
+        parser.add_argument('--runs', type=int, default=20, help='Timed runs per scenario')
+        parser.add_argument('--explain', action='store_true', help='Print query plans')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.seed(options)
+                for name, params in self.SCENARIOS.items():
+                    self.run_scenario(name, params, options)
+                raise Rollback
+        except Rollback:
+            self.stdout.write(self.style.SUCCESS('Variant filter benchmark complete (seeded data rolled back)'))
+
+    def seed(self, options):
+        """Bulk insert a synthetic catalog; bulk_create skips save() and signals"""
+        rng = random.Random(options['seed'])
+        category, _ = Category.objects.get_or_create(slug='benchmark', defaults={'name': 'Benchmark'})
+
+        started = time.perf_counter()
+        products = Product.objects.bulk_create([
+            Product(
+                name=f'Benchmark {i}', slug=f'benchmark-{i}', sku_prefix=f'BENCH{i}',
+                category=category, brand='Bench', base_price=Decimal('100000'),
+                short_description='', description='',
+            )
+            for i in range(options['products'])
+        ], batch_size=1000)
+
+        variants = []
+        for product in products:
+            for j in range(options['variants']):
+                variants.append(ProductVariant(
+                    product=product,
+                    sku=f'{product.sku_prefix}-{j}',
+                    color=rng.choice(self.COLORS),
+                    material=rng.choice(self.MATERIALS),
+                    lens_type=rng.choice(self.LENS_TYPES),
+                    size=rng.choice(self.SIZES),
+                    price=Decimal(rng.randint(200, 8000) * 1000),
+                    stock=rng.choice([0, 0, 1, 5, 20]),
+                    is_active=rng.random() < 0.95,
+                ))
+        ProductVariant.objects.bulk_create(variants, batch_size=2000)
+
+        self.stdout.write(
+            f"Seeded {len(products)} products / {len(variants)} variants "
+            f"in {time.perf_counter() - started:.1f} s"
+        )
+
+    def run_scenario(self, name, params, options):
+        base = Product.objects.filter(is_active=True)
+        querysets = {
+            'legacy joins': legacy_variant_filter(base, params),
+            'compiled EXISTS': base.filter(compile_variant_filter(params)),
+        }
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\n{name}: {params}"))
+        for label, queryset in querysets.items():
+            page = queryset.order_by('-created_at')
+
+            timings = []
+            for _ in range(options['runs']):
+                started = time.perf_counter()
+                count = page.count()
+                list(page.values_list('pk', flat=True)[:20])
+                timings.append((time.perf_counter() - started) * 1000)
+
+            self.stdout.write(
+                f"  {label:<16} count={count:<7} median {statistics.median(timings):.1f} ms, "
+                f"max {max(timings):.1f} ms"
+            )
+            if options['explain']:
+                for line in page[:20].explain().splitlines():
+                    self.stdout.write(f"    {line}")
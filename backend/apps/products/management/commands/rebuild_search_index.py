@@ -0,0 +1,32 @@
+"""
+Django management command to (re)build the product search index
+Usage: python manage.py rebuild_search_index [--missing-only]
+"""
+
+from django.core.management.base import BaseCommand
+from apps.products.models import Product
+from apps.products.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the diacritic-folded product search index'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--missing-only',
+            action='store_true',
+            help='Only index products that have no search document yet',
+        )
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        queryset = Product.objects.all()
+        if options['missing_only']:
+            queryset = queryset.filter(search_document__isnull=True)
+
+        count = 0
+        for product in queryset.only('pk', 'name', 'brand', 'short_description', 'description').iterator(chunk_size=500):
+            backend.index(product)
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} products with {type(backend).__name__}'))
@@ -0,0 +1,149 @@
+"""
+Django management command to rebuild processed images whose processing
+profile is out of date (after changing sizes, formats or encoder settings)
+Usage: python manage.py reprocess_media [--batch-size 50] [--max-inflight 4] [--reset] [--sync]
+
+Stale rows are found by comparing ProductMedia.processing_profile with the
+current profile, walked in primary key order and queued as bounded batches
+of reprocess_media_batch on a dedicated queue (PRODUCT_MEDIA_REPROCESS_QUEUE)
+so order processing is never stuck behind a bulk rebuild. The last fully
+completed batch is checkpointed in the cache; an interrupted run resumes
+from there, and rows that became current in the meantime are skipped.
+A run that reaches the end of the scan clears the checkpoint, so rows
+that failed are retried by the next run; a --limit run keeps it and the
+next run carries on from there.
+"""
+
+from collections import deque
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from apps.products.imaging import get_profile
+from apps.products.models import ProductMedia
+from apps.products.tasks import reprocess_media_batch
+import time
+
+
+CHECKPOINT_KEY = 'products:reprocess_media:checkpoint:{profile}'
+POLL_INTERVAL = 0.5
+
+
+class Command(BaseCommand):
+    help = 'Rebuild processed images that were made with an older processing profile (resumable)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help='Media rows per Celery task')
+        parser.add_argument('--max-inflight', type=int, default=4, help='Batches queued or running at once')
+        parser.add_argument('--limit', type=int, help='Stop after queueing this many rows')
+        parser.add_argument(
+            '--queue',
+            default=getattr(settings, 'PRODUCT_MEDIA_REPROCESS_QUEUE', 'media_bulk'),
+            help='Celery queue for the batches',
+        )
+        parser.add_argument('--reset', action='store_true', help='Ignore the saved checkpoint and rescan from the start')
+        parser.add_argument('--sync', action='store_true', help='Process batches in this process instead of Celery')
+        parser.add_argument('--dry-run', action='store_true', help='Only count stale rows')
+
+    def handle(self, *args, **options):
+        profile = get_profile()
+        checkpoint_key = CHECKPOINT_KEY.format(profile=profile)
+        if options['reset']:
+            cache.delete(checkpoint_key)
+        checkpoint = cache.get(checkpoint_key) or 0
+
+        stale = ProductMedia.objects.filter(media_type='image').exclude(
+            processing_profile=profile
+        ).exclude(original_file='')
+        remaining = stale.filter(pk__gt=checkpoint).count()
+        self.stdout.write(
+            f"Profile {profile}: {stale.count()} stale rows, {remaining} after checkpoint {checkpoint}"
+        )
+        if options['dry_run'] or not remaining:
+            return
+
+        # A --limit below the stale count stops short of the end: keep the checkpoint
+        capped = bool(options['limit']) and options['limit'] < remaining
+        if capped:
+            remaining = options['limit']
+
+        self.started = time.monotonic()
+        self.totals = {'processed': 0, 'skipped': 0, 'failed': 0}
+        self.remaining = remaining
+        self.checkpoint_frozen = False
+        pending = deque()
+        queued = 0
+        last_pk = checkpoint
+
+        try:
+            while queued < remaining:
+                size = min(options['batch_size'], remaining - queued)
+                ids = list(stale.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:size])
+                if not ids:
+                    break
+                last_pk = ids[-1]
+                queued += len(ids)
+
+                if options['sync']:
+                    self.complete(checkpoint_key, last_pk, reprocess_media_batch(ids))
+                    continue
+
+                pending.append((last_pk, reprocess_media_batch.apply_async(args=[ids], queue=options['queue'])))
+                while len(pending) >= options['max_inflight']:
+                    self.wait_for_oldest(pending, checkpoint_key)
+
+            while pending:
+                self.wait_for_oldest(pending, checkpoint_key)
+
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING(
+                f"\nInterrupted; resume from checkpoint {cache.get(checkpoint_key) or 0} by running the command again"
+            ))
+            return
+
+        self.report(final=True)
+        if capped:
+            self.stdout.write(
+                f"Stopped at --limit; the next run resumes from checkpoint {cache.get(checkpoint_key) or 0}"
+            )
+        else:
+            cache.delete(checkpoint_key)
+
+    def wait_for_oldest(self, pending, checkpoint_key):
+        """
+        Block until the oldest batch finishes, then move the checkpoint to its
+        last row (batches complete in FIFO order from the checkpoint's view,
+        so it never skips past unfinished work)
+        """
+        batch_last_pk, result = pending[0]
+        while not result.ready():
+            time.sleep(POLL_INTERVAL)
+        pending.popleft()
+        counts = result.get(propagate=False)
+        if isinstance(counts, Exception):
+            # Keep resuming from before this batch
+            self.stderr.write(f"Batch ending at {batch_last_pk} failed: {counts}")
+            self.checkpoint_frozen = True
+            counts = {}
+        self.complete(checkpoint_key, batch_last_pk, counts)
+
+    def complete(self, checkpoint_key, batch_last_pk, counts):
+        for key in self.totals:
+            self.totals[key] += counts.get(key, 0)
+        if not self.checkpoint_frozen:
+            cache.set(checkpoint_key, batch_last_pk, None)
+        self.report()
+
+    def report(self, final=False):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        done = sum(self.totals.values())
+        rate = done / elapsed
+        eta = (self.remaining - done) / rate if rate else 0
+        message = (
+            f"{done}/{self.remaining} rows ({self.totals['processed']} rebuilt, "
+            f"{self.totals['skipped']} already current, {self.totals['failed']} failed) "
+            f"in {elapsed:.1f}s, {rate:.1f} rows/s"
+        )
+        if final:
+            self.stdout.write(self.style.SUCCESS(message))
+        else:
+            self.stdout.write(f"{message}, ETA {eta:.0f}s")
@@ -0,0 +1,263 @@
+"""
+Content-addressed, storage-agnostic store for product media
+
+Originals are identified by the SHA-256 of their bytes and derivatives by
+(content hash, processing profile); each derivative set holds every size
+in every configured format. A repeated upload of the same file points at
+the stored original and reuses its derivatives, so it costs no processing
+and no extra disk space.
+
+Everything goes through the Django storage API, so media workers do not
+need the web container's disk: originals are read as streams (spooled
+when the backend cannot seek, as with object storage), and a local copy
+is made only for tools that need a real path (ffmpeg), size-capped and
+deleted afterwards.
+"""
+
+from contextlib import contextmanager
+import hashlib
+import os
+import tempfile
+import logging
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from .imaging import FORMAT_EXTENSIONS, FORMAT_MIME_TYPES, LEGACY_FORMATS, get_sizes
+
+logger = logging.getLogger(__name__)
+
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Non-seekable originals are buffered in memory up to this size, then on disk
+SPOOL_MAX_MEMORY = 16 * 1024 * 1024
+
+
+class SourceTooLarge(Exception):
+    """An original exceeds PRODUCT_MEDIA_MAX_SOURCE_BYTES"""
+
+
+def get_temp_dir():
+    """Where spooled originals and ffmpeg copies go (None: system default)"""
+    return getattr(settings, 'PRODUCT_MEDIA_TEMP_DIR', None)
+
+
+def get_max_source_bytes():
+    return getattr(settings, 'PRODUCT_MEDIA_MAX_SOURCE_BYTES', 2 * 1024 ** 3)
+
+
+def hash_file(file):
+    """SHA-256 hex digest of a file object, read in chunks (rewound afterwards when possible)"""
+    if not isinstance(file, File):
+        file = File(file)
+    hasher = hashlib.sha256()
+    for chunk in file.chunks(HASH_CHUNK_SIZE):
+        hasher.update(chunk)
+    if file.seekable():
+        file.seek(0)
+    return hasher.hexdigest()
+
+
+def copy_stream(source, target, limit=None):
+    """Copy in HASH_CHUNK_SIZE chunks; SourceTooLarge past `limit` bytes"""
+    copied = 0
+    while True:
+        chunk = source.read(HASH_CHUNK_SIZE)
+        if not chunk:
+            return copied
+        copied += len(chunk)
+        if limit is not None and copied > limit:
+            raise SourceTooLarge(f"Source is larger than {limit} bytes")
+        target.write(chunk)
+
+
+def open_original(field_file):
+    """Seekable binary stream of a FileField's file (see open_stored)"""
+    return open_stored(field_file.name, field_file.storage)
+
+
+@contextmanager
+def open_stored(name, storage=default_storage):
+    """
+    Seekable binary stream of a stored file, from any storage backend
+    Streams that cannot seek (object storage bodies) are spooled first
+    """
+    with storage.open(name, 'rb') as handle:
+        if handle.seekable():
+            yield handle
+            return
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY, dir=get_temp_dir()) as spool:
+            copy_stream(handle, spool, limit=get_max_source_bytes())
+            spool.seek(0)
+            yield spool
+
+
+@contextmanager
+def local_path(field_file):
+    """
+    Filesystem path of a stored file for tools that need one (ffmpeg):
+    the file itself on local storage, otherwise a size-capped temporary
+    copy that is removed on exit
+    """
+    try:
+        path = field_file.storage.path(field_file.name)
+    except NotImplementedError:
+        path = None
+    if path and os.path.exists(path):
+        yield path
+        return
+
+    suffix = os.path.splitext(field_file.name)[1]
+    copy = tempfile.NamedTemporaryFile(suffix=suffix, dir=get_temp_dir(), delete=False)
+    try:
+        with copy, field_file.storage.open(field_file.name, 'rb') as source:
+            copy_stream(source, copy, limit=get_max_source_bytes())
+        yield copy.name
+    finally:
+        os.unlink(copy.name)
+
+
+def get_content_hash(file):
+    """Hash computed while uploading (apps.products.uploads) or hash the file now"""
+    return getattr(file, 'content_hash', None) or hash_file(file)
+
+
+def derivative_path(content_hash, profile, size_name, ext='webp'):
+    """Storage name of one derivative; sharded by hash prefix"""
+    return os.path.join('products/processed', size_name, content_hash[:2], f'{content_hash}_{profile}.{ext}')
+
+
+def find_original(content_hash):
+    """Storage name of an already stored original with this content, if any"""
+    from .models import ProductMedia
+
+    names = ProductMedia.objects.filter(content_hash=content_hash).exclude(
+        original_file=''
+    ).values_list('original_file', flat=True).distinct()[:5]
+    for name in names:
+        if default_storage.exists(name):
+            return name
+    return None
+
+
+def find_image_info(content_hash):
+    """imaging.ImageInfo recorded for another upload of this content, if any"""
+    from .imaging import ImageInfo
+    from .models import ProductMedia
+
+    row = ProductMedia.objects.filter(content_hash=content_hash, width__isnull=False).exclude(
+        placeholder=''
+    ).values_list('width', 'height', 'dominant_color', 'placeholder').first()
+    return ImageInfo(*row) if row else None
+
+
+def find_derivatives(content_hash, profile):
+    """processed_images manifest for (hash, profile), or None if never built"""
+    from .models import MediaDerivativeSet
+
+    return MediaDerivativeSet.objects.filter(
+        content_hash=content_hash, profile=profile
+    ).values_list('processed_images', flat=True).first()
+
+
+def store_derivatives(content_hash, profile, renditions):
+    """
+    Write renditions (imaging.Rendition) under their content-addressed names,
+    record the set and return its processed_images manifest:
+
+        {
+            "thumbnail": url, "medium": url, "large": url,   # legacy keys (WebP)
+            "renditions": [
+                {"size": "thumbnail", "format": "avif", "url": ..., "width": 300, "height": 300, "bytes": 8123},
+                ...
+            ]
+        }
+    """
+    from .models import MediaDerivativeSet
+
+    entries = []
+    for rendition in renditions:
+        path = derivative_path(
+            content_hash, profile, rendition.size_name, FORMAT_EXTENSIONS[rendition.image_format]
+        )
+        if not default_storage.exists(path):
+            path = default_storage.save(path, ContentFile(rendition.data))
+        entries.append({
+            'size': rendition.size_name,
+            'format': rendition.image_format.lower(),
+            'url': default_storage.url(path),
+            'width': rendition.width,
+            'height': rendition.height,
+            'bytes': len(rendition.data),
+        })
+
+    derivative_set, created = MediaDerivativeSet.objects.get_or_create(
+        content_hash=content_hash,
+        profile=profile,
+        defaults={'processed_images': build_manifest(entries)},
+    )
+    if not created:
+        # Built concurrently by another upload of the same file: keep the first
+        logger.info(f"Derivatives for {content_hash[:12]} ({profile}) already stored")
+    return derivative_set.processed_images
+
+
+def build_manifest(entries):
+    """processed_images from rendition entries; legacy size keys point at WebP (else JPEG)"""
+    manifest = {}
+    for image_format in reversed(LEGACY_FORMATS):
+        for entry in entries:
+            if entry['format'] == image_format.lower():
+                manifest[entry['size']] = entry['url']
+    manifest['renditions'] = sorted(entries, key=lambda entry: (entry['format'], entry['width']))
+    return manifest
+
+
+def build_srcset(processed_images):
+    """
+    {mime type: srcset string} for <picture><source type=... srcset=...>,
+    smallest format first. Manifests from before renditions existed only
+    have the legacy WebP URLs; their widths come from the configured sizes.
+    """
+    if not processed_images:
+        return {}
+
+    renditions = processed_images.get('renditions')
+    if renditions is None:
+        sizes = get_sizes()
+        renditions = [
+            {'format': 'webp', 'url': url, 'width': sizes[size_name][0]}
+            for size_name, url in processed_images.items()
+            if size_name in sizes
+        ]
+
+    by_format = {}
+    for entry in sorted(renditions, key=lambda entry: entry['width']):
+        by_format.setdefault(entry['format'], []).append(f"{entry['url']} {entry['width']}w")
+
+    srcset = {}
+    for image_format in FORMAT_MIME_TYPES:
+        if image_format.lower() in by_format:
+            srcset[FORMAT_MIME_TYPES[image_format]] = ', '.join(by_format[image_format.lower()])
+    return srcset
+
+
+def store_tree(local_dir, prefix):
+    """
+    Copy every file under local_dir to storage as prefix/<relative path>,
+    replacing existing files so relative references (HLS playlists) hold
+    """
+    names = []
+    for root, _, files in os.walk(local_dir):
+        for filename in sorted(files):
+            file_path = os.path.join(root, filename)
+            name = os.path.join(prefix, os.path.relpath(file_path, local_dir)).replace(os.sep, '/')
+            if default_storage.exists(name):
+                default_storage.delete(name)
+            with open(file_path, 'rb') as handle:
+                # Storage backends upload File objects chunk by chunk (multipart on S3)
+                names.append(default_storage.save(name, File(handle)))
+    return names
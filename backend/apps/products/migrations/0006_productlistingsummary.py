@@ -0,0 +1,73 @@
+# Generated by Django 5.2.9 on 2026-10-17 02:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_listing_summaries(apps, schema_editor):
+    """Build a summary row for every existing product"""
+    Product = apps.get_model('products', 'Product')
+    ProductVariant = apps.get_model('products', 'ProductVariant')
+    ProductMedia = apps.get_model('products', 'ProductMedia')
+    ProductListingSummary = apps.get_model('products', 'ProductListingSummary')
+
+    summaries = {pk: ProductListingSummary(product_id=pk) for pk in Product.objects.values_list('pk', flat=True)}
+
+    for variant in ProductVariant.objects.filter(is_active=True).iterator():
+        summary = summaries[variant.product_id]
+        display_price = variant.sale_price if variant.sale_price else variant.price
+        if summary.min_price is None or display_price < summary.min_price:
+            summary.min_price = display_price
+        if summary.max_price is None or display_price > summary.max_price:
+            summary.max_price = display_price
+        summary.total_stock += variant.stock
+        summary.in_stock = summary.in_stock or variant.stock > 0
+        if variant.is_default:
+            summary.default_variant_id = variant.id
+            summary.default_sku = variant.sku
+            summary.default_color = variant.color
+            summary.default_price = variant.price
+            summary.default_sale_price = variant.sale_price
+
+    seen = set()
+    media_qs = ProductMedia.objects.filter(media_type='image', is_processed=True).order_by('display_order', 'created_at')
+    for product_id, processed_images in media_qs.values_list('product_id', 'processed_images').iterator():
+        if product_id in seen:
+            continue
+        seen.add(product_id)
+        if processed_images and 'thumbnail' in processed_images:
+            summaries[product_id].thumbnail_url = processed_images['thumbnail']
+
+    ProductListingSummary.objects.bulk_create(summaries.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_alter_product_sku_prefix_alter_productvariant_sku'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductListingSummary',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='listing_summary', serialize=False, to='products.product')),
+                ('min_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('max_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('default_sku', models.CharField(blank=True, max_length=100)),
+                ('default_color', models.CharField(blank=True, max_length=50)),
+                ('default_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('default_sale_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('thumbnail_url', models.CharField(blank=True, max_length=500)),
+                ('total_stock', models.IntegerField(default=0)),
+                ('in_stock', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('default_variant', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='products.productvariant')),
+            ],
+            options={
+                'verbose_name_plural': 'Product Listing Summaries',
+                'indexes': [models.Index(fields=['in_stock'], name='products_pr_in_stoc_0b20e9_idx'), models.Index(fields=['min_price'], name='products_pr_min_pri_d3a12c_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_listing_summaries, migrations.RunPython.noop),
+    ]
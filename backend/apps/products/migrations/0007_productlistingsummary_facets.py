@@ -0,0 +1,68 @@
+# Generated by Django 5.2.9 on 2026-10-17 02:25
+
+from django.db import migrations, models
+
+
+def backfill_facet_attributes(apps, schema_editor):
+    """Collect distinct variant attributes into the existing summary rows"""
+    ProductVariant = apps.get_model('products', 'ProductVariant')
+    ProductListingSummary = apps.get_model('products', 'ProductListingSummary')
+
+    attributes = {}
+    for product_id, color, material, lens_type, size in ProductVariant.objects.filter(
+        is_active=True
+    ).values_list('product_id', 'color', 'material', 'lens_type', 'size').iterator():
+        entry = attributes.setdefault(product_id, (set(), set(), set(), set()))
+        if color:
+            entry[0].add(color)
+        entry[1].add(material)
+        entry[2].add(lens_type)
+        entry[3].add(size)
+
+    summaries = list(ProductListingSummary.objects.filter(product_id__in=attributes.keys()))
+    for summary in summaries:
+        colors, materials, lens_types, sizes = attributes[summary.product_id]
+        summary.colors = sorted(colors)
+        summary.materials = sorted(materials)
+        summary.lens_types = sorted(lens_types)
+        summary.sizes = sorted(sizes)
+
+    ProductListingSummary.objects.bulk_update(
+        summaries, ['colors', 'materials', 'lens_types', 'sizes'], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_productlistingsummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productlistingsummary',
+            name='colors',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='productlistingsummary',
+            name='lens_types',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='productlistingsummary',
+            name='materials',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='productlistingsummary',
+            name='sizes',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AlterField(
+            model_name='productlistingsummary',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.RunPython(backfill_facet_attributes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.9 on 2026-10-17 02:28
+
+import django.db.models.deletion
+from django.db import migrations, models, DatabaseError
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Frozen copies of the names used by apps.products.search: migrations must not
+# import live code that later refactors can change or remove
+FTS_TABLE = 'products_search_fts'
+TSVECTOR_COLUMN = 'search_vector'
+TSVECTOR_INDEX = 'products_search_vector_gin'
+
+
+def create_search_structures(apps, schema_editor):
+    """tsvector column + GIN index on PostgreSQL, FTS5 table on SQLite"""
+    table = apps.get_model('products', 'ProductSearchDocument')._meta.db_table
+    vendor = schema_editor.connection.vendor
+
+    if vendor == 'postgresql':
+        schema_editor.execute(f"ALTER TABLE {table} ADD COLUMN {TSVECTOR_COLUMN} tsvector")
+        schema_editor.execute(f"CREATE INDEX {TSVECTOR_INDEX} ON {table} USING GIN ({TSVECTOR_COLUMN})")
+    elif vendor == 'sqlite':
+        try:
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(name, brand, body)"
+            )
+        except DatabaseError as e:
+            # SQLite built without FTS5: SimpleSearchBackend fallback kicks in
+            logger.warning(f"FTS5 unavailable, product search will use the fallback backend: {e}")
+
+
+def drop_search_structures(apps, schema_editor):
+    table = apps.get_model('products', 'ProductSearchDocument')._meta.db_table
+    vendor = schema_editor.connection.vendor
+
+    if vendor == 'postgresql':
+        schema_editor.execute(f"DROP INDEX IF EXISTS {TSVECTOR_INDEX}")
+        schema_editor.execute(f"ALTER TABLE {table} DROP COLUMN IF EXISTS {TSVECTOR_COLUMN}")
+    elif vendor == 'sqlite':
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_productlistingsummary_facets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchDocument',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='products.product')),
+                ('name', models.TextField(blank=True)),
+                ('brand', models.TextField(blank=True)),
+                ('body', models.TextField(blank=True, help_text='Folded short + full description')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(create_search_structures, drop_search_structures),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.9 on 2026-10-17 02:39
+
+from django.db import migrations, models
+
+
+def backfill_category_paths(apps, schema_editor):
+    """Compute path/depth for existing categories, parents first"""
+    Category = apps.get_model('products', 'Category')
+
+    parents = dict(Category.objects.values_list('pk', 'parent_id'))
+    paths = {}
+
+    def path_for(pk, seen=()):
+        if pk not in paths:
+            parent_id = parents.get(pk)
+            # Guard against pre-existing cycles: treat the category as a root
+            prefix = path_for(parent_id, seen + (pk,)) if parent_id and parent_id not in seen else ''
+            paths[pk] = f"{prefix}{pk:06d}/"
+        return paths[pk]
+
+    for pk in parents:
+        path = path_for(pk)
+        Category.objects.filter(pk=pk).update(path=path, depth=path.count('/') - 1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0009_relatedproduct'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=255),
+        ),
+        migrations.RunPython(backfill_category_paths, migrations.RunPython.noop),
+    ]
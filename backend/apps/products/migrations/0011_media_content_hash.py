@@ -0,0 +1,36 @@
+# Generated by Django 5.2.9 on 2026-10-17 02:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0010_category_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productmedia',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, help_text='SHA-256 of the original file', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='productmedia',
+            name='processing_profile',
+            field=models.CharField(blank=True, help_text='Processing profile the processed images were built with', max_length=40),
+        ),
+        migrations.CreateModel(
+            name='MediaDerivativeSet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64)),
+                ('profile', models.CharField(max_length=40)),
+                ('processed_images', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('content_hash', 'profile'), name='unique_media_derivative_set')],
+            },
+        ),
+    ]
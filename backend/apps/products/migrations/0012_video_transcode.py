@@ -0,0 +1,23 @@
+# Generated by Django 5.2.9 on 2026-10-17 02:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0011_media_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productmedia',
+            name='hls_playlist',
+            field=models.CharField(blank=True, help_text='URL of the HLS master playlist (adaptive bitrate)', max_length=500),
+        ),
+        migrations.AddField(
+            model_name='productmedia',
+            name='processing_progress',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Percent done while a video is transcoding'),
+        ),
+    ]
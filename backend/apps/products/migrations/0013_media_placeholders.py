@@ -0,0 +1,53 @@
+# Generated by Django 5.2.9 on 2026-10-17 02:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0012_video_transcode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productlistingsummary',
+            name='thumbnail_color',
+            field=models.CharField(blank=True, max_length=7),
+        ),
+        migrations.AddField(
+            model_name='productlistingsummary',
+            name='thumbnail_height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='productlistingsummary',
+            name='thumbnail_placeholder',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='productlistingsummary',
+            name='thumbnail_width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='productmedia',
+            name='dominant_color',
+            field=models.CharField(blank=True, help_text='#rrggbb', max_length=7),
+        ),
+        migrations.AddField(
+            model_name='productmedia',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, help_text='Intrinsic height of the original', null=True),
+        ),
+        migrations.AddField(
+            model_name='productmedia',
+            name='placeholder',
+            field=models.TextField(blank=True, help_text='Tiny blurred preview as a data URI (LQIP)'),
+        ),
+        migrations.AddField(
+            model_name='productmedia',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, help_text='Intrinsic width of the original', null=True),
+        ),
+    ]
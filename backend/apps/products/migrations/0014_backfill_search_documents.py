@@ -0,0 +1,67 @@
+# Generated by Django 5.2.9 on 2026-10-17 09:12
+
+from django.db import migrations
+from django.utils.html import strip_tags
+import unicodedata
+
+
+# Frozen copies of apps.products.search names and folding rules
+FTS_TABLE = 'products_search_fts'
+TSVECTOR_COLUMN = 'search_vector'
+
+
+def fold_vietnamese(text):
+    if not text:
+        return ''
+    text = text.lower().replace('đ', 'd')
+    decomposed = unicodedata.normalize('NFD', text)
+    stripped = ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return ' '.join(stripped.split())
+
+
+def backfill_search_documents(apps, schema_editor):
+    """Search documents for products created before 0008, then fill the vendor index from them"""
+    Product = apps.get_model('products', 'Product')
+    ProductSearchDocument = apps.get_model('products', 'ProductSearchDocument')
+    connection = schema_editor.connection
+    alias = connection.alias
+
+    documents = []
+    for product in Product.objects.using(alias).filter(search_document__isnull=True).only(
+        'pk', 'name', 'brand', 'short_description', 'description'
+    ).iterator(chunk_size=500):
+        body = ' '.join(filter(None, [product.short_description, strip_tags(product.description or '')]))
+        documents.append(ProductSearchDocument(
+            product_id=product.pk,
+            name=fold_vietnamese(product.name),
+            brand=fold_vietnamese(product.brand),
+            body=fold_vietnamese(body),
+        ))
+    ProductSearchDocument.objects.using(alias).bulk_create(documents, batch_size=500)
+
+    table = ProductSearchDocument._meta.db_table
+    if connection.vendor == 'postgresql':
+        schema_editor.execute(
+            f"UPDATE {table} SET {TSVECTOR_COLUMN} = "
+            f"setweight(to_tsvector('simple', name), 'A') || "
+            f"setweight(to_tsvector('simple', brand), 'B') || "
+            f"setweight(to_tsvector('simple', body), 'C') "
+            f"WHERE {TSVECTOR_COLUMN} IS NULL"
+        )
+    elif connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names():
+        schema_editor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, name, brand, body) "
+            f"SELECT product_id, name, brand, body FROM {table} "
+            f"WHERE product_id NOT IN (SELECT rowid FROM {FTS_TABLE})"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0013_media_placeholders'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_search_documents, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,9 @@
 import random
 import string
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Substr
 from django.utils.text import slugify
 from django.core.validators import MinValueValidator, MaxValueValidator
 from decimal import Decimal
@@ -22,6 +25,11 @@ class Category(models.Model):
     is_active = models.BooleanField(default=True)
     display_order = models.IntegerField(default=0)
     
+    # Materialized path: zero-padded ids from the root, e.g. "000001/000007/"
+    # Maintained in save(); descendants of X are path__startswith=X.path
+    path = models.CharField(max_length=255, db_index=True, blank=True, editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+    
     # SEO fields
     meta_title = models.CharField(max_length=200, blank=True)
     meta_description = models.TextField(blank=True)
@@ -29,6 +37,8 @@ class Category(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    PATH_SEGMENT_WIDTH = 6
+    
     class Meta:
         verbose_name_plural = 'Categories'
         ordering = ['display_order', 'name']
@@ -36,12 +46,108 @@ class Category(models.Model):
             models.Index(fields=['slug']),
             models.Index(fields=['is_active', 'display_order']),
         ]
+    
+    def clean(self):
+        """Reject moves that would create a cycle as a form error (admin/forms via full_clean)"""
+        super().clean()
+        if self.pk and self.parent_id:
+            parent_path = Category.objects.filter(pk=self.parent_id).values_list('path', flat=True).first() or ''
+            self.check_parent(parent_path)
+    
+    def check_parent(self, parent_path):
+        if self.parent_id == self.pk or (self.path and parent_path.startswith(self.path)):
+            raise ValidationError({'parent': 'A category cannot be moved under itself or its descendants'})
         
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
-            
-        super().save(*args, **kwargs)
+        
+        # A rejected move in update_path rolls the parent change back too
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self.update_path()
+    
+    @classmethod
+    def build_path(cls, pk, parent_path=''):
+        return f"{parent_path}{pk:0{cls.PATH_SEGMENT_WIDTH}d}/"
+    
+    def update_path(self):
+        """
+        Recompute path/depth from the parent and rewrite the subtree prefix if it moved
+        Raises ValidationError for a parent inside the subtree, whose path
+        would otherwise be rewritten into itself
+        """
+        parent_path = ''
+        if self.parent_id:
+            parent_path = Category.objects.filter(pk=self.parent_id).values_list('path', flat=True).first() or ''
+            self.check_parent(parent_path)
+        
+        new_path = self.build_path(self.pk, parent_path)
+        old_path = self.path
+        if new_path == old_path:
+            return
+        
+        new_depth = new_path.count('/') - 1
+        with transaction.atomic():
+            Category.objects.filter(pk=self.pk).update(path=new_path, depth=new_depth)
+            if old_path:
+                Category.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                    path=Concat(Value(new_path), Substr('path', len(old_path) + 1)),
+                    depth=F('depth') + (new_depth - self.depth),
+                )
+        self.path, self.depth = new_path, new_depth
+    
+    def get_descendants(self, include_self=False):
+        """All categories below this one (one indexed prefix query)"""
+        queryset = Category.objects.filter(path__startswith=self.path)
+        return queryset if include_self else queryset.exclude(pk=self.pk)
+    
+    @classmethod
+    def build_tree(cls):
+        """
+        Whole active hierarchy as nested dicts, with active product counts
+        per category (`product_count`) and per subtree (`total_product_count`).
+        Two queries; categories under an inactive ancestor are left out.
+        """
+        counts = dict(
+            Product.objects.filter(is_active=True).values('category_id')
+            .annotate(count=models.Count('pk')).values_list('category_id', 'count')
+        )
+        
+        nodes = {}
+        parents = {}
+        roots = []
+        categories = cls.objects.filter(is_active=True).order_by('depth', 'display_order', 'name')
+        for category in categories:
+            node = {
+                'id': category.pk,
+                'name': category.name,
+                'slug': category.slug,
+                'image': category.image.url if category.image else None,
+                'display_order': category.display_order,
+                'depth': category.depth,
+                'path': category.path,
+                'product_count': counts.get(category.pk, 0),
+                'total_product_count': 0,
+                'children': [],
+            }
+            if category.parent_id is None:
+                roots.append(node)
+            elif category.parent_id in nodes:
+                nodes[category.parent_id]['children'].append(node)
+            else:
+                continue
+            nodes[category.pk] = node
+            parents[category.pk] = category.parent_id
+        
+        # Roll subtree totals up, deepest first
+        for pk in sorted(nodes, key=lambda pk: -nodes[pk]['depth']):
+            node = nodes[pk]
+            node['total_product_count'] += node['product_count']
+            if parents[pk] in nodes:
+                nodes[parents[pk]]['total_product_count'] += node['total_product_count']
+        
+        return roots
     
     def __str__(self):
         return self.name
@@ -380,6 +486,17 @@ class ProductMedia(models.Model):
         null=True,
         blank=True
     )
+    hls_playlist = models.CharField(
+        max_length=500,
+        blank=True,
+        help_text="URL of the HLS master playlist (adaptive bitrate)"
+    )
+    
+    # Image metadata (filled in by processing), lets pages render before any rendition loads
+    width = models.PositiveIntegerField(null=True, blank=True, help_text="Intrinsic width of the original")
+    height = models.PositiveIntegerField(null=True, blank=True, help_text="Intrinsic height of the original")
+    dominant_color = models.CharField(max_length=7, blank=True, help_text="#rrggbb")
+    placeholder = models.TextField(blank=True, help_text="Tiny blurred preview as a data URI (LQIP)")
     
     # Metadata
     alt_text = models.CharField(max_length=200, blank=True, help_text="Alt text for SEO")
@@ -399,6 +516,23 @@ class ProductMedia(models.Model):
         default='pending'
     )
     processing_error = models.TextField(blank=True)
+    processing_progress = models.PositiveSmallIntegerField(
+        default=0,
+        help_text="Percent done while a video is transcoding"
+    )
+    
+    # Content addressing (see apps.products.media_store)
+    content_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        db_index=True,
+        help_text="SHA-256 of the original file"
+    )
+    processing_profile = models.CharField(
+        max_length=40,
+        blank=True,
+        help_text="Processing profile the processed images were built with"
+    )
     
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
@@ -417,12 +551,246 @@ class ProductMedia(models.Model):
     
     def save(self, *args, **kwargs):
         is_new = self.pk is None
+        if is_new:
+            self.deduplicate()
         super().save(*args, **kwargs)
         
         # Trigger Celery task for processing (only on new uploads)
         if is_new and not self.is_processed:
             from apps.products.tasks import process_product_media
             process_product_media.delay(self.pk)
+    
+    def deduplicate(self):
+        """
+        Hash a fresh upload; if the same content is already stored, point at
+        the stored original and reuse its derivatives (no processing queued)
+        """
+        from .imaging import get_profile
+        from .media_store import find_derivatives, find_image_info, find_original, get_content_hash
+        
+        if self.original_file and not self.original_file._committed:
+            self.content_hash = get_content_hash(self.original_file.file)
+            existing = find_original(self.content_hash)
+            if existing:
+                self.original_file = existing
+        
+        if self.media_type == 'image' and self.content_hash and not self.is_processed:
+            profile = get_profile()
+            processed_images = find_derivatives(self.content_hash, profile)
+            info = find_image_info(self.content_hash)
+            if processed_images and info:
+                self.set_image_info(info)
+                self.processed_images = processed_images
+                self.processing_profile = profile
+                self.is_processed = True
+                self.processing_status = 'completed'
+
+    
+    def set_image_info(self, info):
+        """Copy an imaging.ImageInfo onto the row"""
+        self.width, self.height = info.width, info.height
+        self.dominant_color = info.dominant_color
+        self.placeholder = info.placeholder
+
+
+class MediaDerivativeSet(models.Model):
+    """
+    Processed images for one original content hash under one processing
+    profile; shared by every ProductMedia with that content
+    """
+    
+    content_hash = models.CharField(max_length=64)
+    profile = models.CharField(max_length=40)
+    processed_images = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['content_hash', 'profile'], name='unique_media_derivative_set'),
+        ]
+    
+    def __str__(self):
+        return f"{self.content_hash[:12]} ({self.profile})"
+
+
+class ProductListingSummary(models.Model):
+    """
+    Denormalized read model for product listings (one row per product)
+    Refreshed by signals whenever variants, media or stock change,
+    so list endpoints never have to aggregate variants/media per product
+    """
+
+    product = models.OneToOneField(
+        Product,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='listing_summary'
+    )
+
+    # Price range (display price = sale price if set, otherwise regular price)
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    max_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+
+    # Default variant snapshot
+    default_variant = models.ForeignKey(
+        ProductVariant,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    default_sku = models.CharField(max_length=100, blank=True)
+    default_color = models.CharField(max_length=50, blank=True)
+    default_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    default_sale_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+
+    # First processed image
+    thumbnail_url = models.CharField(max_length=500, blank=True)
+    thumbnail_width = models.PositiveIntegerField(null=True, blank=True)
+    thumbnail_height = models.PositiveIntegerField(null=True, blank=True)
+    thumbnail_color = models.CharField(max_length=7, blank=True)
+    thumbnail_placeholder = models.TextField(blank=True)
+
+    # Inventory
+    total_stock = models.IntegerField(default=0)
+    in_stock = models.BooleanField(default=False)
+
+    # Distinct attribute values across active variants (feeds the facet index)
+    colors = models.JSONField(default=list, blank=True)
+    materials = models.JSONField(default=list, blank=True)
+    lens_types = models.JSONField(default=list, blank=True)
+    sizes = models.JSONField(default=list, blank=True)
+
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        verbose_name_plural = 'Product Listing Summaries'
+        indexes = [
+            models.Index(fields=['in_stock']),
+            models.Index(fields=['min_price']),
+        ]
+
+    def __str__(self):
+        return f"Listing summary for product {self.product_id}"
+
+    def get_default_display_price(self):
+        """Mirror ProductVariant.get_display_price for the snapshot"""
+        return self.default_sale_price if self.default_sale_price else self.default_price
+
+    @classmethod
+    def build(cls, product_id):
+        """Compute (without saving) the summary for a product from its variants and media"""
+        summary = cls(product_id=product_id)
+
+        variants = list(
+            ProductVariant.objects.filter(product_id=product_id, is_active=True)
+            .values(
+                'id', 'sku', 'color', 'material', 'lens_type', 'size',
+                'price', 'sale_price', 'stock', 'is_default'
+            )
+        )
+
+        if variants:
+            display_prices = [v['sale_price'] if v['sale_price'] else v['price'] for v in variants]
+            summary.min_price = min(display_prices)
+            summary.max_price = max(display_prices)
+
+        summary.total_stock = sum(v['stock'] for v in variants)
+        summary.in_stock = any(v['stock'] > 0 for v in variants)
+        summary.colors = sorted({v['color'] for v in variants if v['color']})
+        summary.materials = sorted({v['material'] for v in variants})
+        summary.lens_types = sorted({v['lens_type'] for v in variants})
+        summary.sizes = sorted({v['size'] for v in variants})
+
+        default = next((v for v in variants if v['is_default']), None)
+        if default:
+            summary.default_variant_id = default['id']
+            summary.default_sku = default['sku']
+            summary.default_color = default['color']
+            summary.default_price = default['price']
+            summary.default_sale_price = default['sale_price']
+
+        media = ProductMedia.objects.filter(
+            product_id=product_id, media_type='image', is_processed=True
+        ).values('processed_images', 'dominant_color', 'placeholder').first()
+        if media and 'thumbnail' in media['processed_images']:
+            processed_images = media['processed_images']
+            summary.thumbnail_url = processed_images['thumbnail']
+            for rendition in processed_images.get('renditions', []):
+                if rendition['size'] == 'thumbnail':
+                    summary.thumbnail_width, summary.thumbnail_height = rendition['width'], rendition['height']
+                    break
+            summary.thumbnail_color = media['dominant_color']
+            summary.thumbnail_placeholder = media['placeholder']
+
+        return summary
+
+    @classmethod
+    def refresh(cls, product_id):
+        """Recompute and persist the summary; no-op if the product no longer exists"""
+        if not Product.objects.filter(pk=product_id).exists():
+            return None
+
+        summary = cls.build(product_id)
+        summary.save()
+        return summary
+
+
+class ProductSearchDocument(models.Model):
+    """
+    Diacritic-folded search text per product
+    Maintained by apps.products.search; the active backend builds its
+    full-text index (tsvector column / FTS5 table) from these columns
+    """
+
+    product = models.OneToOneField(
+        Product,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='search_document'
+    )
+    name = models.TextField(blank=True)
+    brand = models.TextField(blank=True)
+    body = models.TextField(blank=True, help_text="Folded short + full description")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Search document for product {self.product_id}"
+
+
+class RelatedProduct(models.Model):
+    """
+    Precomputed top-N neighbours per product
+    Rebuilt offline by apps.products.related from co-purchases blended with
+    category/brand similarity; read by ProductViewSet.related
+    """
+
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='related_links'
+    )
+    related = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='linked_from'
+    )
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+    co_purchases = models.PositiveIntegerField(default=0)
+    computed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['product', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'related'], name='unique_related_product'),
+        ]
+        indexes = [
+            models.Index(fields=['product', 'rank']),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.related_id} (#{self.rank})"
 
 
 class ProductReview(models.Model):
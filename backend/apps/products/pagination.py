@@ -0,0 +1,217 @@
+"""
+Pagination for catalog endpoints
+
+CatalogPagination keeps the default page-number behaviour and switches to
+keyset (cursor) pagination when the client asks for it with ?cursor=...
+(or ?paginate=cursor for the first page). Keyset pages seek past the last
+row's sort key instead of using OFFSET, so deep pages and infinite scroll
+cost the same as the first page, and skip COUNT(*) unless requested.
+"""
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+import json
+
+from django.db import connection
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def encode_value(value):
+    """JSON-safe sort key value; strings round-trip through the field's to_python on filtering"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def estimate_count(queryset):
+    """
+    Planner row estimate on PostgreSQL (no scan), exact COUNT elsewhere
+    Good enough for "about N results" in infinite scroll UIs
+    """
+    if connection.vendor == 'postgresql':
+        try:
+            plan = json.loads(queryset.order_by().explain(format='json'))
+            return int(plan[0]['Plan']['Plan Rows'])
+        except (ValueError, KeyError, IndexError, TypeError):
+            pass
+    return queryset.count()
+
+
+class KeysetPagination(BasePagination):
+    """
+    Composite-key seek pagination
+
+    The sort key is the queryset's ordering plus the primary key as a
+    tie-breaker, so it is total and stable for every ordering option.
+    The cursor is an opaque base64 token holding the boundary row's key
+    values and the direction of travel.
+    """
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+
+        self.keys = self.get_sort_keys(queryset)
+        queryset = queryset.order_by(*[('-' if desc else '') + field for field, desc in self.keys])
+        unpaginated = queryset
+
+        position, reverse = self.decode_cursor(request)
+        if reverse:
+            queryset = queryset.reverse()
+        if position is not None:
+            queryset = queryset.filter(self.seek_filter(position, reverse))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        # Forward: a previous page exists if we came from a cursor.
+        # Backward: a next page always exists (the row we came from).
+        if reverse:
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+
+        self.first_position = self.get_position(rows[0]) if rows else None
+        self.last_position = self.get_position(rows[-1]) if rows else None
+        if not rows and position is not None:
+            # Empty page past the end/start: step back from where we were
+            self.first_position = self.last_position = position
+
+        self.count = None
+        count_mode = request.query_params.get(self.count_query_param)
+        if count_mode == 'exact':
+            self.count = unpaginated.count()
+        elif count_mode == 'estimate':
+            self.count = estimate_count(unpaginated)
+
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+            if size > 0:
+                return min(size, self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+        return self.page_size
+
+    def get_sort_keys(self, queryset):
+        """[(field, descending)] from the queryset ordering, ending with the primary key"""
+        ordering = list(queryset.query.order_by) or list(queryset.model._meta.ordering)
+        pk_name = queryset.model._meta.pk.attname
+
+        keys = []
+        for item in ordering:
+            if not isinstance(item, str):
+                continue
+            desc = item.startswith('-')
+            field = item.lstrip('-')
+            if field in ('pk', 'id', pk_name):
+                keys.append((pk_name, desc))
+                return keys
+            keys.append((field, desc))
+
+        keys.append((pk_name, keys[0][1] if keys else False))
+        return keys
+
+    def get_position(self, obj):
+        position = []
+        for field, _ in self.keys:
+            value = obj
+            for part in field.split('__'):
+                value = getattr(value, part)
+            position.append(encode_value(value))
+        return position
+
+    def seek_filter(self, position, reverse):
+        """
+        Rows strictly after `position` in sort order (before it when reverse):
+        (k1 > v1) OR (k1 = v1 AND k2 > v2) OR ...
+        """
+        condition = Q()
+        equal = Q()
+        for (field, desc), value in zip(self.keys, position):
+            lookup = 'lt' if desc != reverse else 'gt'
+            condition |= equal & Q(**{f'{field}__{lookup}': value})
+            equal &= Q(**{field: value})
+        return condition
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            data = json.loads(urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            position, reverse = data['p'], bool(data.get('r'))
+            if not isinstance(position, list) or len(position) != len(self.keys):
+                raise ValueError
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def encode_cursor(self, position, reverse):
+        token = urlsafe_b64encode(json.dumps({'p': position, 'r': int(reverse)}).encode('utf-8')).decode('ascii')
+        url = remove_query_param(self.base_url, 'page')
+        return replace_query_param(url, self.cursor_query_param, token)
+
+    def get_next_link(self):
+        if not self.has_next or self.last_position is None:
+            return None
+        return self.encode_cursor(self.last_position, False)
+
+    def get_previous_link(self):
+        if not self.has_previous or self.first_position is None:
+            return None
+        return self.encode_cursor(self.first_position, True)
+
+    def get_paginated_response(self, data):
+        payload = OrderedDict()
+        if self.count is not None:
+            payload['count'] = self.count
+        payload['next'] = self.get_next_link()
+        payload['previous'] = self.get_previous_link()
+        payload['results'] = data
+        return Response(payload)
+
+
+class CatalogPagination(PageNumberPagination):
+    """
+    Page numbers by default (existing clients keep working);
+    keyset pagination when ?cursor= or ?paginate=cursor is passed
+    """
+    keyset_class = KeysetPagination
+
+    def use_keyset(self, request):
+        params = request.query_params
+        return params.get('paginate') == 'cursor' or bool(params.get(self.keyset_class.cursor_query_param))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.use_keyset(request):
+            self.keyset = self.keyset_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
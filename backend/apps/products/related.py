@@ -0,0 +1,192 @@
+"""
+Related-products index
+
+Offline job (build_related_products task) that scores product pairs from
+co-purchases in the order history, blended with category/brand similarity
+and a small popularity prior, and stores the top-N per product in
+RelatedProduct. NumPy/SciPy are imported lazily so web workers do not
+need them loaded.
+"""
+
+from collections import defaultdict
+import logging
+
+from django.conf import settings
+from django.db import transaction
+
+from apps.orders.models import OrderStatus
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_WEIGHTS = {
+    'co_purchase': 1.0,   # cosine similarity of purchase baskets
+    'category': 0.3,
+    'brand': 0.2,
+    'popularity': 0.05,   # tie-breaker among attribute-only candidates
+}
+
+# Orders that never turned into a real purchase
+EXCLUDED_ORDER_STATUSES = [OrderStatus.CANCELED, OrderStatus.PROCESSING_FAILED]
+
+
+def get_weights():
+    return {**DEFAULT_WEIGHTS, **getattr(settings, 'PRODUCT_RELATED_WEIGHTS', {})}
+
+
+def get_top_n():
+    return getattr(settings, 'PRODUCT_RELATED_TOP_N', 12)
+
+
+def load_baskets(index):
+    """(basket_rows, product_cols) for every purchased product, one basket per order"""
+    from apps.orders.models import OrderItem
+
+    baskets = {}
+    rows, cols = [], []
+    items = OrderItem.objects.filter(variant__isnull=False).exclude(
+        order__status__in=EXCLUDED_ORDER_STATUSES
+    ).values_list('order_id', 'variant__product_id')
+
+    for order_id, product_id in items.iterator(chunk_size=10000):
+        column = index.get(product_id)
+        if column is None:
+            continue
+        rows.append(baskets.setdefault(order_id, len(baskets)))
+        cols.append(column)
+    return rows, cols, len(baskets)
+
+
+def co_purchase_matrices(rows, cols, n_baskets, n_products):
+    """
+    Sparse co-occurrence counts (products x products, zero diagonal),
+    their cosine-normalised form, and per-product basket counts
+    """
+    import numpy as np
+    from scipy import sparse
+
+    baskets = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+        shape=(n_baskets, n_products),
+    )
+    # Duplicate lines of the same product in one order count once
+    baskets.data[:] = 1
+
+    counts = (baskets.T @ baskets).tocsr()
+    purchases = counts.diagonal().astype(np.float64)
+    counts.setdiag(0)
+    counts.eliminate_zeros()
+    counts.sort_indices()
+
+    norm = np.sqrt(purchases)
+    norm[norm == 0] = 1
+    inverse = sparse.diags(1.0 / norm)
+    cosine = (inverse @ counts @ inverse).tocsr()
+    cosine.sort_indices()
+    return counts, cosine, purchases
+
+
+def top_by_group(groups, popularity, limit):
+    """{group: member indices sorted by popularity, truncated to limit}"""
+    members = defaultdict(list)
+    for position, group in enumerate(groups):
+        members[group].append(position)
+    return {
+        group: sorted(positions, key=lambda p: -popularity[p])[:limit]
+        for group, positions in members.items()
+    }
+
+
+def compute_related(products, rows, cols, n_baskets, top_n=None, weights=None):
+    """
+    Score candidates per product and return [(product_id, related_id, rank, score, co_purchases)]
+
+    Candidates are the product's co-purchase neighbours (sparse row) plus the
+    most popular products of its category, brand and category+brand groups,
+    so work per product is bounded and the job scales with order history size.
+    `products` is a list of (id, category_id, brand, view_count).
+    """
+    import numpy as np
+
+    top_n = top_n or get_top_n()
+    weights = weights or get_weights()
+
+    n = len(products)
+    ids = np.array([p[0] for p in products], dtype=np.int64)
+    category_codes = {c: i for i, c in enumerate(sorted({p[1] for p in products}))}
+    brand_codes = {b: i for i, b in enumerate(sorted({(p[2] or '').lower() for p in products}))}
+    categories = np.array([category_codes[p[1]] for p in products], dtype=np.int64)
+    brands = np.array([brand_codes[(p[2] or '').lower()] for p in products], dtype=np.int64)
+
+    counts, cosine, purchases = co_purchase_matrices(rows, cols, n_baskets, n)
+
+    popularity = np.log1p(np.array([max(p[3], 0) for p in products], dtype=np.float64)) + np.log1p(purchases)
+    if popularity.max() > 0:
+        popularity = popularity / popularity.max()
+
+    pool = top_n + 1
+    by_category = top_by_group(categories.tolist(), popularity, pool)
+    by_brand = top_by_group(brands.tolist(), popularity, pool)
+    by_both = top_by_group(list(zip(categories.tolist(), brands.tolist())), popularity, pool)
+
+    results = []
+    for i in range(n):
+        start, end = cosine.indptr[i], cosine.indptr[i + 1]
+        neighbours = cosine.indices[start:end]
+
+        candidates = np.unique(np.concatenate([
+            neighbours,
+            np.array(by_category[categories[i]], dtype=np.int64),
+            np.array(by_brand[brands[i]], dtype=np.int64),
+            np.array(by_both[(categories[i], brands[i])], dtype=np.int64),
+        ]).astype(np.int64))
+        candidates = candidates[candidates != i]
+        if not len(candidates):
+            continue
+
+        co_score = np.zeros(len(candidates))
+        co_count = np.zeros(len(candidates))
+        positions = np.searchsorted(candidates, neighbours)
+        co_score[positions] = cosine.data[start:end]
+        co_count[positions] = counts.data[counts.indptr[i]:counts.indptr[i + 1]]
+
+        score = (
+            weights['co_purchase'] * co_score
+            + weights['category'] * (categories[candidates] == categories[i])
+            + weights['brand'] * (brands[candidates] == brands[i])
+            + weights['popularity'] * popularity[candidates]
+        )
+
+        order = np.argsort(-score, kind='stable')[:top_n]
+        for rank, position in enumerate(order, start=1):
+            results.append((
+                int(ids[i]), int(ids[candidates[position]]), rank,
+                float(score[position]), int(co_count[position]),
+            ))
+    return results
+
+
+def build_related_index(top_n=None):
+    """Rebuild RelatedProduct for all active products; returns number of rows stored"""
+    from .models import Product, RelatedProduct
+
+    products = list(
+        Product.objects.filter(is_active=True).order_by('pk').values_list('pk', 'category_id', 'brand', 'view_count')
+    )
+    index = {product[0]: position for position, product in enumerate(products)}
+    rows, cols, n_baskets = load_baskets(index)
+
+    results = compute_related(products, rows, cols, n_baskets, top_n=top_n) if len(products) > 1 else []
+
+    with transaction.atomic():
+        RelatedProduct.objects.all().delete()
+        RelatedProduct.objects.bulk_create(
+            (
+                RelatedProduct(product_id=product_id, related_id=related_id, rank=rank, score=score, co_purchases=co)
+                for product_id, related_id, rank, score, co in results
+            ),
+            batch_size=2000,
+        )
+
+    logger.info(f"Related index: {len(results)} links for {len(products)} products from {n_baskets} orders")
+    return len(results)
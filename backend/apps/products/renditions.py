@@ -0,0 +1,195 @@
+"""
+On-demand image renditions at arbitrary sizes
+
+    /media/r/<content hash>/<width>x<height>.<avif|webp|jpg>?s=<signature>
+
+URLs are issued by the backend and signed, so clients cannot make the
+server render sizes nobody asked for: media in the API carry
+`layout_urls`, one signed URL per layout in PRODUCT_RENDITION_LAYOUTS and
+format. The first request
+for a size renders it from the stored original and writes it to storage
+under a deterministic name; nginx serves that file directly from then on
+(try_files before proxying, see nginx/nginx.conf), so Django only sees
+cold sizes.
+
+Concurrent first hits are coalesced: one request renders under a cache
+lock (shared across processes via Redis) while the others wait for the
+file to appear. Renders inside one process are capped by a semaphore;
+a request that cannot get a slot in time gets 503 with Retry-After
+rather than piling up decodes.
+
+Renditions do not depend on the processing profile: after changing
+encoder settings, delete products/renditions/ to have them re-rendered.
+"""
+
+import os
+import threading
+import time
+import logging
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare
+from PIL import Image
+
+from .imaging import FORMAT_EXTENSIONS, FORMAT_MIME_TYPES, get_formats, render_one
+from .media_store import find_original, open_stored
+
+logger = logging.getLogger(__name__)
+
+
+SIGNING_SALT = 'apps.products.renditions'
+
+LOCK_KEY = 'products:rendition:lock:{name}'
+
+# Renders this long are considered dead and their lock expires
+LOCK_TIMEOUT = 60
+
+# How long a request waits for a render running elsewhere / for a render slot
+WAIT_TIMEOUT = 10.0
+LOCK_POLL = 0.1
+
+MIN_SIZE = 16
+
+# Frontend layouts not covered by the eager sizes (PRODUCT_IMAGE_SIZES)
+DEFAULT_LAYOUTS = {
+    'cart': (192, 192),
+    'card': (640, 640),
+    'zoom': (2400, 2400),
+}
+
+EXTENSION_FORMATS = {ext: image_format for image_format, ext in FORMAT_EXTENSIONS.items()}
+
+
+class RenditionNotFound(Exception):
+    """Unknown content, unsupported format or size out of bounds"""
+
+
+class RenditionBusy(Exception):
+    """No render slot (or no finished render) within WAIT_TIMEOUT"""
+
+
+def get_max_size():
+    """Largest width/height that may be requested"""
+    return getattr(settings, 'PRODUCT_RENDITION_MAX_SIZE', 2400)
+
+
+def get_layouts():
+    return getattr(settings, 'PRODUCT_RENDITION_LAYOUTS', DEFAULT_LAYOUTS)
+
+
+def get_max_renders():
+    """Concurrent renders per process"""
+    return getattr(settings, 'PRODUCT_RENDITION_MAX_RENDERS', 2)
+
+
+_render_slots = None
+_render_slots_lock = threading.Lock()
+
+
+def get_render_slots():
+    global _render_slots
+    with _render_slots_lock:
+        if _render_slots is None:
+            _render_slots = threading.BoundedSemaphore(get_max_renders())
+        return _render_slots
+
+
+def rendition_name(content_hash, width, height, ext):
+    """Storage name of a rendition; nginx maps the URL onto it (keep the two in sync)"""
+    return f'products/renditions/{content_hash[:2]}/{content_hash}/{width}x{height}.{ext}'
+
+
+def sign(content_hash, width, height, ext):
+    return signing.Signer(salt=SIGNING_SALT).signature(f'{content_hash}/{width}x{height}.{ext}')
+
+
+def verify(content_hash, width, height, ext, signature):
+    return bool(signature) and constant_time_compare(signature, sign(content_hash, width, height, ext))
+
+
+def rendition_url(content_hash, width, height, ext='webp'):
+    """Signed URL of one rendition (rendered on first request)"""
+    path = reverse('product-rendition', kwargs={
+        'content_hash': content_hash, 'width': width, 'height': height, 'ext': ext,
+    })
+    return f'{path}?s={sign(content_hash, width, height, ext)}'
+
+
+def layout_urls(content_hash):
+    """{layout: {mime type: signed URL}} for every layout, best format first"""
+    formats = get_formats()
+    return {
+        layout: {
+            FORMAT_MIME_TYPES[image_format]: rendition_url(content_hash, width, height, FORMAT_EXTENSIONS[image_format])
+            for image_format in formats
+        }
+        for layout, (width, height) in get_layouts().items()
+    }
+
+
+def validate(content_hash, width, height, ext):
+    """Image format for the request; RenditionNotFound if it cannot be served"""
+    image_format = EXTENSION_FORMATS.get(ext)
+    if image_format is None or image_format not in get_formats():
+        raise RenditionNotFound(f"Unsupported format {ext}")
+    max_size = get_max_size()
+    if not (MIN_SIZE <= width <= max_size and MIN_SIZE <= height <= max_size):
+        raise RenditionNotFound(f"Size {width}x{height} out of bounds")
+    return image_format
+
+
+def get_or_render(content_hash, width, height, ext):
+    """
+    Storage name of the rendition, rendering it first if needed
+    Exactly one concurrent caller renders; the others wait for its file.
+    """
+    image_format = validate(content_hash, width, height, ext)
+    name = rendition_name(content_hash, width, height, ext)
+    if default_storage.exists(name):
+        return name
+
+    lock_key = LOCK_KEY.format(name=name)
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while True:
+        if cache.add(lock_key, os.getpid(), LOCK_TIMEOUT):
+            try:
+                if not default_storage.exists(name):
+                    render(content_hash, (width, height), image_format, name, deadline)
+                return name
+            finally:
+                cache.delete(lock_key)
+
+        # Someone else is rendering it
+        if time.monotonic() >= deadline:
+            raise RenditionBusy(f"{name} is still being rendered")
+        time.sleep(LOCK_POLL)
+        if default_storage.exists(name):
+            return name
+
+
+def render(content_hash, size, image_format, name, deadline):
+    """Render from the stored original into `name` (holding a render slot)"""
+    original = find_original(content_hash)
+    if original is None:
+        raise RenditionNotFound(f"No original for {content_hash[:12]}")
+
+    slots = get_render_slots()
+    if not slots.acquire(timeout=max(0, deadline - time.monotonic())):
+        raise RenditionBusy("All render slots are busy")
+    try:
+        start = time.perf_counter()
+        with open_stored(original) as source:
+            try:
+                rendition = render_one(source, size, image_format)
+            except (OSError, Image.DecompressionBombError) as e:
+                # The hash belongs to a video, or the original is unreadable
+                raise RenditionNotFound(f"Cannot render {content_hash[:12]}: {e}")
+        default_storage.save(name, ContentFile(rendition.data))
+        logger.info(f"Rendered {name} ({len(rendition.data)} bytes) in {time.perf_counter() - start:.2f}s")
+    finally:
+        slots.release()
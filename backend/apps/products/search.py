@@ -0,0 +1,258 @@
+"""
+Full-text search backends for products
+
+- PostgresSearchBackend: weighted tsvector column + GIN index (production)
+- SQLiteFTSBackend: FTS5 virtual table (local/dev)
+- SimpleSearchBackend: icontains over the folded document (fallback)
+
+All backends search Vietnamese text with diacritics folded ("kính" == "kinh")
+and blend text relevance with product popularity (view_count).
+"""
+
+from django.conf import settings
+from django.db import connection, transaction, DatabaseError
+from django.db.models import Case, When, Value, FloatField, F, Func, Q
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Greatest, Ln
+from django.utils.html import strip_tags
+from django.utils.module_loading import import_string
+import re
+import unicodedata
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+FTS_TABLE = 'products_search_fts'
+TSVECTOR_COLUMN = 'search_vector'
+
+
+def fold_vietnamese(text):
+    """
+    Lowercase and strip Vietnamese diacritics: "Kính Mắt Đẹp" -> "kinh mat dep"
+    'đ' is not a combining mark so it is mapped explicitly
+    """
+    if not text:
+        return ''
+    text = text.lower().replace('đ', 'd')
+    decomposed = unicodedata.normalize('NFD', text)
+    stripped = ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return ' '.join(stripped.split())
+
+
+def tokenize(text):
+    """Folded word tokens, safe to embed in tsquery/FTS5 query syntax"""
+    return re.findall(r'\w+', fold_vietnamese(text))
+
+
+def build_document_fields(product):
+    """Folded, weighted fields for a product"""
+    body = ' '.join(filter(None, [product.short_description, strip_tags(product.description or '')]))
+    return {
+        'name': fold_vietnamese(product.name),
+        'brand': fold_vietnamese(product.brand),
+        'body': fold_vietnamese(body),
+    }
+
+
+class MatchRelevance(Func):
+    """
+    Correlated scalar subquery scoring the outer product for a full-text query
+    `template` has {query} and {pk} placeholders, e.g.
+    "(SELECT rank(...) FROM index WHERE index MATCH {query} AND id = {pk})"
+    """
+    output_field = FloatField()
+
+    def __init__(self, template, query):
+        self.sql_template = template
+        super().__init__(Value(query), F('pk'))
+
+    def as_sql(self, compiler, connection, **extra_context):
+        query_sql, query_params = compiler.compile(self.source_expressions[0])
+        pk_sql, pk_params = compiler.compile(self.source_expressions[1])
+        return self.sql_template.format(query=query_sql, pk=pk_sql), (*query_params, *pk_params)
+
+
+class SimpleSearchBackend:
+    """
+    Portable fallback: AND of icontains per token over the folded document
+    Still a scan, but over one narrow table instead of four raw columns
+    """
+
+    def index(self, product):
+        """Store the folded document for a product"""
+        from .models import ProductSearchDocument
+
+        fields = build_document_fields(product)
+        ProductSearchDocument.objects.update_or_create(product_id=product.pk, defaults=fields)
+        self.index_document(product.pk, fields)
+
+    def index_document(self, product_id, fields):
+        """Backend-specific index update (nothing to do for the fallback)"""
+
+    def remove(self, product_id):
+        """Drop a product from backend-specific structures"""
+
+    def match_expressions(self, tokens):
+        """
+        Return (matching product ids subquery, relevance expression), both
+        evaluated by the database, or None if this backend cannot answer
+        (the caller then falls back)
+        """
+        return None
+
+    def search(self, queryset, query):
+        """Filter `queryset` to matches and annotate it with `search_rank`"""
+        tokens = tokenize(query)
+        if not tokens:
+            return queryset
+
+        expressions = self.match_expressions(tokens)
+        if expressions is None:
+            return self.fallback_search(queryset, tokens)
+
+        # Matching, ranking and pagination all happen in the same SQL query
+        matches, relevance = expressions
+        weight = getattr(settings, 'PRODUCT_SEARCH_POPULARITY_WEIGHT', 0.1)
+        return queryset.filter(pk__in=matches).annotate(
+            search_rank=relevance * (
+                Value(1.0) + Value(weight) * Ln(Greatest(F('view_count'), Value(0)) + Value(1.0))
+            )
+        )
+
+    def fallback_search(self, queryset, tokens):
+        condition = Q()
+        for token in tokens:
+            condition &= (
+                Q(search_document__name__contains=token)
+                | Q(search_document__brand__contains=token)
+                | Q(search_document__body__contains=token)
+            )
+
+        weight = getattr(settings, 'PRODUCT_SEARCH_POPULARITY_WEIGHT', 0.1)
+        name_match = Q()
+        for token in tokens:
+            name_match &= Q(search_document__name__contains=token)
+
+        return queryset.filter(condition).annotate(
+            search_rank=Case(
+                When(name_match, then=Value(3.0)),
+                default=Value(1.0),
+                output_field=FloatField(),
+            ) * (Value(1.0) + Value(weight) * Ln(F('view_count') + Value(1.0)))
+        )
+
+
+class PostgresSearchBackend(SimpleSearchBackend):
+    """
+    tsvector column on the search document table with a GIN index
+    Weights: name A, brand B, description C; 'simple' config since the text is pre-folded
+    """
+
+    def _table(self):
+        from .models import ProductSearchDocument
+        return ProductSearchDocument._meta.db_table
+
+    def index_document(self, product_id, fields):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                UPDATE {self._table()} SET {TSVECTOR_COLUMN} =
+                    setweight(to_tsvector('simple', %s), 'A') ||
+                    setweight(to_tsvector('simple', %s), 'B') ||
+                    setweight(to_tsvector('simple', %s), 'C')
+                WHERE product_id = %s
+                """,
+                [fields['name'], fields['brand'], fields['body'], product_id],
+            )
+
+    def match_expressions(self, tokens):
+        # Prefix match on every token, all tokens required
+        tsquery = ' & '.join(f"{token}:*" for token in tokens)
+        table = self._table()
+        matches = RawSQL(
+            f"SELECT product_id FROM {table} WHERE {TSVECTOR_COLUMN} @@ to_tsquery('simple', %s)",
+            [tsquery],
+        )
+        relevance = MatchRelevance(
+            f"(SELECT ts_rank_cd({TSVECTOR_COLUMN}, to_tsquery('simple', {{query}})) "
+            f"FROM {table} WHERE product_id = {{pk}})",
+            tsquery,
+        )
+        return matches, relevance
+
+
+class SQLiteFTSBackend(SimpleSearchBackend):
+    """FTS5 virtual table keyed by product id (rowid), ranked with bm25"""
+
+    # bm25 column weights: name, brand, body
+    BM25_WEIGHTS = (10.0, 5.0, 1.0)
+
+    def __init__(self):
+        self.available = None
+
+    def index_document(self, product_id, fields):
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [product_id])
+                cursor.execute(
+                    f"INSERT INTO {FTS_TABLE} (rowid, name, brand, body) VALUES (%s, %s, %s, %s)",
+                    [product_id, fields['name'], fields['brand'], fields['body']],
+                )
+        except DatabaseError as e:
+            logger.warning(f"Could not update FTS index for product {product_id}: {e}")
+
+    def remove(self, product_id):
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [product_id])
+        except DatabaseError as e:
+            logger.warning(f"Could not remove product {product_id} from FTS index: {e}")
+
+    def is_available(self):
+        """False when SQLite was built without FTS5 and the table was never created"""
+        if self.available is None:
+            with connection.cursor() as cursor:
+                self.available = FTS_TABLE in connection.introspection.table_names(cursor)
+            if not self.available:
+                logger.error(f"FTS table {FTS_TABLE} missing, product search falls back")
+        return self.available
+
+    def match_expressions(self, tokens):
+        if not self.is_available():
+            return None
+
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        weights = ', '.join(str(w) for w in self.BM25_WEIGHTS)
+        matches = RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match])
+        relevance = MatchRelevance(
+            f"(SELECT -bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH {{query}} AND rowid = {{pk}})",
+            match,
+        )
+        return matches, relevance
+
+
+BACKENDS_BY_VENDOR = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SQLiteFTSBackend,
+}
+
+_backend = None
+
+
+def get_search_backend():
+    """
+    Search backend from settings.PRODUCT_SEARCH_BACKEND (dotted path),
+    otherwise picked from the database vendor
+    """
+    global _backend
+    if _backend is None:
+        backend_path = getattr(settings, 'PRODUCT_SEARCH_BACKEND', None)
+        if backend_path:
+            backend_class = import_string(backend_path)
+        else:
+            backend_class = BACKENDS_BY_VENDOR.get(connection.vendor, SimpleSearchBackend)
+        _backend = backend_class()
+    return _backend
+
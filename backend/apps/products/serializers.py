@@ -3,7 +3,11 @@ Serializers for Products API
 """
 
 from rest_framework import serializers
-from .models import Category, Product, ProductVariant, ProductMedia, ProductReview
+from .models import (
+    Category, Product, ProductVariant, ProductMedia, ProductReview, ProductListingSummary
+)
+from .media_store import build_srcset
+from .renditions import layout_urls
 
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -26,15 +30,25 @@ class ProductMediaSerializer(serializers.ModelSerializer):
     medium_url = serializers.SerializerMethodField()
     large_url = serializers.SerializerMethodField()
     
+    # {mime type: "url 300w, url 800w, ..."} per format, smallest format first
+    srcset = serializers.SerializerMethodField()
+    
+    # {layout: {mime type: signed on-demand rendition URL}}
+    layout_urls = serializers.SerializerMethodField()
+    
     class Meta:
         model = ProductMedia
         fields = [
             'id', 'media_type', 'original_file', 'processed_images',
-            'thumbnail_url', 'medium_url', 'large_url',
-            'processed_video', 'video_thumbnail', 'alt_text',
-            'title', 'display_order', 'is_processed'
+            'thumbnail_url', 'medium_url', 'large_url', 'srcset', 'layout_urls',
+            'width', 'height', 'dominant_color', 'placeholder',
+            'processed_video', 'video_thumbnail', 'hls_playlist', 'alt_text',
+            'title', 'display_order', 'is_processed', 'processing_status', 'processing_progress'
+        ]
+        read_only_fields = [
+            'id', 'processed_images', 'width', 'height', 'dominant_color', 'placeholder',
+            'is_processed', 'hls_playlist', 'processing_status', 'processing_progress'
         ]
-        read_only_fields = ['id', 'processed_images', 'is_processed']
     
     def get_thumbnail_url(self, obj):
         if obj.processed_images and 'thumbnail' in obj.processed_images:
@@ -50,6 +64,14 @@ class ProductMediaSerializer(serializers.ModelSerializer):
         if obj.processed_images and 'large' in obj.processed_images:
             return obj.processed_images['large']
         return None
+    
+    def get_srcset(self, obj):
+        return build_srcset(obj.processed_images) or None
+    
+    def get_layout_urls(self, obj):
+        if obj.media_type != 'image' or not obj.content_hash:
+            return None
+        return layout_urls(obj.content_hash)
 
 
 class ProductVariantSerializer(serializers.ModelSerializer):
@@ -98,48 +120,80 @@ class ProductVariantSerializer(serializers.ModelSerializer):
 
 
 class ProductListSerializer(serializers.ModelSerializer):
-    """Lightweight serializer for product listings"""
+    """
+    Lightweight serializer for product listings
+    Reads price/stock/thumbnail data from ProductListingSummary
+    (select_related('listing_summary') keeps a page at a single query)
+    """
     
     category_name = serializers.CharField(source='category.name', read_only=True)
     default_variant = serializers.SerializerMethodField()
     thumbnail = serializers.SerializerMethodField()
+    thumbnail_placeholder = serializers.SerializerMethodField()
     price_range = serializers.SerializerMethodField()
-    in_stock = serializers.BooleanField(source='is_in_stock', read_only=True)
+    in_stock = serializers.SerializerMethodField()
     
     class Meta:
         model = Product
         fields = [
             'id', 'name', 'slug', 'brand', 'category_name', 'short_description',
-            'base_price', 'price_range', 'thumbnail', 'default_variant',
+            'base_price', 'price_range', 'thumbnail', 'thumbnail_placeholder', 'default_variant',
             'is_active', 'is_featured', 'is_new_arrival', 'is_best_seller',
             'in_stock', 'view_count'
         ]
         read_only_fields = ['id', 'view_count']
     
+    def _get_summary(self, obj):
+        """Listing summary for the product (computed on the fly if the row is missing)"""
+        try:
+            return obj.listing_summary
+        except ProductListingSummary.DoesNotExist:
+            obj.listing_summary = ProductListingSummary.build(obj.pk)
+            return obj.listing_summary
+    
     def get_default_variant(self, obj):
         """Get default variant info"""
-        default = obj.variants.filter(is_default=True, is_active=True).first()
-        if default:
+        summary = self._get_summary(obj)
+        if summary.default_variant_id:
             return {
-                'id': default.id,
-                'sku': default.sku,
-                'color': default.color,
-                'price': default.price,
-                'sale_price': default.sale_price,
-                'display_price': default.get_display_price(),
+                'id': summary.default_variant_id,
+                'sku': summary.default_sku,
+                'color': summary.default_color,
+                'price': summary.default_price,
+                'sale_price': summary.default_sale_price,
+                'display_price': summary.get_default_display_price(),
             }
         return None
     
     def get_thumbnail(self, obj):
         """Get first product image thumbnail"""
-        media = obj.media.filter(media_type='image', is_processed=True).first()
-        if media and media.processed_images and 'thumbnail' in media.processed_images:
-            return media.processed_images['thumbnail']
-        return None
+        return self._get_summary(obj).thumbnail_url or None
+    
+    def get_thumbnail_placeholder(self, obj):
+        """Size, dominant colour and inline LQIP of the thumbnail (render before it loads)"""
+        summary = self._get_summary(obj)
+        if not summary.thumbnail_url or not summary.thumbnail_placeholder:
+            return None
+        return {
+            'width': summary.thumbnail_width,
+            'height': summary.thumbnail_height,
+            'dominant_color': summary.thumbnail_color,
+            'placeholder': summary.thumbnail_placeholder,
+        }
     
     def get_price_range(self, obj):
-        """Get price range from variants"""
-        return obj.get_price_range()
+        """Get display price range from active variants"""
+        summary = self._get_summary(obj)
+        if summary.min_price is None:
+            return None
+        return {
+            'min': summary.min_price,
+            'max': summary.max_price
+        }
+    
+    def get_in_stock(self, obj):
+        """Check if any active variant is in stock"""
+        return self._get_summary(obj).in_stock
 
 
 class ProductDetailSerializer(serializers.ModelSerializer):
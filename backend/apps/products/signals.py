@@ -0,0 +1,77 @@
+"""
+Product app signals - Keep denormalized read models in sync
+"""
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import cache as collection_cache
+from .facets import bump_facet_epoch
+from .search import get_search_backend
+from .models import Category, Product, ProductVariant, ProductMedia, ProductListingSummary
+
+
+def schedule_listing_refresh(product_id):
+    """
+    Refresh the listing summary once the current transaction commits
+    Deferring avoids recreating the row mid-cascade when a product is deleted
+    and lets stock changes inside order/warehouse transactions settle first
+    """
+    transaction.on_commit(lambda: ProductListingSummary.refresh(product_id))
+
+
+def schedule_collection_invalidation(product_id):
+    """Invalidate the cached collections the product can appear in, once committed"""
+    def invalidate():
+        flags = Product.objects.filter(pk=product_id).values(*collection_cache.COLLECTION_FLAGS.values()).first()
+        collection_cache.invalidate_for_product(product_id, flags=flags)
+
+    transaction.on_commit(invalidate)
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, created, **kwargs):
+    """
+    Every product gets a summary row as soon as it exists; touching it on
+    later saves lets the facet index pick up brand/flag/activation changes.
+    The search document is re-folded from the saved text on commit.
+    """
+    schedule_listing_refresh(instance.pk)
+    transaction.on_commit(lambda: get_search_backend().index(instance))
+    schedule_collection_invalidation(instance.pk)
+    transaction.on_commit(collection_cache.invalidate_category_tree)
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    """Deleted products vanish from the summary table, so force a facet rebuild"""
+    transaction.on_commit(bump_facet_epoch)
+    product_id = instance.pk
+    transaction.on_commit(lambda: get_search_backend().remove(product_id))
+    transaction.on_commit(lambda: collection_cache.invalidate_for_product(product_id))
+    transaction.on_commit(collection_cache.invalidate_category_tree)
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def variant_changed(sender, instance, **kwargs):
+    """Price, stock or default flag may have changed (covers order and import stock paths)"""
+    schedule_listing_refresh(instance.product_id)
+    schedule_collection_invalidation(instance.product_id)
+
+
+@receiver(post_save, sender=ProductMedia)
+@receiver(post_delete, sender=ProductMedia)
+def media_changed(sender, instance, **kwargs):
+    """Thumbnail may have changed"""
+    schedule_listing_refresh(instance.product_id)
+    schedule_collection_invalidation(instance.product_id)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, instance, **kwargs):
+    """Category names are embedded in every cached collection payload and the tree"""
+    transaction.on_commit(collection_cache.invalidate_all)
+    transaction.on_commit(collection_cache.invalidate_category_tree)
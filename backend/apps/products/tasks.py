@@ -4,16 +4,40 @@ Handles automatic resizing, format conversion, and optimization
 """
 
 from celery import shared_task
-from PIL import Image, ImageOps
-from io import BytesIO
-from django.core.files.base import ContentFile
+from django.conf import settings
 from django.core.files.storage import default_storage
+from .imaging import get_profile, inspect, render_derivatives
+from .media_store import (
+    find_derivatives, find_image_info, get_temp_dir, hash_file, local_path, open_original,
+    store_derivatives, store_tree,
+)
 import os
+import tempfile
+import time
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+# Fields process_image() fills in
+IMAGE_RESULT_FIELDS = [
+    'processed_images', 'content_hash', 'processing_profile',
+    'width', 'height', 'dominant_color', 'placeholder',
+]
+
+# Retry delay when every transcode slot on the host is taken
+VIDEO_SLOT_RETRY_SECONDS = 30
+
+
+def get_video_queue():
+    return getattr(settings, 'PRODUCT_VIDEO_QUEUE', 'media_video')
+
+
+def get_video_slot_wait():
+    """How long a video may wait for a transcode slot before it is marked failed"""
+    return getattr(settings, 'PRODUCT_VIDEO_SLOT_WAIT', 2 * 60 * 60)
+
+
 @shared_task(bind=True, max_retries=3)
 def process_product_media(self, media_id):
     """
@@ -25,16 +49,18 @@ def process_product_media(self, media_id):
     try:
         media = ProductMedia.objects.get(pk=media_id)
         media.processing_status = 'processing'
-        media.save(update_fields=['processing_status'])
+        media.save(update_fields=['processing_status', 'updated_at'])
         
-        if media.media_type == 'image':
-            process_image(media)
-        elif media.media_type == 'video':
-            process_video(media)
+        if media.media_type == 'video':
+            # Long-running: handed to the video queue, which completes the row
+            transcode_product_video.apply_async(args=[media.pk], queue=get_video_queue())
+            return
+        
+        process_image(media)
         
         media.is_processed = True
         media.processing_status = 'completed'
-        media.save(update_fields=['is_processed', 'processing_status', 'processed_images'])
+        media.save(update_fields=['is_processed', 'processing_status', *IMAGE_RESULT_FIELDS, 'updated_at'])
         
         logger.info(f"Successfully processed media {media_id}")
         
@@ -44,187 +70,134 @@ def process_product_media(self, media_id):
         logger.error(f"Error processing media {media_id}: {str(exc)}")
         media.processing_status = 'failed'
         media.processing_error = str(exc)
-        media.save(update_fields=['processing_status', 'processing_error'])
+        media.save(update_fields=['processing_status', 'processing_error', 'updated_at'])
         raise self.retry(exc=exc, countdown=60)
 
 
 def process_image(media):
     """
     Process product image:
-    1. Generate multiple sizes (thumbnail, medium, large)
-    2. Convert to WebP format for optimal web performance
-    3. Optionally upscale if original is too small
+    1. Reuse stored derivatives for the same content + profile if any
+    2. Otherwise decode once, build the thumbnail/medium/large pyramid and
+       encode each size to AVIF/WebP/JPEG in parallel (see apps.products.imaging)
+    3. Store them under content-addressed names (see apps.products.media_store)
+    4. Record intrinsic size, dominant colour and an inline placeholder
     """
-    # Define target sizes (width, height)
-    SIZES = {
-        'thumbnail': (300, 300),
-        'medium': (800, 800),
-        'large': (1500, 1500),
-    }
-    
-    processed_paths = {}
-    
     try:
-        # Open original image
-        original_path = media.original_file.path
-        with Image.open(original_path) as img:
-            # Convert to RGB if necessary (for WebP compatibility)
-            if img.mode in ('RGBA', 'LA', 'P'):
-                background = Image.new('RGB', img.size, (255, 255, 255))
-                if img.mode == 'P':
-                    img = img.convert('RGBA')
-                background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-                img = background
-            elif img.mode != 'RGB':
-                img = img.convert('RGB')
-            
-            # Check if image needs upscaling
-            original_width, original_height = img.size
-            if original_width < 800 or original_height < 800:
-                img = upscale_image(img)
+        # Streamed from whatever storage holds the original (no local path needed)
+        with open_original(media.original_file) as original:
+            if not media.content_hash:
+                media.content_hash = hash_file(original)
             
-            # Generate each size
-            for size_name, dimensions in SIZES.items():
-                processed_img = resize_image(img, dimensions)
-                
-                # Save as WebP
-                output = BytesIO()
-                processed_img.save(output, format='WEBP', quality=85, method=6)
-                output.seek(0)
-                
-                # Generate file path
-                base_name = os.path.splitext(os.path.basename(media.original_file.name))[0]
-                webp_filename = f"{base_name}_{size_name}.webp"
-                webp_path = os.path.join('products/processed', size_name, webp_filename)
-                
-                # Save to storage
-                saved_path = default_storage.save(
-                    webp_path,
-                    ContentFile(output.read())
-                )
-                
-                processed_paths[size_name] = default_storage.url(saved_path)
+            profile = get_profile()
+            processed_images = find_derivatives(media.content_hash, profile)
+            if processed_images is None:
+                renditions, info = render_derivatives(original)
+                processed_images = store_derivatives(media.content_hash, profile, renditions)
+            else:
+                logger.info(f"Reusing derivatives of {media.content_hash[:12]} for media {media.id}")
+                info = find_image_info(media.content_hash) or inspect(original)
         
         # Update media object
-        media.processed_images = processed_paths
+        media.processed_images = processed_images
+        media.processing_profile = profile
+        media.set_image_info(info)
         
     except Exception as e:
         logger.error(f"Error processing image {media.id}: {str(e)}")
         raise
 
 
-def resize_image(img, target_size):
+@shared_task(bind=True, max_retries=3, acks_late=True)
+def transcode_product_video(self, media_id, waiting_since=None):
     """
-    Resize image to target size while maintaining aspect ratio
-    Uses high-quality Lanczos resampling
-    """
-    # Use ImageOps.fit for smart cropping to exact dimensions
-    # Or use thumbnail() to maintain aspect ratio without cropping
-    
-    # Option 1: Exact size with smart crop (recommended for product images)
-    resized = ImageOps.fit(
-        img,
-        target_size,
-        method=Image.Resampling.LANCZOS,
-        centering=(0.5, 0.5)
-    )
-    
-    return resized
-
-
-def upscale_image(img, scale_factor=2):
+    Transcode an uploaded product video: HLS ladder + faststart MP4 + poster
+    in a single ffmpeg run (see apps.products.video), with progress written
+    to ProductMedia.processing_progress
+    Runs on PRODUCT_VIDEO_QUEUE; at most PRODUCT_VIDEO_MAX_TRANSCODES per host.
+    waiting_since: when the task first found every slot busy (set on requeue)
     """
-    Upscale small images using high-quality Lanczos algorithm
-    For production, consider integrating AI upscaling libraries like:
-    - waifu2x-python
-    - Real-ESRGAN
-    """
-    new_size = (img.width * scale_factor, img.height * scale_factor)
+    from apps.products.models import ProductMedia
+    from .video import TranscodeSlot, transcode
     
-    # High-quality upscaling with Lanczos
-    upscaled = img.resize(new_size, Image.Resampling.LANCZOS)
+    try:
+        media = ProductMedia.objects.get(pk=media_id, media_type='video')
+    except ProductMedia.DoesNotExist:
+        logger.error(f"Video ProductMedia {media_id} not found")
+        return
     
-    # Apply slight sharpening to improve perceived quality
-    from PIL import ImageEnhance
-    enhancer = ImageEnhance.Sharpness(upscaled)
-    upscaled = enhancer.enhance(1.2)  # 20% sharper
+    slot = TranscodeSlot()
+    if not slot.acquire():
+        # Every transcode slot on this host is busy: requeue instead of blocking
+        # the worker, until a leaked lock or wedged ffmpeg has held them too long
+        waiting_since = waiting_since or time.time()
+        if time.time() - waiting_since >= get_video_slot_wait():
+            logger.error(f"No transcode slot for video {media_id} after {get_video_slot_wait()}s, giving up")
+            media.processing_status = 'failed'
+            media.processing_error = f"No free transcode slot after waiting {get_video_slot_wait()} seconds"
+            media.save(update_fields=['processing_status', 'processing_error', 'updated_at'])
+            return
+        raise self.retry(
+            args=[media_id], kwargs={'waiting_since': waiting_since},
+            countdown=VIDEO_SLOT_RETRY_SECONDS, max_retries=None,
+        )
     
-    logger.info(f"Upscaled image from {img.size} to {new_size}")
-    return upscaled
+    with slot:
+        try:
+            ProductMedia.objects.filter(pk=media_id).update(processing_status='processing', processing_progress=0)
+            base_name = os.path.splitext(os.path.basename(media.original_file.name))[0]
+            
+            # ffmpeg needs seekable local files: a temp copy of the original
+            # (only if storage is remote) and a scratch dir for the outputs
+            with local_path(media.original_file) as input_path, tempfile.TemporaryDirectory(dir=get_temp_dir()) as workdir:
+                outputs = transcode(input_path, workdir, base_name, ProgressReporter(media_id))
+                # Keyed by media so uploads sharing a filename never overwrite each other
+                prefix = f'products/videos/processed/{media.pk}'
+                store_tree(workdir, prefix)
+            
+            media.processed_video.name = f"{prefix}/{outputs['mp4']}"
+            media.video_thumbnail.name = f"{prefix}/{outputs['poster']}"
+            media.hls_playlist = default_storage.url(f"{prefix}/{outputs['hls']}")
+            media.is_processed = True
+            media.processing_status = 'completed'
+            media.processing_progress = 100
+            media.processing_error = ''
+            media.save(update_fields=[
+                'processed_video', 'video_thumbnail', 'hls_playlist', 'is_processed',
+                'processing_status', 'processing_progress', 'processing_error', 'updated_at'
+            ])
+            logger.info(f"Successfully transcoded video {media_id}")
+        
+        except Exception as exc:
+            logger.error(f"Error transcoding video {media_id}: {exc}")
+            media.processing_status = 'failed'
+            media.processing_error = str(exc)
+            media.save(update_fields=['processing_status', 'processing_error', 'updated_at'])
+            raise self.retry(exc=exc, countdown=60)
 
 
-@shared_task(bind=True, max_retries=3)
-def process_video(media):
-    """
-    Process product video:
-    1. Compress and optimize for web
-    2. Convert to HLS or MP4
-    3. Generate thumbnail
+class ProgressReporter:
+    """Writes transcode progress to the row, at most every few percent / seconds"""
     
-    Requires ffmpeg to be installed on the system
-    """
-    try:
-        import subprocess
-        
-        input_path = media.original_file.path
-        base_name = os.path.splitext(os.path.basename(media.original_file.name))[0]
-        
-        # Output paths
-        output_dir = os.path.join('products/videos/processed/', base_name)
-        os.makedirs(os.path.join(default_storage.location, output_dir), exist_ok=True)
-        
-        output_video_path = os.path.join(output_dir, f"{base_name}_optimized.mp4")
-        output_thumbnail_path = os.path.join(output_dir, f"{base_name}_thumb.jpg")
-        
-        full_output_video = os.path.join(default_storage.location, output_video_path)
-        full_output_thumbnail = os.path.join(default_storage.location, output_thumbnail_path)
-        
-        # Convert video to optimized MP4
-        # Using H.264 codec with web-friendly settings
-        video_command = [
-            'ffmpeg',
-            '-i', input_path,
-            '-c:v', 'libx264',
-            '-preset', 'medium',
-            '-crf', '23',  # Quality (lower = better, 23 is good balance)
-            '-c:a', 'aac',
-            '-b:a', '128k',
-            '-movflags', '+faststart',  # Enable streaming
-            '-vf', 'scale=1280:-2',  # Scale to max 1280px width
-            '-y',  # Overwrite output
-            full_output_video
-        ]
-        
-        subprocess.run(video_command, check=True, capture_output=True)
-        
-        # Generate thumbnail from video (at 1 second mark)
-        thumbnail_command = [
-            'ffmpeg',
-            '-i', input_path,
-            '-ss', '00:00:01',  # Capture at 1 second
-            '-vframes', '1',
-            '-vf', 'scale=800:-1',
-            '-y',
-            full_output_thumbnail
-        ]
-        
-        subprocess.run(thumbnail_command, check=True, capture_output=True)
-        
-        # Update media object
-        media.processed_video.name = output_video_path
-        media.video_thumbnail.name = output_thumbnail_path
-        media.is_processed = True
-        media.processing_status = 'completed'
-        media.save()
-        
-        logger.info(f"Successfully processed video {media.id}")
-        
-    except subprocess.CalledProcessError as e:
-        logger.error(f"FFmpeg error processing video {media.id}: {e.stderr}")
-        raise
-    except Exception as e:
-        logger.error(f"Error processing video {media.id}: {str(e)}")
-        raise
+    def __init__(self, media_id, min_step=5, min_interval=2.0):
+        self.media_id = media_id
+        self.min_step = min_step
+        self.min_interval = min_interval
+        self.last_percent = 0
+        self.last_write = 0.0
+    
+    def __call__(self, percent):
+        now = time.monotonic()
+        if percent < 100 and (
+            percent - self.last_percent < self.min_step or now - self.last_write < self.min_interval
+        ):
+            return
+        from apps.products.models import ProductMedia
+        from django.utils import timezone
+        # update(): no signals or listing refresh for every tick; updated_at
+        # still moves so conditional GETs of the product see the progress
+        ProductMedia.objects.filter(pk=self.media_id).update(processing_progress=percent, updated_at=timezone.now())
+        self.last_percent, self.last_write = percent, now
 
 
 @shared_task
@@ -249,3 +222,64 @@ def cleanup_old_media():
     
     logger.info(f"Cleaned up {count} old failed media records")
     return count
+
+
+@shared_task
+def reprocess_media_batch(media_ids):
+    """
+    Rebuild processed images for a batch of image media whose processing
+    profile is out of date; rows that are already current are skipped
+    Queued by the reprocess_media management command on its own queue
+    """
+    from apps.products.models import ProductMedia
+    
+    profile = get_profile()
+    counts = {'processed': 0, 'skipped': 0, 'failed': 0}
+    
+    for media in ProductMedia.objects.filter(pk__in=media_ids, media_type='image').order_by('pk'):
+        if media.processing_profile == profile:
+            counts['skipped'] += 1
+            continue
+        try:
+            process_image(media)
+        except Exception as e:
+            # Keep serving the old images; the row stays stale and is retried next run
+            media.processing_error = str(e)
+            media.save(update_fields=['processing_error', 'updated_at'])
+            counts['failed'] += 1
+            continue
+        
+        media.is_processed = True
+        media.processing_status = 'completed'
+        media.processing_error = ''
+        media.save(update_fields=[
+            'is_processed', 'processing_status', 'processing_error', *IMAGE_RESULT_FIELDS, 'updated_at'
+        ])
+        counts['processed'] += 1
+    
+    return counts
+
+
+@shared_task(ignore_result=True)
+def flush_product_view_counts():
+    """
+    Periodic task: write buffered product view hits to Product.view_count
+    Scheduled via CELERY_BEAT_SCHEDULE every PRODUCT_VIEW_FLUSH_INTERVAL seconds
+    """
+    from apps.products.counters import flush_view_counts
+    
+    updated = flush_view_counts()
+    if updated:
+        logger.info(f"Flushed view counts for {updated} products")
+    return updated
+
+
+@shared_task(ignore_result=True)
+def build_related_products():
+    """
+    Periodic task: rebuild the related-products index from the order history
+    Scheduled nightly via CELERY_BEAT_SCHEDULE
+    """
+    from apps.products.related import build_related_index
+    
+    return build_related_index()
@@ -1,12 +1,71 @@
-from django.test import TestCase
+from django.core.exceptions import ValidationError
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
-from .models import Category, Product, ProductVariant
+from django.db import DatabaseError, connection
+from django.test.utils import CaptureQueriesContext
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+from redis.exceptions import LockNotOwnedError, RedisError
+from celery.exceptions import Retry
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from . import cache as collection_cache, counters, facets, imaging, media_store, renditions, tasks, video
+from .search import fold_vietnamese, get_search_backend, SQLiteFTSBackend
+from .models import (
+    Category, Product, ProductVariant, ProductListingSummary, ProductSearchDocument, RelatedProduct, ProductMedia,
+    MediaDerivativeSet
+)
+from .filters import compile_variant_filter
+from .related import build_related_index
+from apps.orders.models import Order, OrderItem, OrderStatus
+from django.apps import apps as django_apps
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files import File
+from django.core.files.storage import InMemoryStorage, default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.test import RequestFactory
+from importlib import import_module
+from io import BytesIO, StringIO
+from PIL import Image
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
 
 User = get_user_model()
 
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CatalogTestCase(TestCase):
+    """API client, an 'Eyewear' category and a product factory, on a local cache"""
+
+    product_fields = {'brand': 'Ray-Ban', 'base_price': '100.00', 'short_description': 'Short', 'description': 'Desc'}
+
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Eyewear')
+
+    def create_product(self, name, variants=(), category=None, **fields):
+        """
+        Product and its variants (SKU '<name>-<index>', the first one default),
+        with the on_commit summary/search/cache hooks run
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(
+                name=name, category=category or self.category, **{**self.product_fields, **fields}
+            )
+            for index, variant in enumerate(variants):
+                ProductVariant.objects.create(product=product, sku=f'{name}-{index}', **{'is_default': index == 0, **variant})
+        return product
+
 class ProductCreateAPITest(TestCase):
     def setUp(self):
         self.client = APIClient()
@@ -50,3 +109,1176 @@ class ProductCreateAPITest(TestCase):
         self.assertEqual(variant.product, product)
         self.assertEqual(variant.sku, 'TEST-SKU-001')
         self.assertEqual(variant.stock, 0)
+
+
+class ProductListingSummaryTest(CatalogTestCase):
+
+    def test_summary_refreshed_from_variant_changes(self):
+        product = self.create_product('Summary Product', [
+            {'color': 'Black', 'price': '200.00', 'sale_price': '150.00', 'stock': 0},
+            {'color': 'Gold', 'price': '300.00', 'stock': 4},
+        ])
+
+        summary = ProductListingSummary.objects.get(product=product)
+        self.assertEqual(summary.min_price, Decimal('150.00'))
+        self.assertEqual(summary.max_price, Decimal('300.00'))
+        self.assertEqual(summary.total_stock, 4)
+        self.assertTrue(summary.in_stock)
+        self.assertEqual(summary.default_color, 'Black')
+
+        gold = product.variants.get(color='Gold')
+        with self.captureOnCommitCallbacks(execute=True):
+            gold.stock = 0
+            gold.save(update_fields=['stock'])
+
+        summary.refresh_from_db()
+        self.assertEqual(summary.total_stock, 0)
+        self.assertFalse(summary.in_stock)
+
+    def test_list_query_count_does_not_grow_with_page_size(self):
+        self.create_product('First', [{'color': 'Black', 'price': '100.00', 'stock': 1}])
+        url = reverse('product-list')
+
+        with CaptureQueriesContext(connection) as small_page:
+            self.client.get(url)
+
+        for index in range(5):
+            self.create_product(f'Extra {index}', [{'color': 'Red', 'price': '120.00', 'stock': 2}])
+
+        with CaptureQueriesContext(connection) as large_page:
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 6)
+        self.assertEqual(len(small_page), len(large_page))
+        self.assertEqual(response.data['results'][0]['price_range'], {'min': Decimal('120.00'), 'max': Decimal('120.00')})
+
+    def test_variant_filters_match_on_the_same_variant(self):
+        mixed = self.create_product('Mixed', [
+            {'color': 'Black', 'size': 'L', 'price': '100.00', 'stock': 1},
+            {'color': 'Gold', 'size': 'M', 'price': '100.00', 'stock': 1},
+        ])
+        exact = self.create_product('Exact', [
+            {'color': 'Matte Black', 'size': 'M', 'price': '100.00', 'stock': 2},
+        ])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('product-list'), {'color': 'black', 'size': 'M', 'in_stock': 'true'})
+
+        self.assertEqual([p['id'] for p in response.data['results']], [exact.id])
+        self.assertFalse(any('DISTINCT' in query['sql'] for query in queries.captured_queries))
+
+
+class VariantFilterTest(CatalogTestCase):
+    """compile_variant_filter: one EXISTS over the same active variant"""
+
+    def setUp(self):
+        super().setUp()
+        # On sale for 150 but priced 200; the cheap one is out of stock
+        self.sale = self.create_product('Sale', [{'color': 'Black', 'price': '200.00', 'sale_price': '150.00', 'stock': 2}])
+        self.cheap = self.create_product('Cheap', [{'color': 'Black', 'price': '120.00', 'stock': 0}])
+        self.premium = self.create_product('Premium', [
+            {'color': 'Gold', 'price': '400.00', 'stock': 1},
+            {'color': 'Black', 'price': '90.00', 'stock': 5, 'is_active': False},
+        ])
+
+    def matching(self, **params):
+        variant_filter = compile_variant_filter(params)
+        return set(Product.objects.filter(variant_filter).values_list('name', flat=True))
+
+    def test_no_variant_params_compiles_to_nothing(self):
+        self.assertIsNone(compile_variant_filter({'in_stock': 'false', 'brand': 'Ray-Ban', 'color': ''}))
+
+    def test_price_bounds_use_the_raw_variant_price(self):
+        # Sale price is not what min/max_price compare against
+        self.assertEqual(self.matching(min_price='180'), {'Sale', 'Premium'})
+        self.assertEqual(self.matching(max_price='160'), {'Cheap'})
+        self.assertEqual(self.matching(min_price='100', max_price='200'), {'Sale', 'Cheap'})
+        # Inactive variants never match, even when cheaper
+        self.assertEqual(self.matching(max_price='100'), set())
+
+    def test_in_stock_holds_on_the_same_variant(self):
+        self.assertEqual(self.matching(in_stock='true'), {'Sale', 'Premium'})
+        self.assertEqual(self.matching(in_stock='true', max_price='160'), set())
+        # Premium's black variant is in stock but inactive
+        self.assertEqual(self.matching(in_stock='true', color='black'), {'Sale'})
+
+    def test_combines_with_category_tree(self):
+        sunglasses = Category.objects.create(name='Sunglasses', parent=self.category)
+        aviator = self.create_product('Aviator', [{'color': 'Black', 'price': '250.00', 'stock': 3}], category=sunglasses)
+        accessories = Category.objects.create(name='Accessories')
+        self.create_product('Case', [{'color': 'Black', 'price': '250.00', 'stock': 3}], category=accessories)
+
+        response = self.client.get(
+            reverse('product-list'), {'category_tree': 'sunglasses', 'min_price': '180', 'in_stock': 'true'}
+        )
+        self.assertEqual([p['id'] for p in response.data['results']], [aviator.id])
+
+        response = self.client.get(
+            reverse('product-list'), {'category_tree': 'eyewear', 'min_price': '180', 'in_stock': 'true'}
+        )
+        self.assertEqual({p['id'] for p in response.data['results']}, {self.sale.id, self.premium.id, aviator.id})
+
+
+@override_settings(PRODUCT_FACET_SYNC_INTERVAL=0)
+class ProductFacetTest(CatalogTestCase):
+
+    def test_list_returns_disjunctive_facet_counts(self):
+        self.create_product('Aviator', brand='Ray-Ban', variants=[
+            {'color': 'Black', 'size': 'M', 'price': '700000.00', 'stock': 3},
+            {'color': 'Gold', 'size': 'L', 'price': '900000.00', 'stock': 0},
+        ])
+        self.create_product('Holbrook', brand='Oakley', variants=[
+            {'color': 'Black', 'size': 'S', 'price': '1500000.00', 'stock': 1},
+        ])
+        facets.get_facet_index().sync(force=True)
+
+        response = self.client.get(reverse('product-list'), {'facets': 'true', 'brand': 'Ray-Ban'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 1)
+        counts = response.data['facets']
+        # Brand counts ignore the brand selection itself
+        self.assertEqual(counts['brand'], {'Oakley': 1, 'Ray-Ban': 1})
+        # Other facets are narrowed by the brand selection
+        self.assertEqual(counts['color'], {'Black': 1, 'Gold': 1})
+        self.assertEqual(counts['size'], {'L': 1, 'M': 1})
+        self.assertEqual(counts['price'], {'500000-1000000': 1})
+
+    def test_variant_facets_hold_on_the_same_variant_as_the_list_filter(self):
+        # Black only comes in L, size M only in out-of-stock Gold
+        self.create_product('Aviator', brand='Ray-Ban', variants=[
+            {'color': 'Black', 'size': 'L', 'price': '700000.00', 'stock': 3},
+            {'color': 'Gold', 'size': 'M', 'price': '1500000.00', 'stock': 0},
+        ])
+        self.create_product('Holbrook', brand='Oakley', variants=[
+            {'color': 'Black', 'size': 'M', 'price': '1500000.00', 'stock': 1},
+        ])
+        facets.get_facet_index().sync(force=True)
+
+        def get(**params):
+            return self.client.get(reverse('product-list'), {'facets': 'true', **params}).data
+
+        data = get(color='black')
+        self.assertEqual(data['facets']['size'], {'L': 1, 'M': 1})
+
+        data = get(color='black', size='M')
+        self.assertEqual(data['count'], 1)
+        self.assertEqual(data['facets']['brand'], {'Oakley': 1})
+        self.assertEqual(data['facets']['color'], {'Black': 1, 'Gold': 1})
+
+        data = get(size='M', in_stock='true')
+        self.assertEqual(data['count'], 1)
+        self.assertEqual(data['facets']['brand'], {'Oakley': 1})
+
+        # Price bounds apply to the variant price, on the same variant
+        data = get(color='black', min_price='1000000')
+        self.assertEqual(data['count'], 1)
+        self.assertEqual(data['facets']['brand'], {'Oakley': 1})
+        self.assertEqual(data['facets']['color'], {'Black': 1, 'Gold': 1})
+
+    def test_index_picks_up_variant_changes_incrementally(self):
+        product = self.create_product('Aviator', brand='Ray-Ban', variants=[
+            {'color': 'Black', 'price': '700000.00', 'stock': 3},
+        ])
+        index = facets.get_facet_index().sync(force=True)
+        self.assertEqual(index.counts({})['color'], {'Black': 1})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductVariant.objects.create(product=product, sku='Aviator-red', color='Red', price='700000.00')
+
+        index.sync()
+        self.assertEqual(index.counts({'color': ['red']})['brand'], {'Ray-Ban': 1})
+
+
+class ProductSearchTest(CatalogTestCase):
+    product_fields = {
+        **CatalogTestCase.product_fields,
+        'short_description': 'Gọng nhẹ',
+        'description': '<p>Tròng chống tia UV</p>',
+    }
+
+    def test_fold_vietnamese(self):
+        self.assertEqual(fold_vietnamese('Kính Mắt ĐẸP'), 'kinh mat dep')
+
+    def test_search_ignores_diacritics_and_ranks_by_relevance(self):
+        sunglasses = self.create_product('Kính Râm Aviator', brand='Ray-Ban')
+        frame = self.create_product('Gọng Kính Tròn', brand='Oakley', view_count=50)
+        self.create_product('Hộp Đựng', brand='Gentle Monster')
+
+        response = self.client.get(reverse('product-list'), {'search': 'kinh ram'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([p['id'] for p in response.data['results']], [sunglasses.id])
+
+        response = self.client.get(reverse('product-list'), {'search': 'kính'})
+        self.assertEqual({p['id'] for p in response.data['results']}, {sunglasses.id, frame.id})
+        self.assertIsInstance(get_search_backend(), SQLiteFTSBackend)
+
+        # Description text is searchable too, with HTML stripped
+        response = self.client.get(reverse('product-list'), {'search': 'chong tia'})
+        self.assertEqual(response.data['count'], 3)
+
+    def test_search_ranks_and_paginates_in_sql(self):
+        # Every description mentions "UV"; only one name does
+        products = [
+            self.create_product('Gọng Vuông', brand='Prada'),
+            self.create_product('Gọng Tròn', brand='Oakley', view_count=1000),
+            self.create_product('Kính Râm UV', brand='Ray-Ban'),
+            self.create_product('Hộp Đựng', brand='Gentle Monster'),
+        ]
+
+        pages, url, params = [], reverse('product-list'), {'search': 'uv', 'page_size': 1, 'paginate': 'cursor'}
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.extend(p['id'] for p in response.data['results'])
+            url, params = response.data['next'], None
+
+        # Name hit first, then popularity lifts a body hit; every match once
+        self.assertEqual(pages[:2], [products[2].id, products[1].id])
+        self.assertEqual(sorted(pages), sorted(product.id for product in products))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('product-list'), {'search': 'uv'})
+        self.assertEqual([p['id'] for p in response.data['results']], pages)
+        # Ranked by the FTS subquery, not a CASE over ids fetched up front
+        self.assertFalse(any('CASE' in query['sql'] for query in queries.captured_queries))
+
+    def test_deleted_product_leaves_the_index(self):
+        product = self.create_product('Kính Râm', brand='Ray-Ban')
+        with self.captureOnCommitCallbacks(execute=True):
+            product.delete()
+
+        response = self.client.get(reverse('product-list'), {'search': 'kinh'})
+        self.assertEqual(response.data['count'], 0)
+
+    def test_migration_backfills_products_created_before_search(self):
+        product = self.create_product('Kính Râm', brand='Ray-Ban')
+        # As if the product predates 0008: no document, no FTS row
+        ProductSearchDocument.objects.all().delete()
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM products_search_fts')
+
+        migration = import_module('apps.products.migrations.0014_backfill_search_documents')
+        # SQLite's schema editor can't open inside the test transaction
+        schema_editor = MagicMock(connection=connection)
+        schema_editor.execute.side_effect = lambda sql: connection.cursor().execute(sql)
+        migration.backfill_search_documents(django_apps, schema_editor)
+
+        self.assertEqual(ProductSearchDocument.objects.get(product=product).name, 'kinh ram')
+        response = self.client.get(reverse('product-list'), {'search': 'kinh ram'})
+        self.assertEqual([p['id'] for p in response.data['results']], [product.id])
+
+
+class ProductViewCounterTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Eyewear')
+        self.product = Product.objects.create(
+            name='Viewed', brand='Ray-Ban', category=self.category,
+            base_price='100.00', short_description='Short', description='Desc',
+        )
+        counters._buffer.drain()
+        counters._buffer.redis_down_until = 0.0
+
+    def test_retrieve_buffers_views_when_redis_is_down(self):
+        with patch('apps.products.counters.get_redis', side_effect=RedisError('down')):
+            for _ in range(3):
+                response = self.client.get(reverse('product-detail', kwargs={'slug': self.product.slug}))
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+            # Nothing written on the read path
+            self.product.refresh_from_db()
+            self.assertEqual(self.product.view_count, 0)
+            self.assertEqual(counters._buffer.counts[self.product.pk], 3)
+
+            # Redis still down: the buffer is written straight to the DB
+            counters.flush_local_buffer()
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.view_count, 3)
+
+    def test_apply_view_counts_adds_to_existing_counts(self):
+        other = Product.objects.create(
+            name='Other', brand='Oakley', category=self.category, view_count=10,
+            base_price='100.00', short_description='Short', description='Desc',
+        )
+
+        with self.assertNumQueries(1):
+            counters.apply_view_counts({str(self.product.pk).encode(): b'4', other.pk: 2})
+
+        self.product.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((self.product.view_count, other.view_count), (4, 12))
+
+
+    def _redis(self, pending):
+        client = MagicMock()
+        client.lock.return_value.acquire.return_value = True
+        client.pipeline.return_value.execute.side_effect = lambda: [pending.copy(), pending.clear()]
+        return client
+
+    def test_flush_claims_pending_hits_once(self):
+        pending = {str(self.product.pk).encode(): b'3'}
+        client = self._redis(pending)
+        # The lock expired during a slow flush: release() must not fail the flush
+        client.lock.return_value.release.side_effect = LockNotOwnedError('expired')
+
+        with patch('apps.products.counters.get_redis', return_value=client):
+            self.assertEqual(counters.flush_view_counts(), 1)
+            self.assertEqual(counters.flush_view_counts(), 0)
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.view_count, 3)
+        # Read and delete in one MULTI/EXEC
+        client.pipeline.assert_called_with(transaction=True)
+
+    def test_failed_flush_hands_hits_back(self):
+        pending = {str(self.product.pk).encode(): b'2'}
+        client = self._redis(pending)
+
+        with patch('apps.products.counters.get_redis', return_value=client), \
+                patch('apps.products.counters.apply_view_counts', side_effect=DatabaseError('down')):
+            with self.assertRaises(DatabaseError):
+                counters.flush_view_counts()
+
+        client.pipeline.return_value.hincrby.assert_called_once_with(
+            counters.PENDING_KEY, str(self.product.pk).encode(), 2
+        )
+
+
+class ProductKeysetPaginationTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Eyewear')
+        # Duplicate prices force the id tie-breaker to keep pages disjoint
+        self.products = [
+            Product.objects.create(
+                name=f'Frame {index}', brand='Ray-Ban', category=self.category,
+                base_price=['100.00', '200.00', '100.00', '300.00', '200.00'][index],
+                short_description='Short', description='Desc',
+            )
+            for index in range(5)
+        ]
+
+    def _walk(self, url, params):
+        ids, pages = [], []
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append(response.data)
+            ids.extend(p['id'] for p in response.data['results'])
+            if not response.data['next']:
+                return ids, pages
+            response = self.client.get(response.data['next'])
+
+    def test_cursor_pages_follow_every_ordering(self):
+        url = reverse('product-list')
+        for ordering in ['base_price', '-base_price', 'name', '-created_at', 'view_count']:
+            field = ordering.lstrip('-')
+            expected = sorted(
+                self.products,
+                key=lambda p: (getattr(p, field), p.pk),
+                reverse=ordering.startswith('-'),
+            )
+            ids, pages = self._walk(url, {'paginate': 'cursor', 'ordering': ordering, 'page_size': 2})
+            self.assertEqual(ids, [p.pk for p in expected], ordering)
+            self.assertNotIn('count', pages[0])
+
+    def test_previous_link_returns_the_earlier_page(self):
+        url = reverse('product-list')
+        first = self.client.get(url, {'paginate': 'cursor', 'ordering': 'base_price', 'page_size': 2}).data
+        second = self.client.get(first['next']).data
+        back = self.client.get(second['previous']).data
+
+        self.assertEqual([p['id'] for p in back['results']], [p['id'] for p in first['results']])
+        self.assertIsNone(back['previous'])
+
+    def test_count_is_opt_in_and_page_numbers_still_work(self):
+        url = reverse('product-list')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url, {'paginate': 'cursor'})
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+
+        response = self.client.get(url, {'paginate': 'cursor', 'count': 'exact'})
+        self.assertEqual(response.data['count'], 5)
+
+        response = self.client.get(url, {'page': 1})
+        self.assertEqual(response.data['count'], 5)
+
+        response = self.client.get(url, {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ProductCollectionCacheTest(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        collection_cache.cache.clear()
+
+    def test_featured_is_served_from_cache_until_a_member_changes(self):
+        featured = self.create_product('Featured', is_featured=True)
+        url = reverse('product-featured')
+
+        self.assertEqual(self.client.get(url).data[0]['in_stock'], False)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertFalse(any('SELECT' in query['sql'] for query in queries.captured_queries))
+
+        # Unrelated products leave the cached entry alone
+        version = collection_cache.get_version('featured')
+        self.create_product('Plain')
+        self.assertEqual(collection_cache.get_version('featured'), version)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductVariant.objects.create(product=featured, sku='FEAT-1', color='Black', price='100.00', stock=3)
+
+        self.assertEqual(self.client.get(url).data[0]['in_stock'], True)
+
+    def test_unflagging_removes_product_from_collection(self):
+        featured = self.create_product('Featured', is_featured=True)
+        url = reverse('product-featured')
+        self.assertEqual(len(self.client.get(url).data), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            featured.is_featured = False
+            featured.save()
+
+        self.assertEqual(self.client.get(url).data, [])
+
+    def test_stale_entry_is_served_while_another_request_rebuilds(self):
+        calls = []
+
+        def build():
+            calls.append(1)
+            return ['fresh'], []
+
+        key = f"{collection_cache.KEY_PREFIX}:featured:{collection_cache.get_version('featured')}:featured"
+        collection_cache.cache.set(key, {'payload': ['stale'], 'members': [], 'fresh_until': 0}, 60)
+
+        # Another worker holds the rebuild lock: stale payload, no rebuild
+        collection_cache.cache.add(f'{key}:lock', 1, 30)
+        self.assertEqual(collection_cache.get_or_build('featured', 'featured', build), ['stale'])
+        self.assertEqual(calls, [])
+
+        # Lock released: this request rebuilds
+        collection_cache.cache.delete(f'{key}:lock')
+        self.assertEqual(collection_cache.get_or_build('featured', 'featured', build), ['fresh'])
+        self.assertEqual(calls, [1])
+
+    def test_build_still_served_when_the_cache_fails_mid_request(self):
+        # Lock taken and entry stored, then the cache goes away before the release
+        with patch.object(collection_cache.cache, 'delete', side_effect=ConnectionError('down')):
+            self.assertEqual(collection_cache.get_or_build('featured', 'featured', lambda: (['fresh'], [])), ['fresh'])
+
+
+class ConditionalGetTest(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = self.create_product('Aviator')
+        self.variant = ProductVariant.objects.create(product=self.product, sku='AV-1', color='Black', price='100.00', stock=1)
+
+    def test_product_detail_returns_304_until_a_variant_changes(self):
+        url = reverse('product-detail', kwargs={'slug': self.product.slug})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+        self.variant.stock = 0
+        self.variant.save(update_fields=['stock', 'updated_at'])
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_deleting_a_variant_changes_the_etag(self):
+        url = reverse('product-detail', kwargs={'slug': self.product.slug})
+        etag = self.client.get(url)['ETag']
+
+        ProductVariant.objects.create(product=self.product, sku='AV-2', color='Gold', price='100.00')
+        etag_with_two = self.client.get(url)['ETag']
+        ProductVariant.objects.filter(sku='AV-2').delete()
+
+        self.assertNotEqual(etag, etag_with_two)
+        self.assertNotEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag_with_two).status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_category_and_variant_endpoints_are_conditional(self):
+        for url in [reverse('category-list'), reverse('variant-list'), reverse('variant-detail', kwargs={'pk': self.variant.pk})]:
+            etag = self.client.get(url)['ETag']
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED, url)
+
+        self.assertEqual(self.client.get(reverse('variant-detail', kwargs={'pk': 'abc'})).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class RelatedProductIndexTest(CatalogTestCase):
+    IN_STOCK = [{'color': 'Black', 'price': '100.00', 'stock': 5}]
+
+    def setUp(self):
+        super().setUp()
+        self.sunglasses = Category.objects.create(name='Sunglasses')
+        self.frames = Category.objects.create(name='Frames')
+
+    def _order(self, *products, status=OrderStatus.COMPLETED):
+        order = Order.objects.create(
+            email='buyer@example.com', phone='0900000000', payment_method='cod',
+            subtotal='100.00', total='100.00', status=status,
+        )
+        for variant in (product.variants.get() for product in products):
+            OrderItem.objects.create(
+                order=order, variant=variant, product_name=variant.product.name, variant_sku=variant.sku,
+                variant_details={}, unit_price='100.00', quantity=1, total_price='100.00',
+            )
+
+    def test_co_purchases_outrank_category_neighbours(self):
+        aviator = self.create_product('Aviator', self.IN_STOCK, category=self.sunglasses)
+        wayfarer = self.create_product('Wayfarer', self.IN_STOCK, category=self.sunglasses)
+        frame = self.create_product('Round Frame', self.IN_STOCK, category=self.frames, brand='Oakley')
+        self._order(aviator, frame)
+        self._order(aviator, frame)
+        # Cancelled orders do not count
+        self._order(aviator, status=OrderStatus.CANCELED)
+
+        self.assertGreater(build_related_index(top_n=2), 0)
+
+        links = RelatedProduct.objects.filter(product=aviator)
+        self.assertEqual([link.related_id for link in links], [frame.id, wayfarer.id])
+        self.assertEqual(links[0].co_purchases, 2)
+
+        response = self.client.get(reverse('product-related', kwargs={'slug': aviator.slug}))
+        self.assertEqual([p['id'] for p in response.data], [frame.id, wayfarer.id])
+
+    def test_related_falls_back_to_category_before_index_is_built(self):
+        aviator = self.create_product('Aviator', self.IN_STOCK, category=self.sunglasses)
+        wayfarer = self.create_product('Wayfarer', self.IN_STOCK, category=self.sunglasses)
+        self.create_product('Round Frame', self.IN_STOCK, category=self.frames)
+
+        response = self.client.get(reverse('product-related', kwargs={'slug': aviator.slug}))
+        self.assertEqual([p['id'] for p in response.data], [wayfarer.id])
+
+
+class CategoryTreeTest(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        collection_cache.cache.clear()
+        self.eyewear = self.category
+        self.sunglasses = Category.objects.create(name='Sunglasses', parent=self.eyewear)
+        self.aviators = Category.objects.create(name='Aviators', parent=self.sunglasses)
+        self.accessories = Category.objects.create(name='Accessories')
+
+    def test_paths_follow_moves(self):
+        self.assertEqual(self.aviators.depth, 2)
+        self.assertTrue(self.aviators.path.startswith(self.sunglasses.path))
+
+        self.sunglasses.parent = self.accessories
+        self.sunglasses.save()
+        self.aviators.refresh_from_db()
+
+        self.assertTrue(self.aviators.path.startswith(self.accessories.path))
+        self.assertEqual(self.aviators.depth, 2)
+        self.assertEqual(set(self.eyewear.get_descendants()), set())
+
+        # Cycles are rejected by validation; save() only maintains the path
+        self.accessories.parent = self.aviators
+        with self.assertRaises(ValidationError):
+            self.accessories.full_clean()
+
+        self.accessories.refresh_from_db()
+        with patch.object(Category, 'clean') as clean:
+            self.accessories.display_order = 1
+            self.accessories.save()
+        clean.assert_not_called()
+
+    def test_orm_save_rejects_a_cyclic_parent(self):
+        paths = dict(Category.objects.values_list('pk', 'path'))
+
+        self.eyewear.parent = self.aviators
+        with self.assertRaises(ValidationError):
+            self.eyewear.save()
+        self.sunglasses.parent = self.sunglasses
+        with self.assertRaises(ValidationError):
+            self.sunglasses.save()
+
+        # Parent change rolled back, paths untouched
+        self.assertEqual(dict(Category.objects.values_list('pk', 'path')), paths)
+        self.assertIsNone(Category.objects.get(pk=self.eyewear.pk).parent_id)
+        self.assertEqual(set(self.eyewear.get_descendants()), {self.sunglasses, self.aviators})
+
+    def test_tree_endpoint_counts_products_per_subtree(self):
+        self.create_product('Classic Aviator', category=self.aviators)
+        self.create_product('Wayfarer', category=self.sunglasses)
+        self.create_product('Case', category=self.accessories)
+
+        response = self.client.get(reverse('category-tree'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        eyewear = next(node for node in response.data if node['slug'] == 'eyewear')
+        self.assertEqual((eyewear['product_count'], eyewear['total_product_count']), (0, 2))
+        sunglasses = eyewear['children'][0]
+        self.assertEqual((sunglasses['product_count'], sunglasses['total_product_count']), (1, 2))
+        self.assertEqual(sunglasses['children'][0]['slug'], 'aviators')
+
+        # Cached until a product or category changes
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('category-tree'))
+        self.assertFalse(any('SELECT' in query['sql'] for query in queries.captured_queries))
+
+        self.create_product('Pilot', category=self.aviators)
+        response = self.client.get(reverse('category-tree'))
+        eyewear = next(node for node in response.data if node['slug'] == 'eyewear')
+        self.assertEqual(eyewear['total_product_count'], 3)
+
+    def test_product_listing_filters_by_category_subtree(self):
+        aviator = self.create_product('Classic Aviator', category=self.aviators)
+        wayfarer = self.create_product('Wayfarer', category=self.sunglasses)
+        self.create_product('Case', category=self.accessories)
+
+        response = self.client.get(reverse('product-list'), {'category_tree': 'eyewear'})
+        self.assertEqual({p['id'] for p in response.data['results']}, {aviator.id, wayfarer.id})
+
+        response = self.client.get(reverse('product-list'), {'category_tree': self.aviators.pk})
+        self.assertEqual([p['id'] for p in response.data['results']], [aviator.id])
+
+
+class ImageDerivativeTest(TestCase):
+    """Single-decode pyramid pipeline in apps.products.imaging"""
+
+    def _jpeg(self, size, mode='RGB'):
+        output = BytesIO()
+        Image.new(mode, size, (120, 60, 30)).save(output, format='JPEG', quality=90)
+        output.seek(0)
+        return output
+
+    def tearDown(self):
+        imaging.shutdown_executor()
+
+    def test_renders_every_size_in_every_format(self):
+        renditions, info = imaging.render_derivatives(self._jpeg((2400, 1600)))
+        self.assertEqual((info.width, info.height), (2400, 1600))
+        color = tuple(int(info.dominant_color[i:i + 2], 16) for i in (1, 3, 5))
+        for channel, expected in zip(color, (120, 60, 30)):
+            self.assertAlmostEqual(channel, expected, delta=3)  # JPEG rounding
+        self.assertTrue(info.placeholder.startswith('data:image/webp;base64,'))
+        self.assertLess(len(info.placeholder), 400)
+
+        self.assertEqual(
+            {(r.size_name, r.image_format) for r in renditions},
+            {(size, f) for size in imaging.DEFAULT_SIZES for f in imaging.get_formats()},
+        )
+        for rendition in renditions:
+            with Image.open(BytesIO(rendition.data)) as img:
+                self.assertEqual(img.format, rendition.image_format)
+                self.assertEqual(img.size, imaging.DEFAULT_SIZES[rendition.size_name])
+                self.assertEqual(img.size, (rendition.width, rendition.height))
+
+    def test_unsupported_format_checked_and_warned_once(self):
+        imaging.can_encode.cache_clear()
+        self.addCleanup(imaging.can_encode.cache_clear)
+        with patch('apps.products.imaging.features.check', return_value=False) as check:
+            with self.assertLogs('apps.products.imaging', level='WARNING') as logs:
+                for _ in range(3):
+                    self.assertEqual(imaging.get_formats(), ['JPEG'])
+        self.assertEqual(check.call_count, len(imaging.DEFAULT_FORMATS) - 1)
+        self.assertEqual(len(logs.output), len(imaging.DEFAULT_FORMATS) - 1)
+
+    def test_srcset_from_legacy_manifest(self):
+        srcset = media_store.build_srcset({'thumbnail': '/t.webp', 'large': '/l.webp'})
+        self.assertEqual(srcset, {'image/webp': '/t.webp 300w, /l.webp 1500w'})
+
+    def test_large_jpeg_decoded_in_draft_mode(self):
+        img, original_size = imaging.decode(self._jpeg((4800, 3600)), {'small': (300, 300)})
+        self.assertEqual(original_size, (4800, 3600))
+        # DCT scaling: 1/8 is the largest reduction that still covers 300x300
+        self.assertEqual(img.size, (600, 450))
+
+    def test_small_source_upscaled(self):
+        img, _ = imaging.decode(self._jpeg((400, 300)), imaging.DEFAULT_SIZES)
+        self.assertEqual(img.size, (800, 600))
+
+    def test_encoders_use_processes_unless_the_worker_is_daemonic(self):
+        # Threads-pool workers run tasks in the main process: real process pool
+        self.assertIsInstance(imaging.get_executor(), ProcessPoolExecutor)
+        imaging.shutdown_executor()
+
+        # Prefork children are daemonic and may not fork
+        with patch('apps.products.imaging.multiprocessing.current_process', return_value=MagicMock(daemon=True)):
+            self.assertIsInstance(imaging.get_executor(), ThreadPoolExecutor)
+
+
+class BenchmarkCommandTest(TestCase):
+    """Smoke runs of the image benchmarks on a tiny generated source"""
+
+    def setUp(self):
+        # Measurements fork; the children must not inherit a live pool
+        imaging.shutdown_executor()
+        self.addCleanup(imaging.shutdown_executor)
+
+    def test_benchmark_media(self):
+        out = StringIO()
+        call_command('benchmark_media', '--megapixels', '0.05', '--runs', '1', stdout=out)
+        output = out.getvalue()
+        self.assertIn('0.05 MP JPEG source:', output)
+        for pipeline in ('legacy', 'pyramid'):
+            self.assertIn(f'  {pipeline} ', output)
+        self.assertIn('Benchmark complete', output)
+
+    def test_benchmark_image_pipeline_writes_and_compares_json(self):
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir, ignore_errors=True)
+        results_path = os.path.join(workdir, 'results.json')
+        args = ['--megapixels', '0.05', '--modes', 'RGB', 'P', '--orientations', '6', '--formats', 'JPEG', '--runs', '1']
+
+        call_command('benchmark_image_pipeline', *args, '--json', results_path, stdout=StringIO())
+        with open(results_path) as handle:
+            results = json.load(handle)
+        self.assertEqual([case['name'] for case in results['cases']], ['0.05mp-RGB-o6', '0.05mp-P-o6'])
+        for case in results['cases']:
+            self.assertEqual(set(case['ms']), {'decode', 'upscale', 'fit', 'encode', 'describe', 'total'})
+            self.assertGreater(case['output_bytes']['JPEG'], 0)
+
+        out = StringIO()
+        call_command('benchmark_image_pipeline', *args, '--compare', results_path, stdout=out)
+        self.assertIn('0.05mp-P-o6', out.getvalue().split('Against')[1])
+
+        with self.assertRaises(CommandError):
+            call_command('benchmark_image_pipeline', *args, '--compare', os.path.join(workdir, 'missing.json'))
+
+
+class MediaDeduplicationTest(TestCase):
+    """Content-addressed originals and derivatives (apps.products.media_store)"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.addCleanup(imaging.shutdown_executor)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        category = Category.objects.create(name='Sunglasses')
+        self.product = Product.objects.create(
+            name='Aviator', brand='Ray-Ban', category=category, base_price='100.00',
+            short_description='Short', description='Desc',
+        )
+        output = BytesIO()
+        Image.new('RGB', (1000, 900), (20, 80, 160)).save(output, format='JPEG')
+        self.photo = output.getvalue()
+
+    def _stored_files(self):
+        return sorted(
+            os.path.relpath(os.path.join(root, name), self.media_root)
+            for root, _, names in os.walk(self.media_root) for name in names
+        )
+
+    def _upload(self, name):
+        with patch('apps.products.tasks.process_product_media.delay') as delay:
+            media = ProductMedia.objects.create(
+                product=self.product, media_type='image',
+                original_file=SimpleUploadedFile(name, self.photo, content_type='image/jpeg'),
+            )
+        return media, delay
+
+    def test_upload_handler_hashes_while_streaming(self):
+        request = RequestFactory().post('/', {'file': SimpleUploadedFile('a.jpg', self.photo)})
+        self.assertEqual(request.FILES['file'].content_hash, hashlib.sha256(self.photo).hexdigest())
+
+    def test_repeat_upload_reuses_original_and_derivatives(self):
+        first, delay = self._upload('front.jpg')
+        delay.assert_called_once_with(first.pk)
+        self.assertEqual(first.content_hash, hashlib.sha256(self.photo).hexdigest())
+
+        tasks.process_product_media(first.pk)
+        first.refresh_from_db()
+        self.assertEqual(first.processing_status, 'completed')
+        self.assertEqual(set(first.processed_images), set(imaging.DEFAULT_SIZES) | {'renditions'})
+        large_webp = next(
+            r for r in first.processed_images['renditions'] if (r['size'], r['format']) == ('large', 'webp')
+        )
+        self.assertEqual(first.processed_images['large'], large_webp['url'])
+        self.assertEqual((large_webp['width'], large_webp['height']), (1500, 1500))
+        self.assertGreater(large_webp['bytes'], 0)
+
+        self.assertEqual((first.width, first.height), (1000, 900))
+        self.assertTrue(first.placeholder.startswith('data:image/webp;base64,'))
+        response = APIClient().get(reverse('product-list'))
+        self.assertEqual(response.data['results'][0]['thumbnail_placeholder'], {
+            'width': 300, 'height': 300, 'dominant_color': first.dominant_color, 'placeholder': first.placeholder,
+        })
+
+        response = APIClient().get(reverse('product-detail', args=[self.product.slug]))
+        srcset = response.data['media'][0]['srcset']
+        self.assertEqual(list(srcset)[-1], 'image/jpeg')
+        self.assertIn(f"{large_webp['url']} 1500w", srcset['image/webp'])
+        stored = self._stored_files()
+
+        second, delay = self._upload('front-copy.jpg')
+        delay.assert_not_called()
+        self.assertTrue(second.is_processed)
+        self.assertEqual(second.original_file.name, first.original_file.name)
+        self.assertEqual(second.processed_images, first.processed_images)
+        self.assertEqual(second.placeholder, first.placeholder)
+        self.assertEqual(second.processing_profile, imaging.get_profile())
+        self.assertEqual(self._stored_files(), stored)
+        self.assertEqual(MediaDerivativeSet.objects.count(), 1)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ReprocessMediaCommandTest(TestCase):
+    """reprocess_media: stale profile detection, checkpoint and resume"""
+
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.addCleanup(imaging.shutdown_executor)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        category = Category.objects.create(name='Sunglasses')
+        product = Product.objects.create(
+            name='Aviator', brand='Ray-Ban', category=category, base_price='100.00',
+            short_description='Short', description='Desc',
+        )
+        self.media = []
+        for shade in range(3):
+            output = BytesIO()
+            Image.new('RGB', (900, 900), (shade * 40, 90, 160)).save(output, format='JPEG')
+            with patch('apps.products.tasks.process_product_media.delay'):
+                media = ProductMedia.objects.create(
+                    product=product, media_type='image',
+                    original_file=SimpleUploadedFile(f'{shade}.jpg', output.getvalue()),
+                )
+            self.media.append(media)
+        # Built with an older profile
+        ProductMedia.objects.update(processing_profile='img-old', is_processed=True, processing_status='completed')
+
+    def _profiles(self):
+        return list(ProductMedia.objects.order_by('pk').values_list('processing_profile', flat=True))
+
+    def test_resumes_after_interruption_and_skips_current_rows(self):
+        real_batch = tasks.reprocess_media_batch
+        calls = []
+
+        def interrupt_second_batch(ids):
+            calls.append(ids)
+            if len(calls) == 2:
+                raise KeyboardInterrupt
+            return real_batch(ids)
+
+        with patch('apps.products.management.commands.reprocess_media.reprocess_media_batch', interrupt_second_batch):
+            call_command('reprocess_media', '--sync', '--batch-size', '1', stdout=StringIO())
+        profile = imaging.get_profile()
+        self.assertEqual(self._profiles(), [profile, 'img-old', 'img-old'])
+
+        out = StringIO()
+        call_command('reprocess_media', '--sync', '--batch-size', '1', stdout=out)
+        self.assertIn(f'2 after checkpoint {self.media[0].pk}', out.getvalue())
+        self.assertEqual(self._profiles(), [profile] * 3)
+        self.assertEqual(set(ProductMedia.objects.get(pk=self.media[2].pk).processed_images['renditions'][0]), {
+            'size', 'format', 'url', 'width', 'height', 'bytes'
+        })
+
+        # Nothing stale any more
+        out = StringIO()
+        call_command('reprocess_media', '--sync', stdout=out)
+        self.assertIn('0 stale rows', out.getvalue())
+
+
+    def test_limited_run_keeps_the_checkpoint(self):
+        call_command('reprocess_media', '--sync', '--batch-size', '1', '--limit', '1', stdout=StringIO())
+
+        out = StringIO()
+        call_command('reprocess_media', '--sync', '--dry-run', stdout=out)
+        self.assertIn(f'2 after checkpoint {self.media[0].pk}', out.getvalue())
+
+
+class VideoTranscodeTest(TestCase):
+    """Single-run ffmpeg command, progress parsing and transcode slots (apps.products.video)"""
+
+    def test_progress_parsed_per_block(self):
+        seen = []
+        lines = [b'frame=10', b'out_time_us=2500000', b'progress=continue',
+                 b'out_time_ms=5000000', b'progress=continue', b'progress=end']
+        video.parse_progress(lines, 10.0, seen.append)
+        self.assertEqual(seen, [25, 50, 100])
+
+    def test_one_invocation_without_upscaled_renditions(self):
+        source = video.SourceInfo(duration=12.0, width=1280, height=720, has_audio=True)
+        rungs = video.select_rungs(source)
+        self.assertEqual([rung['name'] for rung in rungs], ['720p', '480p', '360p'])
+
+        command = video.build_command('in.mov', '/out', source, rungs, 'clip.mp4', 'clip.jpg')
+        self.assertEqual(command.count('-i'), 1)
+        self.assertIn('split=5', command[command.index('-filter_complex') + 1])
+        self.assertEqual(
+            command[command.index('-var_stream_map') + 1],
+            'v:0,a:0,name:720p v:1,a:1,name:480p v:2,a:2,name:360p',
+        )
+        self.assertIn('+faststart', command)
+        self.assertEqual(command[-1], '/out/clip.jpg')
+
+    def test_transcode_slots_cap_concurrency(self):
+        lock_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, lock_dir, ignore_errors=True)
+
+        first = video.TranscodeSlot(slots=1, lock_dir=lock_dir)
+        second = video.TranscodeSlot(slots=1, lock_dir=lock_dir)
+        self.assertTrue(first.acquire())
+        self.assertFalse(second.acquire())
+        first.release()
+        self.assertTrue(second.acquire())
+        second.release()
+
+    def test_transcode_slots_are_no_ops_without_fcntl(self):
+        with patch.object(video, 'fcntl', None):
+            first = video.TranscodeSlot(slots=1, lock_dir=os.path.join(tempfile.gettempdir(), 'unused'))
+            second = video.TranscodeSlot(slots=1)
+            self.assertTrue(first.acquire())
+            self.assertTrue(second.acquire())
+            first.release()
+            second.release()
+
+    def test_waiting_for_a_slot_is_bounded(self):
+        category = Category.objects.create(name='Sunglasses')
+        product = Product.objects.create(
+            name='Aviator', brand='Ray-Ban', category=category, base_price='100.00',
+            short_description='Short', description='Desc',
+        )
+        with patch('apps.products.tasks.process_product_media.delay'):
+            media = ProductMedia.objects.create(product=product, media_type='video', original_file='clip.mp4')
+
+        with patch('apps.products.video.TranscodeSlot.acquire', return_value=False):
+            # Slots busy: requeued, remembering when the wait started
+            with patch.object(tasks.transcode_product_video, 'retry', side_effect=Retry) as retry:
+                with self.assertRaises(Retry):
+                    tasks.transcode_product_video(media.pk)
+            self.assertIsNotNone(retry.call_args.kwargs['kwargs']['waiting_since'])
+
+            # Still busy past PRODUCT_VIDEO_SLOT_WAIT: marked failed, no requeue
+            with override_settings(PRODUCT_VIDEO_SLOT_WAIT=60):
+                tasks.transcode_product_video(media.pk, waiting_since=time.time() - 61)
+
+        media.refresh_from_db()
+        self.assertEqual(media.processing_status, 'failed')
+        self.assertIn('transcode slot', media.processing_error)
+
+    def test_outputs_of_same_named_uploads_do_not_collide(self):
+        category = Category.objects.create(name='Sunglasses')
+        product = Product.objects.create(
+            name='Aviator', brand='Ray-Ban', category=category, base_price='100.00',
+            short_description='Short', description='Desc',
+        )
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        outputs = {'hls': 'master.m3u8', 'mp4': 'clip.mp4', 'poster': 'clip.jpg'}
+
+        with override_settings(MEDIA_ROOT=media_root), \
+                patch('apps.products.tasks.process_product_media.delay'), \
+                patch('apps.products.video.transcode', return_value=outputs), \
+                patch('apps.products.tasks.store_tree') as store_tree:
+            # Same filename uploaded in different months
+            media = []
+            for month in ('01', '02'):
+                name = f'products/videos/originals/2026/{month}/clip.mp4'
+                os.makedirs(os.path.join(media_root, os.path.dirname(name)))
+                with open(os.path.join(media_root, name), 'wb') as handle:
+                    handle.write(month.encode())
+                media.append(ProductMedia.objects.create(product=product, media_type='video', original_file=name))
+            for item in media:
+                tasks.transcode_product_video(item.pk)
+
+        prefixes = [call.args[1] for call in store_tree.call_args_list]
+        self.assertEqual(len(set(prefixes)), 2)
+        for item in media:
+            item.refresh_from_db()
+            self.assertEqual(item.processing_status, 'completed')
+        self.assertNotEqual(media[0].processed_video.name, media[1].processed_video.name)
+
+    def test_video_upload_dispatched_to_video_queue(self):
+        category = Category.objects.create(name='Sunglasses')
+        product = Product.objects.create(
+            name='Aviator', brand='Ray-Ban', category=category, base_price='100.00',
+            short_description='Short', description='Desc',
+        )
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        with override_settings(MEDIA_ROOT=media_root), patch('apps.products.tasks.process_product_media.delay'):
+            media = ProductMedia.objects.create(
+                product=product, media_type='video',
+                original_file=SimpleUploadedFile('clip.mp4', b'not really a video'),
+            )
+
+        with patch('apps.products.tasks.transcode_product_video.apply_async') as apply_async:
+            tasks.process_product_media(media.pk)
+        apply_async.assert_called_once_with(args=[media.pk], queue='media_video')
+        media.refresh_from_db()
+        self.assertEqual(media.processing_status, 'processing')
+        self.assertFalse(media.is_processed)
+
+
+class ForwardOnlyStream(io.RawIOBase):
+    """Response body of an object-store GET: readable once, front to back"""
+
+    def __init__(self, data):
+        self._buffer = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def readinto(self, target):
+        data = self._buffer.read(len(target))
+        target[:len(data)] = data
+        return len(data)
+
+
+class ObjectStorage(InMemoryStorage):
+    """
+    Local stand-in for S3-compatible storage: nothing is on the local disk
+    and reads are non-seekable streams
+    """
+
+    def _open(self, name, mode='rb'):
+        return File(ForwardOnlyStream(super()._open(name, mode).read()), name=name)
+
+    def size(self, name):
+        return len(super()._open(name, 'rb').read())
+
+
+@override_settings(STORAGES={
+    'default': {'BACKEND': 'apps.products.tests.ObjectStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+})
+class ObjectStorageMediaTest(TestCase):
+    """Media processing through the storage API only (apps.products.media_store)"""
+
+    def setUp(self):
+        self.addCleanup(imaging.shutdown_executor)
+        category = Category.objects.create(name='Sunglasses')
+        self.product = Product.objects.create(
+            name='Aviator', brand='Ray-Ban', category=category, base_price='100.00',
+            short_description='Short', description='Desc',
+        )
+
+    def test_image_processed_without_local_paths(self):
+        output = BytesIO()
+        Image.new('RGB', (1200, 900), (200, 40, 40)).save(output, format='JPEG')
+        with patch('apps.products.tasks.process_product_media.delay'):
+            media = ProductMedia.objects.create(
+                product=self.product, media_type='image',
+                original_file=SimpleUploadedFile('object.jpg', output.getvalue()),
+            )
+
+        tasks.process_product_media(media.pk)
+        media.refresh_from_db()
+        self.assertEqual(media.processing_status, 'completed')
+        self.assertEqual((media.width, media.height), (1200, 900))
+        for rendition in media.processed_images['renditions']:
+            name = media_store.derivative_path(
+                media.content_hash, media.processing_profile, rendition['size'],
+                imaging.FORMAT_EXTENSIONS[rendition['format'].upper()],
+            )
+            self.assertEqual(default_storage.size(name), rendition['bytes'])
+
+    def test_local_copy_for_ffmpeg_is_bounded_and_removed(self):
+        name = default_storage.save('products/originals/clip.mp4', File(BytesIO(b'x' * 5000)))
+        media = ProductMedia(original_file=name)
+        self.assertFalse(os.path.exists(default_storage.path(name)))
+
+        with media_store.local_path(media.original_file) as path:
+            self.assertTrue(path.endswith('.mp4'))
+            with open(path, 'rb') as handle:
+                self.assertEqual(handle.read(), b'x' * 5000)
+        self.assertFalse(os.path.exists(path))
+
+        with override_settings(PRODUCT_MEDIA_MAX_SOURCE_BYTES=1000):
+            with self.assertRaises(media_store.SourceTooLarge):
+                with media_store.local_path(media.original_file):
+                    pass
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class OnDemandRenditionTest(TestCase):
+    """Signed /media/r/ renditions (apps.products.renditions)"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        category = Category.objects.create(name='Sunglasses')
+        product = Product.objects.create(
+            name='Aviator', brand='Ray-Ban', category=category, base_price='100.00',
+            short_description='Short', description='Desc',
+        )
+        output = BytesIO()
+        Image.new('RGB', (1000, 900), (20, 80, 160)).save(output, format='JPEG')
+        with patch('apps.products.tasks.process_product_media.delay'):
+            self.media = ProductMedia.objects.create(
+                product=product, media_type='image',
+                original_file=SimpleUploadedFile('front.jpg', output.getvalue()),
+            )
+
+    def test_first_request_renders_then_served_from_storage(self):
+        url = renditions.rendition_url(self.media.content_hash, 640, 480, 'webp')
+        self.assertTrue(url.startswith(f'/media/r/{self.media.content_hash}/640x480.webp?s='))
+
+        with patch('apps.products.renditions.render_one', wraps=imaging.render_one) as render_one:
+            first = self.client.get(url)
+            second = self.client.get(url)
+
+        render_one.assert_called_once()
+        for response in (first, second):
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'image/webp')
+            self.assertIn('immutable', response['Cache-Control'])
+        with Image.open(BytesIO(b''.join(second.streaming_content))) as img:
+            self.assertEqual(img.size, (640, 480))
+        name = renditions.rendition_name(self.media.content_hash, 640, 480, 'webp')
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, name)))
+
+    def test_signed_layout_urls_round_trip_through_the_api(self):
+        response = self.client.get(reverse('product-detail', args=[self.media.product.slug]))
+        self.assertEqual(response.status_code, 200)
+        layouts = response.json()['media'][0]['layout_urls']
+        self.assertEqual(set(layouts), set(renditions.DEFAULT_LAYOUTS))
+        self.assertEqual(list(layouts['card'])[-1], 'image/jpeg')
+
+        rendition = self.client.get(layouts['card']['image/webp'])
+        self.assertEqual(rendition.status_code, 200)
+        with Image.open(BytesIO(b''.join(rendition.streaming_content))) as img:
+            self.assertEqual(img.size, renditions.DEFAULT_LAYOUTS['card'])
+
+    def test_signature_and_bounds_are_enforced(self):
+        content_hash = self.media.content_hash
+        url = renditions.rendition_url(content_hash, 640, 480, 'webp')
+        self.assertEqual(self.client.get(url.replace('640x480', '641x480')).status_code, 403)
+        self.assertEqual(self.client.get(url.split('?')[0]).status_code, 403)
+
+        too_big = renditions.rendition_url(content_hash, 9000, 480, 'webp')
+        self.assertEqual(self.client.get(too_big).status_code, 404)
+        unknown = renditions.rendition_url('0' * 64, 640, 480, 'webp')
+        self.assertEqual(self.client.get(unknown).status_code, 404)
+
+    def test_concurrent_first_hit_waits_instead_of_rendering(self):
+        content_hash = self.media.content_hash
+        name = renditions.rendition_name(content_hash, 320, 320, 'jpg')
+        # Another process holds the render lock and never finishes in time
+        cache.add(renditions.LOCK_KEY.format(name=name), 1, 60)
+
+        with patch('apps.products.renditions.WAIT_TIMEOUT', 0.3), \
+                patch('apps.products.renditions.render_one') as render_one:
+            response = self.client.get(renditions.rendition_url(content_hash, 320, 320, 'jpg'))
+
+        render_one.assert_not_called()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
@@ -0,0 +1,41 @@
+"""
+Upload handlers that hash files while they stream in
+
+Drop-in replacements for Django's default handlers (see FILE_UPLOAD_HANDLERS):
+every UploadedFile gets a `content_hash` (SHA-256 hex) computed chunk by
+chunk as it is received, so media deduplication never re-reads the upload.
+"""
+
+import hashlib
+
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+
+class ContentHashMixin:
+    """Feed every chunk this handler consumes into a SHA-256 digest"""
+
+    def new_file(self, *args, **kwargs):
+        # Before super(): MemoryFileUploadHandler raises StopFutureHandlers
+        self.hasher = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        result = super().receive_data_chunk(raw_data, start)
+        if result is None:
+            # Consumed by this handler (not passed on to the next one)
+            self.hasher.update(raw_data)
+        return result
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.content_hash = self.hasher.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(ContentHashMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(ContentHashMixin, TemporaryFileUploadHandler):
+    pass
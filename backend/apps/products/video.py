@@ -0,0 +1,290 @@
+"""
+Video transcoding for product media
+
+One ffmpeg run per upload decodes the source once and writes, from a
+split filter graph:
+- an HLS ladder (one rendition per configured height, no upscaling)
+  with aligned keyframes and a master playlist
+- a faststart MP4 for browsers without HLS
+- a JPEG poster frame
+
+Progress is read from `-progress pipe:1` and reported through a callback;
+stderr goes to a temporary file so long runs never buffer it in memory.
+Concurrent transcodes per host are capped with file-lock slots (POSIX
+only; without fcntl, e.g. Windows dev machines, slots are not enforced).
+"""
+
+from collections import namedtuple
+import json
+import os
+import subprocess
+import tempfile
+import logging
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: no flock, transcode slots become no-ops (see TranscodeSlot)
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_LADDER = [
+    {'name': '1080p', 'height': 1080, 'video_bitrate': '5000k', 'audio_bitrate': '128k'},
+    {'name': '720p', 'height': 720, 'video_bitrate': '2800k', 'audio_bitrate': '128k'},
+    {'name': '480p', 'height': 480, 'video_bitrate': '1400k', 'audio_bitrate': '96k'},
+    {'name': '360p', 'height': 360, 'video_bitrate': '800k', 'audio_bitrate': '64k'},
+]
+
+# Progressive MP4 fallback: capped height, quality-targeted
+MP4_MAX_HEIGHT = 720
+MP4_CRF = 23
+
+HLS_SEGMENT_SECONDS = 6
+
+# Poster frame time (clamped for very short clips)
+POSTER_AT = 1.0
+
+MASTER_PLAYLIST = 'master.m3u8'
+
+# How much of stderr to keep for error messages
+STDERR_TAIL = 4000
+
+SourceInfo = namedtuple('SourceInfo', ['duration', 'width', 'height', 'has_audio'])
+
+
+class TranscodeError(Exception):
+    """ffmpeg/ffprobe failed; message holds the tail of its stderr"""
+
+
+def get_ladder():
+    return getattr(settings, 'PRODUCT_VIDEO_LADDER', DEFAULT_LADDER)
+
+
+def get_ffmpeg():
+    return getattr(settings, 'PRODUCT_FFMPEG_BINARY', 'ffmpeg')
+
+
+def get_ffprobe():
+    return getattr(settings, 'PRODUCT_FFPROBE_BINARY', 'ffprobe')
+
+
+def get_max_transcodes():
+    return getattr(settings, 'PRODUCT_VIDEO_MAX_TRANSCODES', 1)
+
+
+# ---------------------------------------------------------------------- probe
+
+def probe(input_path):
+    """Duration and video size of the source, and whether it has audio"""
+    result = subprocess.run(
+        [
+            get_ffprobe(), '-v', 'error', '-print_format', 'json',
+            '-show_entries', 'format=duration:stream=codec_type,width,height',
+            input_path,
+        ],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False,
+    )
+    if result.returncode != 0:
+        raise TranscodeError(result.stderr.decode('utf-8', 'replace')[-STDERR_TAIL:])
+
+    data = json.loads(result.stdout or b'{}')
+    streams = data.get('streams', [])
+    video = next((s for s in streams if s.get('codec_type') == 'video'), None)
+    if video is None:
+        raise TranscodeError(f"No video stream in {os.path.basename(input_path)}")
+    return SourceInfo(
+        duration=float(data.get('format', {}).get('duration') or 0),
+        width=int(video.get('width') or 0),
+        height=int(video.get('height') or 0),
+        has_audio=any(s.get('codec_type') == 'audio' for s in streams),
+    )
+
+
+def select_rungs(source, ladder=None):
+    """Ladder rungs not taller than the source (at least the smallest one)"""
+    ladder = sorted(ladder or get_ladder(), key=lambda rung: -rung['height'])
+    rungs = [rung for rung in ladder if rung['height'] <= source.height]
+    return rungs or ladder[-1:]
+
+
+# ---------------------------------------------------------------------- command
+
+def build_command(input_path, output_dir, source, rungs, mp4_name, poster_name):
+    """
+    Single ffmpeg invocation: split the decoded video once into every
+    HLS rendition, the MP4 fallback and the poster frame
+    """
+    branches = len(rungs) + 2
+    labels = ''.join(f'[v{i}]' for i in range(branches))
+    graph = [f'[0:v]split={branches}{labels}']
+    for i, rung in enumerate(rungs):
+        graph.append(f"[v{i}]scale=-2:{rung['height']}[hls{i}]")
+    mp4_height = min(MP4_MAX_HEIGHT, source.height) // 2 * 2 or MP4_MAX_HEIGHT
+    graph.append(f'[v{len(rungs)}]scale=-2:{mp4_height}[mp4]')
+    poster_at = min(POSTER_AT, source.duration / 2) if source.duration else 0
+    graph.append(f'[v{len(rungs) + 1}]trim=start={poster_at:.3f},setpts=PTS-STARTPTS,scale=800:-2[poster]')
+
+    command = [
+        get_ffmpeg(), '-hide_banner', '-nostats', '-loglevel', 'error',
+        '-progress', 'pipe:1', '-y',
+        '-i', input_path,
+        '-filter_complex', ';'.join(graph),
+    ]
+
+    # HLS ladder: keyframes every segment so renditions switch cleanly
+    stream_map = []
+    for i, rung in enumerate(rungs):
+        command += ['-map', f'[hls{i}]']
+        if source.has_audio:
+            command += ['-map', '0:a:0']
+        command += [
+            f'-c:v:{i}', 'libx264', f'-b:v:{i}', rung['video_bitrate'],
+            f'-maxrate:v:{i}', rung['video_bitrate'], f'-bufsize:v:{i}', _double(rung['video_bitrate']),
+        ]
+        if source.has_audio:
+            command += [f'-c:a:{i}', 'aac', f'-b:a:{i}', rung['audio_bitrate']]
+            stream_map.append(f"v:{i},a:{i},name:{rung['name']}")
+        else:
+            stream_map.append(f"v:{i},name:{rung['name']}")
+    command += [
+        '-preset', 'veryfast', '-sc_threshold', '0',
+        '-force_key_frames', f'expr:gte(t,n_forced*{HLS_SEGMENT_SECONDS})',
+        '-f', 'hls', '-hls_time', str(HLS_SEGMENT_SECONDS), '-hls_playlist_type', 'vod',
+        '-hls_segment_filename', os.path.join(output_dir, 'hls', '%v', 'segment_%03d.ts'),
+        '-master_pl_name', MASTER_PLAYLIST,
+        '-var_stream_map', ' '.join(stream_map),
+        os.path.join(output_dir, 'hls', '%v', 'index.m3u8'),
+    ]
+
+    # Progressive MP4 with the index up front (starts playing before download ends)
+    command += ['-map', '[mp4]']
+    if source.has_audio:
+        command += ['-map', '0:a:0', '-c:a', 'aac', '-b:a', '128k']
+    command += [
+        '-c:v', 'libx264', '-preset', 'medium', '-crf', str(MP4_CRF),
+        '-movflags', '+faststart',
+        os.path.join(output_dir, mp4_name),
+    ]
+
+    command += ['-map', '[poster]', '-frames:v', '1', os.path.join(output_dir, poster_name)]
+    return command
+
+
+def _double(bitrate):
+    """'2800k' -> '5600k' (VBV buffer of two seconds)"""
+    number, unit = bitrate[:-1], bitrate[-1]
+    if unit.isdigit():
+        return str(int(bitrate) * 2)
+    return f'{int(float(number) * 2)}{unit}'
+
+
+# ---------------------------------------------------------------------- run
+
+def parse_progress(lines, duration, on_progress):
+    """
+    Consume ffmpeg `-progress` key=value lines and call on_progress(percent)
+    at the end of every block (ffmpeg emits one about twice a second)
+    """
+    out_time = 0
+    for raw in lines:
+        line = raw.decode('utf-8', 'replace').strip() if isinstance(raw, bytes) else raw.strip()
+        key, _, value = line.partition('=')
+        if key in ('out_time_us', 'out_time_ms'):
+            # Both are microseconds (out_time_ms is misnamed in ffmpeg)
+            try:
+                out_time = int(value) / 1_000_000
+            except ValueError:
+                continue
+        elif key == 'progress':
+            if value == 'end':
+                on_progress(100)
+            elif duration:
+                on_progress(max(0, min(99, int(out_time * 100 / duration))))
+
+
+def run_ffmpeg(command, duration, on_progress):
+    """Run ffmpeg streaming progress; raises TranscodeError with the stderr tail on failure"""
+    with tempfile.TemporaryFile() as stderr:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr)
+        try:
+            parse_progress(process.stdout, duration, on_progress)
+            returncode = process.wait()
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+        if returncode != 0:
+            stderr.seek(max(0, stderr.seek(0, os.SEEK_END) - STDERR_TAIL))
+            raise TranscodeError(stderr.read().decode('utf-8', 'replace'))
+
+
+def transcode(input_path, output_dir, base_name, on_progress=lambda percent: None):
+    """
+    Transcode `input_path` into `output_dir`; returns the produced files
+    relative to it: {'hls': 'hls/master.m3u8', 'mp4': ..., 'poster': ...}
+    """
+    source = probe(input_path)
+    rungs = select_rungs(source)
+    for rung in rungs:
+        os.makedirs(os.path.join(output_dir, 'hls', rung['name']), exist_ok=True)
+
+    mp4_name = f'{base_name}_optimized.mp4'
+    poster_name = f'{base_name}_thumb.jpg'
+    command = build_command(input_path, output_dir, source, rungs, mp4_name, poster_name)
+    logger.info(f"Transcoding {base_name}: {source.width}x{source.height}, {source.duration:.1f}s, "
+                f"renditions {[rung['name'] for rung in rungs]}")
+    run_ffmpeg(command, source.duration, on_progress)
+
+    return {
+        'hls': os.path.join('hls', MASTER_PLAYLIST),
+        'mp4': mp4_name,
+        'poster': poster_name,
+    }
+
+
+# ---------------------------------------------------------------------- slots
+
+class TranscodeSlot:
+    """
+    Non-blocking host-wide semaphore built from flock'd files: at most
+    PRODUCT_VIDEO_MAX_TRANSCODES transcodes run at once, whatever the
+    worker concurrency. Locks are released by the kernel if the holder dies.
+    Where fcntl is unavailable (Windows) every acquire succeeds.
+    """
+
+    def __init__(self, slots=None, lock_dir=None):
+        self.slots = slots or get_max_transcodes()
+        self.lock_dir = lock_dir or getattr(settings, 'PRODUCT_VIDEO_LOCK_DIR', None) or tempfile.gettempdir()
+        self.handle = None
+
+    def acquire(self):
+        """True if a slot was taken"""
+        if fcntl is None:
+            return True
+        os.makedirs(self.lock_dir, exist_ok=True)
+        for slot in range(self.slots):
+            handle = open(os.path.join(self.lock_dir, f'product-video-transcode-{slot}.lock'), 'w')
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                handle.close()
+                continue
+            self.handle = handle
+            return True
+        return False
+
+    def release(self):
+        if self.handle is not None:
+            fcntl.flock(self.handle, fcntl.LOCK_UN)
+            self.handle.close()
+            self.handle = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
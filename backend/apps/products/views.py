@@ -7,7 +7,21 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAuthenticated
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Q, Count, Avg
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Q, Count, Avg, Max
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseForbidden, HttpResponseRedirect
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import require_GET
+from . import cache as collection_cache
+from . import renditions
+from .conditional import conditional_response, make_etag, latest
+from .counters import record_view
+from .pagination import CatalogPagination
+from .imaging import FORMAT_MIME_TYPES
+from .filters import ProductSearchFilter, ProductOrderingFilter, VARIANT_FILTER_LOOKUPS, compile_variant_filter
+from .facets import get_facet_index, selections_from_params, bitset_from_ids, price_bucket_bounds
 from .models import Category, Product, ProductVariant, ProductReview
 from .serializers import (
     CategorySerializer, ProductListSerializer, ProductDetailSerializer,
@@ -37,6 +51,33 @@ class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
                 queryset = queryset.filter(parent_id=parent_id)
         
         return queryset.order_by('display_order', 'name')
+    
+    @action(detail=False, methods=['get'])
+    def tree(self, request):
+        """Whole active category hierarchy with product counts (cached)"""
+        tree = collection_cache.get_or_build(
+            collection_cache.CATEGORY_TREE_SCOPE, 'tree',
+            lambda: (Category.build_tree(), [])
+        )
+        return Response(tree)
+    
+    def list(self, request, *args, **kwargs):
+        """Category list, 304 when no category in it changed"""
+        stats = self.filter_queryset(self.get_queryset()).aggregate(latest=Max('updated_at'), count=Count('pk'))
+        etag = make_etag('categories', request.get_full_path(), stats['count'], stats['latest'])
+        return conditional_response(
+            request, etag, stats['latest'], lambda: super(CategoryViewSet, self).list(request, *args, **kwargs)
+        )
+    
+    def retrieve(self, request, *args, **kwargs):
+        """Category detail, 304 when unchanged"""
+        row = self.get_queryset().filter(slug=kwargs[self.lookup_field]).values('pk', 'updated_at').first()
+        if row is None:
+            return super().retrieve(request, *args, **kwargs)
+        etag = make_etag('category', row['pk'], row['updated_at'])
+        return conditional_response(
+            request, etag, row['updated_at'], lambda: super(CategoryViewSet, self).retrieve(request, *args, **kwargs)
+        )
 
 
 class ProductViewSet(viewsets.ModelViewSet):
@@ -45,12 +86,14 @@ class ProductViewSet(viewsets.ModelViewSet):
     Provides list, retrieve, and filtering
     """
     queryset = Product.objects.filter(is_active=True).select_related('category').prefetch_related('variants', 'media')
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter, ProductOrderingFilter]
     filterset_fields = ['category', 'brand', 'target_gender', 'is_featured', 'is_new_arrival', 'is_best_seller']
     search_fields = ['name', 'brand', 'description', 'short_description']
     ordering_fields = ['created_at', 'base_price', 'view_count', 'name']
     ordering = ['-created_at']
+    pagination_class = CatalogPagination
     lookup_field = 'slug'
+    listing_actions = ['list', 'featured', 'new_arrivals', 'best_sellers', 'related']
     
     def get_serializer_class(self):
         """Use different serializers for list and detail views"""
@@ -65,81 +108,167 @@ class ProductViewSet(viewsets.ModelViewSet):
         """Custom filtering for products"""
         queryset = super().get_queryset()
         
-        # Filter by price range
-        min_price = self.request.query_params.get('min_price', None)
-        max_price = self.request.query_params.get('max_price', None)
+        # Listing actions read from the denormalized summary instead of
+        # prefetching every variant and media row
+        if self.action in self.listing_actions:
+            queryset = queryset.prefetch_related(None).select_related('listing_summary')
         
-        if min_price:
-            queryset = queryset.filter(variants__price__gte=min_price).distinct()
-        if max_price:
-            queryset = queryset.filter(variants__price__lte=max_price).distinct()
+        # Variant-level filters (price, color, lens type, material, size, stock)
+        # compiled into a single EXISTS on the same variant
+        variant_filter = compile_variant_filter(self.request.query_params)
+        if variant_filter is not None:
+            queryset = queryset.filter(variant_filter)
         
-        # Filter by color
-        color = self.request.query_params.get('color', None)
-        if color:
-            queryset = queryset.filter(variants__color__icontains=color).distinct()
+        # Filter by a category and all of its descendants (id or slug)
+        category_tree = self.request.query_params.get('category_tree', None)
+        if category_tree:
+            queryset = queryset.filter(category__path__startswith=self.get_category_path(category_tree))
         
-        # Filter by lens type
-        lens_type = self.request.query_params.get('lens_type', None)
-        if lens_type:
-            queryset = queryset.filter(variants__lens_type=lens_type).distinct()
+        # Filter by price bucket (same buckets as the price facet)
+        price_bucket = self.request.query_params.get('price_bucket', None)
+        if price_bucket:
+            try:
+                lower, upper = price_bucket_bounds(price_bucket)
+            except (ValueError, ArithmeticError):
+                lower, upper = None, None
+            if lower is not None:
+                queryset = queryset.filter(listing_summary__min_price__gte=lower)
+            if upper is not None:
+                queryset = queryset.filter(listing_summary__min_price__lt=upper)
         
-        # Filter by material
-        material = self.request.query_params.get('material', None)
-        if material:
-            queryset = queryset.filter(variants__material=material).distinct()
+        return queryset
+    
+    def get_category_path(self, value):
+        """Materialized path of a category given by id or slug (unmatchable if unknown)"""
+        lookup = {'pk': value} if value.isdigit() else {'slug': value}
+        path = Category.objects.filter(is_active=True, **lookup).values_list('path', flat=True).first()
+        return path or '-'
+    
+    def list(self, request, *args, **kwargs):
+        """Product listing, optionally with facet counts (?facets=true)"""
+        response = super().list(request, *args, **kwargs)
         
-        # Filter by size
-        size = self.request.query_params.get('size', None)
-        if size:
-            queryset = queryset.filter(variants__size=size).distinct()
+        if request.query_params.get('facets') == 'true' and isinstance(response.data, dict):
+            response.data['facets'] = self.get_facet_counts()
         
-        # Filter by availability
-        in_stock = self.request.query_params.get('in_stock', None)
-        if in_stock == 'true':
-            queryset = queryset.filter(variants__stock__gt=0, variants__is_active=True).distinct()
+        return response
+    
+    def get_facet_counts(self):
+        """
+        Facet counts for the current filters, computed from the in-memory bitset index
+        Constraints the index cannot express are resolved once in SQL and
+        intersected as base bitsets: text search and category subtree over
+        products, min/max price over variants (held on the same variant as the
+        other variant-level selections, like compile_variant_filter)
+        """
+        params = self.request.query_params
+        index = get_facet_index()
         
-        return queryset
+        base = None
+        if params.get('search') or params.get('category_tree'):
+            base_queryset = Product.objects.filter(is_active=True)
+            base_queryset = ProductSearchFilter().filter_queryset(self.request, base_queryset, self)
+            if params.get('category_tree'):
+                base_queryset = base_queryset.filter(
+                    category__path__startswith=self.get_category_path(params['category_tree'])
+                )
+            base = bitset_from_ids(base_queryset.values_list('pk', flat=True))
+        
+        variant_base = None
+        price_conditions = {
+            VARIANT_FILTER_LOOKUPS[param]: params[param] for param in ('min_price', 'max_price') if params.get(param)
+        }
+        if price_conditions:
+            variant_base = bitset_from_ids(
+                ProductVariant.objects.filter(is_active=True, **price_conditions).values_list('pk', flat=True)
+            )
+        
+        return index.counts(selections_from_params(params), base=base, variant_base=variant_base)
     
     def retrieve(self, request, *args, **kwargs):
-        """Increment view count when retrieving product detail"""
-        instance = self.get_object()
+        """
+        Count the view (buffered, written to the DB in batches) and return product detail
+        Answers 304 without serializing when the product, its category,
+        variants and media are unchanged since the client's copy
+        """
+        row = Product.objects.filter(is_active=True, slug=kwargs[self.lookup_field]).values(
+            'pk', 'updated_at', 'category__updated_at'
+        ).annotate(
+            variants_updated=Max('variants__updated_at'),
+            variants_count=Count('variants', distinct=True),
+            media_updated=Max('media__updated_at'),
+            media_count=Count('media', distinct=True),
+        ).first()
         
-        # Increment view count
-        Product.objects.filter(pk=instance.pk).update(view_count=instance.view_count + 1)
+        if row is None:
+            # Let get_object() raise the 404
+            return Response(self.get_serializer(self.get_object()).data)
         
-        serializer = self.get_serializer(instance)
-        return Response(serializer.data)
+        record_view(row['pk'])
+        
+        last_modified = latest(row['updated_at'], row['category__updated_at'], row['variants_updated'], row['media_updated'])
+        etag = make_etag(
+            'product', row['pk'], row['updated_at'], row['category__updated_at'],
+            row['variants_updated'], row['variants_count'], row['media_updated'], row['media_count'],
+        )
+        return conditional_response(
+            request, etag, last_modified, lambda: Response(self.get_serializer(self.get_object()).data)
+        )
+    
+    def cached_collection(self, scope, name, get_queryset):
+        """
+        Serialized collection from the collection cache
+        Requests with extra query params (filters) bypass the cache
+        """
+        if self.request.query_params:
+            return self.get_serializer(get_queryset(), many=True).data
+        
+        def build():
+            products = list(get_queryset())
+            return list(self.get_serializer(products, many=True).data), [p.pk for p in products]
+        
+        return collection_cache.get_or_build(scope, name, build)
     
     @action(detail=False, methods=['get'])
     def featured(self, request):
         """Get featured products"""
-        queryset = self.get_queryset().filter(is_featured=True)[:10]
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        data = self.cached_collection(
+            'featured', 'featured',
+            lambda: self.get_queryset().filter(is_featured=True)[:10]
+        )
+        return Response(data)
     
     @action(detail=False, methods=['get'])
     def new_arrivals(self, request):
         """Get new arrival products"""
-        queryset = self.get_queryset().filter(is_new_arrival=True).order_by('-created_at')[:10]
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        data = self.cached_collection(
+            'new_arrivals', 'new_arrivals',
+            lambda: self.get_queryset().filter(is_new_arrival=True).order_by('-created_at')[:10]
+        )
+        return Response(data)
     
     @action(detail=False, methods=['get'])
     def best_sellers(self, request):
         """Get best seller products"""
-        queryset = self.get_queryset().filter(is_best_seller=True)[:10]
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        data = self.cached_collection(
+            'best_sellers', 'best_sellers',
+            lambda: self.get_queryset().filter(is_best_seller=True)[:10]
+        )
+        return Response(data)
     
     @action(detail=True, methods=['get'])
     def related(self, request, slug=None):
-        """Get related products (same category)"""
+        """
+        Get related products from the precomputed index (co-purchases +
+        category/brand similarity), falling back to the same category
+        until the index has been built for this product
+        """
         product = self.get_object()
-        queryset = self.get_queryset().filter(
-            category=product.category
-        ).exclude(pk=product.pk)[:6]
-        serializer = self.get_serializer(queryset, many=True)
+        queryset = self.get_queryset().filter(linked_from__product=product).order_by('linked_from__rank')[:6]
+        products = list(queryset)
+        if not products:
+            products = self.get_queryset().filter(category=product.category).exclude(pk=product.pk)[:6]
+        serializer = self.get_serializer(products, many=True)
         return Response(serializer.data)
 
 
@@ -150,6 +279,7 @@ class ProductVariantViewSet(viewsets.ModelViewSet):
     """
     queryset = ProductVariant.objects.select_related('product')
     serializer_class = ProductVariantSerializer
+    pagination_class = CatalogPagination
     filter_backends = [DjangoFilterBackend, filters.SearchFilter]
     filterset_fields = ['product', 'color', 'material', 'lens_type', 'size']
     search_fields = ['=sku', 'sku', 'product__name', 'product__brand']
@@ -177,6 +307,48 @@ class ProductVariantViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(stock__gt=0)
         
         return queryset
+    
+    def list(self, request, *args, **kwargs):
+        """Variant list, 304 when no listed variant (or its product/media) changed"""
+        stats = self.filter_queryset(self.get_queryset()).aggregate(
+            variants_updated=Max('updated_at'),
+            products_updated=Max('product__updated_at'),
+            media_updated=Max('media__updated_at'),
+            count=Count('pk', distinct=True),
+            media_count=Count('media', distinct=True),
+        )
+        return conditional_response(
+            request, self.make_variant_etag(stats), self.last_modified(stats),
+            lambda: super(ProductVariantViewSet, self).list(request, *args, **kwargs)
+        )
+    
+    def retrieve(self, request, *args, **kwargs):
+        """Variant detail, 304 when unchanged"""
+        try:
+            stats = self.get_queryset().filter(pk=kwargs[self.lookup_field]).aggregate(
+                variants_updated=Max('updated_at'),
+                products_updated=Max('product__updated_at'),
+                media_updated=Max('media__updated_at'),
+                count=Count('pk', distinct=True),
+                media_count=Count('media', distinct=True),
+            )
+        except (TypeError, ValueError):
+            stats = {'count': 0}
+        if not stats['count']:
+            return super().retrieve(request, *args, **kwargs)
+        return conditional_response(
+            request, self.make_variant_etag(stats), self.last_modified(stats),
+            lambda: super(ProductVariantViewSet, self).retrieve(request, *args, **kwargs)
+        )
+    
+    def make_variant_etag(self, stats):
+        return make_etag(
+            'variants', self.request.get_full_path(), stats['count'], stats['variants_updated'],
+            stats['products_updated'], stats['media_updated'], stats['media_count'],
+        )
+    
+    def last_modified(self, stats):
+        return latest(stats['variants_updated'], stats['products_updated'], stats['media_updated'])
 
 
 class ProductReviewViewSet(viewsets.ModelViewSet):
@@ -246,3 +418,33 @@ class ProductReviewViewSet(viewsets.ModelViewSet):
         )
         
         return Response(stats)
+
+
+@require_GET
+@transaction.non_atomic_requests
+def rendition(request, content_hash, width, height, ext):
+    """
+    Signed on-demand rendition (see apps.products.renditions)
+    nginx serves already rendered files itself; this only runs for cold sizes
+    (and for every request when Django serves media, e.g. in development)
+    """
+    width, height = int(width), int(height)
+    if not renditions.verify(content_hash, width, height, ext, request.GET.get('s')):
+        return HttpResponseForbidden()
+    try:
+        name = renditions.get_or_render(content_hash, width, height, ext)
+    except renditions.RenditionNotFound:
+        raise Http404
+    except renditions.RenditionBusy:
+        response = HttpResponse(status=503)
+        response['Retry-After'] = '1'
+        return response
+
+    if getattr(settings, 'PRODUCT_RENDITION_REDIRECT', False):
+        # Object storage: let the client fetch it from the bucket / CDN
+        response = HttpResponseRedirect(default_storage.url(name))
+    else:
+        image_format = renditions.EXTENSION_FORMATS[ext]
+        response = FileResponse(default_storage.open(name, 'rb'), content_type=FORMAT_MIME_TYPES[image_format])
+    patch_cache_control(response, public=True, max_age=365 * 24 * 3600, immutable=True)
+    return response
@@ -9,6 +9,7 @@ from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.authtoken.models import Token
 from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_in
 from .auth_serializers import (
     LoginSerializer,
     RegisterSerializer,
@@ -40,12 +41,17 @@ class LoginView(APIView):
             # Get or create auth token
             token, created = Token.objects.get_or_create(user=user)
             
+            # Token login bypasses django.contrib.auth.login(): send the
+            # signal ourselves (guest cart merge, last_login)
+            user_logged_in.send(sender=user.__class__, request=request, user=user)
+            
             # Return user data + token
             user_serializer = UserSerializer(user)
             
             return Response({
                 'token': token.key,
                 'user': user_serializer.data,
+                'cart_merge_conflicts': getattr(request, 'cart_merge_conflicts', []),
                 'message': 'Đăng nhập thành công!'
             }, status=status.HTTP_200_OK)
         
@@ -72,12 +78,17 @@ class RegisterView(APIView):
             # Create auth token
             token = Token.objects.create(user=user)
             
+            # Registering logs the user in: same signal as LoginView, so the
+            # guest cart is merged into the new account
+            user_logged_in.send(sender=user.__class__, request=request, user=user)
+            
             # Return user data + token
             user_serializer = UserSerializer(user)
             
             return Response({
                 'token': token.key,
                 'user': user_serializer.data,
+                'cart_merge_conflicts': getattr(request, 'cart_merge_conflicts', []),
                 'message': 'Đăng ký thành công!'
             }, status=status.HTTP_201_CREATED)
         
@@ -1,9 +1,26 @@
 """
 Celery configuration for the Django project
+
+Tasks are routed to separate queues so CPU-heavy media work never delays
+the order pipeline:
+
+    orders          order processing and refunds (checkout latency)
+    notifications   customer / staff emails
+    media           processing of new uploads
+    media_video     video transcodes (minutes each, see PRODUCT_VIDEO_QUEUE)
+    media_bulk      reprocess_media rebuilds (see PRODUCT_MEDIA_REPROCESS_QUEUE)
+    maintenance     periodic housekeeping (beat)
+    default         anything not routed
+
+Each queue is consumed by its own worker, started from a profile in
+WORKER_PROFILES (pool, concurrency, prefetch, child recycling), e.g.:
+
+    python -m config.worker orders
 """
 
 import os
 from celery import Celery
+from kombu import Exchange, Queue
 
 # Set the default Django settings module
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
@@ -14,6 +31,59 @@ app = Celery('korean_eyewear')
 # Load configuration from Django settings with CELERY namespace
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
+
+QUEUE_NAMES = ['orders', 'notifications', 'media', 'media_video', 'media_bulk', 'maintenance', 'default']
+
+# Redis priorities: 0 is served first, 9 last (within one queue)
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 9
+
+TASK_ROUTES = {
+    'apps.orders.tasks.process_order_async': {'queue': 'orders', 'priority': PRIORITY_HIGH},
+    'apps.orders.tasks.process_refund_async': {'queue': 'orders', 'priority': PRIORITY_NORMAL},
+    'apps.orders.tasks.send_order_notification': {'queue': 'notifications', 'priority': PRIORITY_NORMAL},
+    'apps.orders.tasks.check_expired_orders': {'queue': 'maintenance'},
+    'apps.orders.tasks.auto_complete_delivered_orders': {'queue': 'maintenance'},
+    'apps.products.tasks.process_product_media': {'queue': 'media', 'priority': PRIORITY_NORMAL},
+    'apps.products.tasks.transcode_product_video': {'queue': 'media_video'},
+    'apps.products.tasks.reprocess_media_batch': {'queue': 'media_bulk', 'priority': PRIORITY_LOW},
+    'apps.products.tasks.flush_product_view_counts': {'queue': 'maintenance', 'priority': PRIORITY_HIGH},
+    'apps.products.tasks.build_related_products': {'queue': 'maintenance', 'priority': PRIORITY_LOW},
+    'apps.products.tasks.cleanup_old_media': {'queue': 'maintenance', 'priority': PRIORITY_LOW},
+    'apps.carts.tasks.reap_stock_reservations': {'queue': 'maintenance', 'priority': PRIORITY_LOW},
+}
+
+# Worker startup profiles (config/worker.py). Prefetch 1 wherever tasks are
+# long or latency matters, so a busy child never hoards queued work;
+# CPU-bound media workers stay at or below the core count.
+# Image workers use the threads pool: prefork children are daemonic and may
+# not fork, which would leave apps.products.imaging on its thread-pool
+# fallback; from the (non-daemonic) main process the encoders get a real
+# process pool, shared by the task threads.
+WORKER_PROFILES = {
+    'orders': {'queues': ['orders'], 'concurrency': 4, 'prefetch_multiplier': 1},
+    'notifications': {'queues': ['notifications'], 'concurrency': 4, 'prefetch_multiplier': 4},
+    'media': {'queues': ['media'], 'concurrency': 2, 'prefetch_multiplier': 1, 'pool': 'threads'},
+    'media_video': {'queues': ['media_video'], 'concurrency': 1, 'prefetch_multiplier': 1, 'max_tasks_per_child': 10},
+    'media_bulk': {'queues': ['media_bulk'], 'concurrency': 1, 'prefetch_multiplier': 1, 'pool': 'threads'},
+    'maintenance': {'queues': ['maintenance', 'default'], 'concurrency': 2, 'prefetch_multiplier': 1},
+}
+
+app.conf.update(
+    task_queues=[Queue(name, Exchange(name), routing_key=name) for name in QUEUE_NAMES],
+    task_default_queue='default',
+    task_routes=TASK_ROUTES,
+    task_default_priority=PRIORITY_NORMAL,
+    # Messages are only taken off the broker when a child is free to run them
+    worker_prefetch_multiplier=1,
+    broker_transport_options={
+        'priority_steps': list(range(10)),
+        'sep': ':',
+        'queue_order_strategy': 'priority',
+    },
+)
+
 # Auto-discover tasks from all installed apps
 app.autodiscover_tasks()
 
@@ -0,0 +1,22 @@
+"""
+Shared Redis client for data structures the cache API cannot express
+(hashes, atomic counters, locks)
+"""
+
+from django.conf import settings
+import redis
+
+_client = None
+
+
+def get_redis():
+    """Process-wide client on settings.REDIS_URL (connection pool is shared)"""
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(
+            settings.REDIS_URL,
+            socket_connect_timeout=0.5,
+            socket_timeout=0.5,
+            health_check_interval=30,
+        )
+    return _client
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 from decouple import config, Csv
+from celery.schedules import crontab
 import dj_database_url
 import os
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -164,6 +165,13 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Same as Django's defaults, but uploads are SHA-256 hashed while streaming
+# in (used to deduplicate product media)
+FILE_UPLOAD_HANDLERS = [
+    'apps.products.uploads.HashingMemoryFileUploadHandler',
+    'apps.products.uploads.HashingTemporaryFileUploadHandler',
+]
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -234,10 +242,12 @@ CSRF_USE_SESSIONS = False  # Use cookie-based CSRF
 # REDIS CACHE CONFIGURATION
 # ==============================================================================
 
+REDIS_URL = config('REDIS_URL', default='redis://127.0.0.1:6379/1')
+
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.redis.RedisCache',
-        'LOCATION': config('REDIS_URL', default='redis://127.0.0.1:6379/1'),
+        'LOCATION': REDIS_URL,
     }
 }
 
@@ -251,6 +261,15 @@ SESSION_COOKIE_SECURE = False  # False for HTTP localhost, True for HTTPS produc
 SESSION_COOKIE_HTTPONLY = True  # Prevent XSS attacks
 SESSION_COOKIE_AGE = 1209600  # 2 weeks in seconds
 
+# Guest carts live in Redis (apps.carts.storage) and expire with the session
+CART_GUEST_TTL = config('CART_GUEST_TTL', default=SESSION_COOKIE_AGE, cast=int)
+
+# Optional soft stock reservations (apps.carts.reservations): cart lines hold
+# their quantity for this many seconds after the last cart change, and other
+# shoppers can only add what is left (stock minus active reservations)
+CART_STOCK_RESERVATIONS = config('CART_STOCK_RESERVATIONS', default=False, cast=bool)
+CART_RESERVATION_TTL = config('CART_RESERVATION_TTL', default=15 * 60, cast=int)
+
 
 # ==============================================================================
 # CELERY CONFIGURATION
@@ -265,6 +284,47 @@ CELERY_TIMEZONE = TIME_ZONE
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60  # 30 minutes max per task
 
+# Product page views are counted in Redis and written to the DB in batches
+PRODUCT_VIEW_FLUSH_INTERVAL = config('PRODUCT_VIEW_FLUSH_INTERVAL', default=30, cast=int)
+
+# Bulk media rebuilds (reprocess_media) run on their own queue, consumed by
+# a dedicated worker: python -m config.worker media_bulk (see config/celery.py)
+PRODUCT_MEDIA_REPROCESS_QUEUE = config('PRODUCT_MEDIA_REPROCESS_QUEUE', default='media_bulk')
+
+# Video transcodes run on their own queue; each takes one of a fixed number
+# of slots per host (file locks), whatever the worker concurrency
+PRODUCT_VIDEO_QUEUE = config('PRODUCT_VIDEO_QUEUE', default='media_video')
+PRODUCT_VIDEO_MAX_TRANSCODES = config('PRODUCT_VIDEO_MAX_TRANSCODES', default=1, cast=int)
+# Seconds a video may wait for a free slot before it is marked failed
+PRODUCT_VIDEO_SLOT_WAIT = config('PRODUCT_VIDEO_SLOT_WAIT', default=2 * 60 * 60, cast=int)
+
+# Media workers read originals through the storage API; scratch space for
+# spooled originals / ffmpeg copies, and the largest original accepted
+PRODUCT_MEDIA_TEMP_DIR = config('PRODUCT_MEDIA_TEMP_DIR', default=None)
+PRODUCT_MEDIA_MAX_SOURCE_BYTES = config('PRODUCT_MEDIA_MAX_SOURCE_BYTES', default=2 * 1024 ** 3, cast=int)
+
+# Signed on-demand renditions (/media/r/...): largest side, renders at once
+# per web process, and whether to redirect to the storage URL (object
+# storage) instead of streaming the file through Django
+PRODUCT_RENDITION_MAX_SIZE = config('PRODUCT_RENDITION_MAX_SIZE', default=2400, cast=int)
+PRODUCT_RENDITION_MAX_RENDERS = config('PRODUCT_RENDITION_MAX_RENDERS', default=2, cast=int)
+PRODUCT_RENDITION_REDIRECT = config('PRODUCT_RENDITION_REDIRECT', default=False, cast=bool)
+
+CELERY_BEAT_SCHEDULE = {
+    'flush-product-view-counts': {
+        'task': 'apps.products.tasks.flush_product_view_counts',
+        'schedule': PRODUCT_VIEW_FLUSH_INTERVAL,
+    },
+    'build-related-products': {
+        'task': 'apps.products.tasks.build_related_products',
+        'schedule': crontab(hour=3, minute=0),
+    },
+    'reap-stock-reservations': {
+        'task': 'apps.carts.tasks.reap_stock_reservations',
+        'schedule': 60,
+    },
+}
+
 
 
 
@@ -15,9 +15,10 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from apps.products.views import rendition
 
 # Unregister TokenProxy model from admin to hide it from the admin interface
 # This must be done here (not in apps.py or admin.py) to ensure it runs
@@ -34,6 +35,11 @@ except Exception:
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('config.api_urls')),
+    # On-demand image renditions; nginx serves rendered ones before proxying
+    re_path(
+        r'^media/r/(?P<content_hash>[0-9a-f]{64})/(?P<width>[0-9]{2,4})x(?P<height>[0-9]{2,4})\.(?P<ext>avif|webp|jpg)$',
+        rendition, name='product-rendition',
+    ),
 ]
 
 # Serve media files in development
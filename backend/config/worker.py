@@ -0,0 +1,41 @@
+"""
+Start a Celery worker from a profile in config.celery.WORKER_PROFILES
+Usage: python -m config.worker <profile> [extra celery worker options]
+
+Extra options are passed through and win over the profile, e.g.
+`python -m config.worker media --concurrency 4`.
+"""
+
+import sys
+
+from config.celery import WORKER_PROFILES, app
+
+
+def build_argv(profile, extra=()):
+    """celery worker arguments for a profile"""
+    settings = WORKER_PROFILES[profile]
+    argv = [
+        'worker',
+        '--hostname', f'{profile}@%h',
+        '--queues', ','.join(settings['queues']),
+        '--concurrency', str(settings['concurrency']),
+        '--prefetch-multiplier', str(settings['prefetch_multiplier']),
+        '--loglevel', 'INFO',
+        # Hand tasks to idle children only, not round-robin to busy ones
+        '-O', 'fair',
+    ]
+    if settings.get('pool'):
+        argv += ['--pool', settings['pool']]
+    if settings.get('max_tasks_per_child'):
+        argv += ['--max-tasks-per-child', str(settings['max_tasks_per_child'])]
+    return argv + list(extra)
+
+
+def main(args):
+    if not args or args[0] not in WORKER_PROFILES:
+        sys.exit(f"Usage: python -m config.worker <{'|'.join(WORKER_PROFILES)}> [celery worker options]")
+    app.worker_main(build_argv(args[0], args[1:]))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
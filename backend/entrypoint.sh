@@ -10,6 +10,9 @@
 echo "Applying database migrations..."
 python manage.py migrate
 
+echo "Indexing products for search..."
+python manage.py rebuild_search_index --missing-only
+
 echo "Collecting static files..."
 python manage.py collectstatic --noinput
 
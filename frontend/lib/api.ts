@@ -68,6 +68,13 @@ export interface Product {
     base_price: string;
     price_range: { min: string; max: string } | null;
     thumbnail: string | null;
+    /** Render instantly: reserve width/height, paint dominant_color, blur placeholder (data URI) */
+    thumbnail_placeholder: {
+        width: number | null;
+        height: number | null;
+        dominant_color: string;
+        placeholder: string;
+    } | null;
     default_variant: ProductVariant | null;
     is_active: boolean;
     is_featured: boolean;
@@ -111,13 +118,26 @@ export interface ProductMedia {
     thumbnail_url: string | null;
     medium_url: string | null;
     large_url: string | null;
+    /** MIME type -> srcset ("url 300w, url 800w, ..."), smallest format first */
+    srcset: Record<string, string> | null;
+    /** Layout ("cart" | "card" | "zoom") -> MIME type -> signed on-demand rendition URL */
+    layout_urls: Record<string, Record<string, string>> | null;
+    width: number | null;
+    height: number | null;
+    dominant_color: string;
+    placeholder: string;
     alt_text: string;
     display_order: number;
 }
 
+/** Compact variant returned inside cart lines */
+export interface CartVariant extends ProductVariant {
+    thumbnail: string | null;
+}
+
 export interface CartItem {
     id: number;
-    variant: ProductVariant;
+    variant: CartVariant;
     quantity: number;
     total_price: string;
     product_name: string;
@@ -131,6 +151,17 @@ export interface Cart {
     subtotal: string;
 }
 
+export type CartBatchOperation =
+    | { op: "add"; variant_id: number; quantity?: number }
+    | { op: "update"; item_id: number; quantity: number }
+    | { op: "remove"; item_id: number };
+
+export interface CartBatchResponse {
+    cart: Cart;
+    /** One per operation, in order */
+    results: { op: CartBatchOperation["op"]; status: "ok" | "error"; error?: string }[];
+}
+
 export interface Order {
     id: number;
     order_number: string;
@@ -190,6 +221,10 @@ export const cartAPI = {
     clear: () =>
         api.post<Cart>("/cart/clear/"),
 
+    // Several add/update/remove operations in one request
+    batch: (operations: CartBatchOperation[]) =>
+        api.post<CartBatchResponse>("/cart/batch/", { operations }),
+
     // Check merge on login
     mergeCheck: (sessionKey: string) =>
         api.post("/cart/merge_check/", { session_key: sessionKey }),
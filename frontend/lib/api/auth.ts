@@ -20,6 +20,13 @@ export interface RegisterData {
     phone_number?: string;
 }
 
+export interface CartMergeConflict {
+    variant_id: number;
+    requested: number;
+    added: number;
+    reason: 'insufficient_stock' | 'cart_already_at_max_stock' | 'unavailable';
+}
+
 export interface AuthResponse {
     token: string;
     user: {
@@ -32,6 +39,8 @@ export interface AuthResponse {
         phone_number?: string;
         avatar?: string;
     };
+    // Login and register: guest cart lines that could not be merged in full
+    cart_merge_conflicts?: CartMergeConflict[];
     message: string;
 }
 
@@ -50,6 +59,8 @@ export async function login(credentials: LoginCredentials): Promise<AuthResponse
         headers: {
             'Content-Type': 'application/json',
         },
+        // Send the session cookie: the guest cart is merged during this request
+        credentials: 'include',
         body: JSON.stringify(credentials),
     });
 
@@ -70,6 +81,8 @@ export async function register(data: RegisterData): Promise<AuthResponse> {
         headers: {
             'Content-Type': 'application/json',
         },
+        // Send the session cookie: the guest cart is merged during this request
+        credentials: 'include',
         body: JSON.stringify(data),
     });
 